@@ -14,14 +14,143 @@ import json
 import re
 import os
 import sys
+import time
 from datetime import datetime
 from pathlib import Path
-import pdfplumber
 from dotenv import load_dotenv
 
+# Shared modules (telemetry, llm, config) live in the project root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import telemetry
+import llm
+import routing
+import incremental_mockup
+import schema_layout
+from checkpoints import JobCheckpoints, file_key
+from config import CHECKPOINTS_ENABLED, HTML_PREVIEW_INTERVAL, HTML_STREAM_ENABLED, MODEL_NAME, SCHEMA_LAYOUT_FIX
+from html_stream import HTMLStream
+from prompt_builder import build_prompt
+
 # Load environment variables
 load_dotenv()
 
+# Checkpointed steps of process_pdf_pipeline, in order
+PIPELINE_STAGES = ("extract", "analyze", "schema", "html", "save")
+
+# Prompt templates (str.format fields are fitted to the task's token budget by build_prompt)
+CLASSIFY_PROMPT_TEMPLATE = """
+Analyze the following BRD (Business Requirements Document) and determine the primary type of application it describes.
+
+Return only one of these categories:
+- "crm" (Customer Relationship Management)
+- "banking" (Digital Banking/Financial Services)
+- "insurance" (Insurance Management)
+- "ecommerce" (E-commerce/Online Shopping)
+- "healthcare" (Healthcare Management)
+- "education" (Learning Management System)
+- "hr" (Human Resources Management)
+- "inventory" (Inventory Management)
+- "project" (Project Management)
+- "generic" (Generic Business Application)
+
+BRD Content:
+{brd_text}
+"""
+
+SCHEMA_PROMPT_TEMPLATE = """
+You are an expert UI designer. Convert the following BRD into a JSON schema for a modern web application mockup.
+
+Application Type: {app_type}
+Focus Areas: {specific_instruction}
+
+IMPORTANT: Return ONLY valid JSON. Do not include any text before or after the JSON.
+
+Requirements:
+- Use an array of objects, each with type (frame, text, rectangle, button, etc.), x, y, width, height, and content/name as appropriate
+- For each text/button/icon, add a 'parent' property with the name of the rectangle/card/container it belongs to, or null if it is a top-level element
+- Group related UI elements (e.g., all fields in a card) under the same parent
+- Use generic field names and labels for all text and content, such as 'First Name', 'Last Name', 'Account Balance', 'Address Field', 'Date of Birth', etc. Do not use real or business-specific data
+- Include clickable buttons for main actions
+- Create a modern, responsive layout
+- Only return the JSON array, no explanation
+
+BRD:
+{brd_text}
+"""
+
+HTML_PROMPT_TEMPLATE = """
+Based on the following BRD content, generate a complete HTML mockup for a BUSINESS ANALYST DASHBOARD specifically designed for BUSINESS ANALYSTS working in FINTECH companies.
+{brd_section}{components_section}
+BUSINESS ANALYST REQUIREMENTS:
+1. Create a BUSINESS ANALYST DASHBOARD (not customer-facing interface)
+2. Show CUSTOMER ANALYTICS and INSIGHTS from analyst perspective
+3. Include CUSTOMER PROFILES with detailed information
+4. Display CUSTOMER SEGMENTATION and ANALYSIS
+5. Show BUSINESS METRICS and KPIs
+6. Include CUSTOMER BEHAVIOR PATTERNS
+7. Display FINANCIAL ANALYSIS and TRENDS
+8. Show CUSTOMER INTERACTION HISTORY
+9. Include RISK ASSESSMENT and COMPLIANCE data
+10. Display CUSTOMER SATISFACTION metrics
+
+CURRENCY AND CONTEXT REQUIREMENTS:
+1. Use RUPEES (Rs.) instead of dollars - format as "Rs. 1,25,000" (with commas at thousands)
+2. Include BANKING CONTEXT: Central Bank regulations, local banks, etc.
+3. Use INTERNATIONAL BUSINESS TERMINOLOGY: "Account", "Transaction", "Banking Service"
+4. Use NEPALI NAMES: Common names like Sita, Ram, Gita, Hari, etc.
+5. Include NEPALI LOCATIONS: Kathmandu, Pokhara, Biratnagar, Lalitpur, etc.
+6. Use NEPALI CURRENCY FORMAT: Rs. 1,00,000 (not $100,000)
+7. Include INTERNATIONAL BUSINESS PRACTICES: Standard business hours, calendar references
+
+DASHBOARD FEATURES:
+1. Customer Overview Cards with key metrics
+2. Customer Segmentation Analysis
+3. Financial Performance Charts
+4. Customer Behavior Analytics
+5. Risk Assessment Dashboard
+6. Compliance Monitoring
+7. Customer Interaction Timeline
+8. Business Intelligence Reports
+9. Data Export and Filtering
+10. Real-time Analytics
+
+TECHNICAL REQUIREMENTS:
+1. Generate the ENTIRE HTML structure from scratch - no predefined templates
+2. Include modern CSS styling with gradients, shadows, and responsive design
+3. Create interactive JavaScript for buttons, search, and data filtering
+4. Use content that reflects the actual BRD requirements
+5. Include charts, graphs, and data visualization elements
+6. Make it professional and modern looking
+7. Include clickable buttons with hover effects
+8. Use a color scheme appropriate for business analytics
+9. Use ONLY ENGLISH LANGUAGE throughout the interface
+
+Return ONLY the complete HTML document. Do not include any explanations or markdown.
+"""
+
+FRAGMENT_PROMPT_TEMPLATE = """
+You are updating parts of an existing HTML mockup for a {app_type} application because its BRD was edited. The rest of the page stays as it is.
+
+Regenerate ONLY the components below. Each comes with its UI schema (the component and the elements inside it) and, if it existed before, its previous HTML.
+{components}
+
+IMPORTANT:
+- Return ONLY a JSON object mapping each component name above to its HTML fragment, e.g. {{"Main Card": "<div data-component=\\"Main Card\\">...</div>"}}
+- The outermost element of each fragment carries data-component="<component name>", and each schema element inside it gets its own data-component attribute
+- Reuse the class names of the existing page styles below so the fragments match the rest of the page; do not output <html>, <head>, <style> or <script> tags
+- Keep the page's content conventions: ONLY ENGLISH text, Nepali names and locations, amounts formatted as "Rs. 1,25,000"
+
+Existing page styles:
+{styles}
+
+BRD Content (for reference):
+{brd_text}
+"""
+
+def page_block(number, page_text):
+    """One page of extracted BRD text, as it appears in the text sent to the model"""
+    return f"--- Page {number} ---\n{page_text or '[No text content]'}"
+
 class EnhancedBRDAgent:
     def __init__(self):
         # Check for Gemini AI availability
@@ -34,8 +163,9 @@ class EnhancedBRDAgent:
                 self.client = None
                 return
             
-            # Set up Gemini model using environment variable
-            self.client = genai.GenerativeModel("gemini-2.5-flash")
+            # Set up Gemini model using environment variable. Individual calls are
+            # routed per task (config.MODEL_ROUTES); the client marks Gemini as available.
+            self.client = routing.get_model(MODEL_NAME)
             print("✓ Gemini AI client initialized")
         except ImportError:
             print("Google Generative AI not available. Install with: pip install google-generativeai")
@@ -51,57 +181,127 @@ class EnhancedBRDAgent:
         """Extract text content from PDF file"""
         try:
             print(f"Reading PDF: {pdf_path}")
-            with pdfplumber.open(pdf_path) as pdf:
+            with telemetry.span("agent.extract_pdf") as extract_span:
                 text_content = []
-                for i, page in enumerate(pdf.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_content.append(f"--- Page {i+1} ---\n{page_text}")
-                    else:
-                        text_content.append(f"--- Page {i+1} ---\n[No text content]")
+                pages = 0
+                for number, pages, page_text in self.iter_pdf_pages(pdf_path):
+                    text_content.append(page_block(number, page_text))
                 
                 full_text = "\n\n".join(text_content)
-                print(f"✓ Extracted {len(full_text)} characters from {len(pdf.pages)} pages")
+                extract_span.set(pages=pages, chars=len(full_text))
+                print(f"✓ Extracted {len(full_text)} characters from {pages} pages")
                 return full_text
         except Exception as e:
             print(f"✗ Error reading PDF: {e}")
             return None
+
+    def iter_pdf_pages(self, pdf_source):
+        """Yield (page number, page count, text) one page at a time; pdf_source is a path or file object"""
+        import pdfplumber  # Only PDF ingest needs it
+
+        with pdfplumber.open(pdf_source) as pdf:
+            total = len(pdf.pages)
+            for i, page in enumerate(pdf.pages):
+                page_text = page.extract_text() or ""
+                page.close()  # Drop the page's parsed layout before reading the next one
+                yield i + 1, total, page_text
     
+    def _classify_prompt(self, brd_text):
+        return build_prompt("classify", CLASSIFY_PROMPT_TEMPLATE, brd_text=brd_text)
+
+    def _parse_app_type(self, response):
+        app_type = response.text.strip().lower()
+        print(f"✓ Detected application type: {app_type}")
+        return app_type
+
     def analyze_brd_content(self, brd_text):
         """Analyze BRD content to determine the type of application"""
+        return self._classify(brd_text)[0]
+
+    def _classify(self, brd_text):
+        """(app type, whether it is the "generic" default because classification failed)"""
+        if not self.client:
+            print("✗ Gemini client not available")
+            return "generic", True
+        
+        try:
+            response = llm.generate("classify", self._classify_prompt(brd_text))
+            return self._parse_app_type(response), False
+        except Exception as e:
+            print(f"✗ Error analyzing BRD content: {e}")
+            return "generic", True
+
+    async def analyze_brd_content_async(self, brd_text):
+        """Async variant of analyze_brd_content"""
         if not self.client:
             print("✗ Gemini client not available")
             return "generic"
         
         try:
-            prompt = f"""
-            Analyze the following BRD (Business Requirements Document) and determine the primary type of application it describes.
-            
-            Return only one of these categories:
-            - "crm" (Customer Relationship Management)
-            - "banking" (Digital Banking/Financial Services)
-            - "insurance" (Insurance Management)
-            - "ecommerce" (E-commerce/Online Shopping)
-            - "healthcare" (Healthcare Management)
-            - "education" (Learning Management System)
-            - "hr" (Human Resources Management)
-            - "inventory" (Inventory Management)
-            - "project" (Project Management)
-            - "generic" (Generic Business Application)
-            
-            BRD Content:
-            {brd_text[:2000]}...
-            """
-            
-            response = self.client.generate_content(prompt)
-            
-            app_type = response.text.strip().lower()
-            print(f"✓ Detected application type: {app_type}")
-            return app_type
+            response = await llm.generate_async("classify", self._classify_prompt(brd_text))
+            return self._parse_app_type(response)
         except Exception as e:
             print(f"✗ Error analyzing BRD content: {e}")
             return "generic"
     
+    def _schema_prompt(self, brd_text, app_type):
+        # Enhanced prompt based on application type
+        type_specific_instructions = {
+            "crm": "Focus on customer profiles, contact management, sales opportunities, and customer service features.",
+            "banking": "Include account management, transactions, payments, and financial services features.",
+            "insurance": "Include policy management, claims processing, and premium calculations.",
+            "ecommerce": "Include product catalogs, shopping carts, order management, and payment processing.",
+            "healthcare": "Include patient records, appointment scheduling, and medical information management.",
+            "education": "Include course management, student records, and learning materials.",
+            "hr": "Include employee records, payroll, and performance management.",
+            "inventory": "Include stock management, product tracking, and warehouse operations.",
+            "project": "Include task management, timelines, and team collaboration.",
+            "generic": "Create a general business application interface."
+        }
+        
+        specific_instruction = type_specific_instructions.get(app_type, type_specific_instructions["generic"])
+        
+        return build_prompt(
+            "schema", SCHEMA_PROMPT_TEMPLATE, priorities={"specific_instruction": 1},
+            app_type=app_type.upper(), specific_instruction=specific_instruction, brd_text=brd_text,
+        )
+
+    def _parse_schema(self, response, app_type):
+        # Try to parse the response directly first
+        try:
+            schema = json.loads(response.text.strip())
+            print(f"✓ Generated UI schema with {len(schema)} elements")
+            return self._check_layout(schema)
+        except json.JSONDecodeError:
+            # Try to extract JSON using regex
+            match = re.search(r'\[.*\]', response.text, re.DOTALL)
+            if match:
+                try:
+                    schema = json.loads(match.group(0))
+                    print(f"✓ Extracted UI schema with {len(schema)} elements")
+                    return self._check_layout(schema)
+                except json.JSONDecodeError:
+                    pass
+            
+            print("✗ Could not parse AI-generated JSON, using fallback schema")
+            return self._generate_fallback_schema(app_type)
+
+    def _check_layout(self, schema):
+        """Repair overlapping, misplaced and orphaned elements of a generated schema"""
+        if not SCHEMA_LAYOUT_FIX:
+            return schema
+        with telemetry.span("agent.schema_layout", elements=len(schema)) as layout_span:
+            try:
+                fixed, summary = schema_layout.auto_layout(schema)
+            except (TypeError, ValueError) as e:
+                print(f"⚠️ Skipped the schema layout check: {e}")
+                return schema
+            layout_span.set(issues=summary["issues_before"], remaining=summary["issues_after"])
+        if summary["issues_before"]:
+            print(f"📐 Fixed {summary['issues_before'] - summary['issues_after']} of "
+                  f"{summary['issues_before']} layout issue(s) in the UI schema")
+        return fixed
+
     def generate_ui_schema(self, brd_text, app_type="generic"):
         """Generate UI schema from BRD text"""
         if not self.client:
@@ -109,73 +309,20 @@ class EnhancedBRDAgent:
             return None
         
         try:
-            # Enhanced prompt based on application type
-            type_specific_instructions = {
-                "crm": "Focus on customer profiles, contact management, sales opportunities, and customer service features.",
-                "banking": "Include account management, transactions, payments, and financial services features.",
-                "insurance": "Include policy management, claims processing, and premium calculations.",
-                "ecommerce": "Include product catalogs, shopping carts, order management, and payment processing.",
-                "healthcare": "Include patient records, appointment scheduling, and medical information management.",
-                "education": "Include course management, student records, and learning materials.",
-                "hr": "Include employee records, payroll, and performance management.",
-                "inventory": "Include stock management, product tracking, and warehouse operations.",
-                "project": "Include task management, timelines, and team collaboration.",
-                "generic": "Create a general business application interface."
-            }
-            
-            specific_instruction = type_specific_instructions.get(app_type, type_specific_instructions["generic"])
-            
-            prompt = f"""
-            You are an expert UI designer. Convert the following BRD into a JSON schema for a modern web application mockup.
-            
-            Application Type: {app_type.upper()}
-            Focus Areas: {specific_instruction}
-            
-            IMPORTANT: Return ONLY valid JSON. Do not include any text before or after the JSON.
-            
-            Requirements:
-            - Use an array of objects, each with type (frame, text, rectangle, button, etc.), x, y, width, height, and content/name as appropriate
-            - For each text/button/icon, add a 'parent' property with the name of the rectangle/card/container it belongs to, or null if it is a top-level element
-            - Group related UI elements (e.g., all fields in a card) under the same parent
-            - Use generic field names and labels for all text and content, such as 'First Name', 'Last Name', 'Account Balance', 'Address Field', 'Date of Birth', etc. Do not use real or business-specific data
-            - Include clickable buttons for main actions
-            - Create a modern, responsive layout
-            - Only return the JSON array, no explanation
-
-            BRD:
-            {brd_text}
-            """
-            
             print("Generating UI schema...")
-            response = self.client.generate_content(prompt)
-            
-            # Try to parse the response directly first
-            try:
-                schema = json.loads(response.text.strip())
-                print(f"✓ Generated UI schema with {len(schema)} elements")
-                return schema
-            except json.JSONDecodeError:
-                # Try to extract JSON using regex
-                match = re.search(r'\[.*\]', response.text, re.DOTALL)
-                if match:
-                    try:
-                        schema = json.loads(match.group(0))
-                        print(f"✓ Extracted UI schema with {len(schema)} elements")
-                        return schema
-                    except json.JSONDecodeError:
-                        pass
-                
-                print("✗ Could not parse AI-generated JSON, using fallback schema")
-                return self._generate_fallback_schema(app_type)
+            response = llm.generate("schema", self._schema_prompt(brd_text, app_type))
+            return self._parse_schema(response, app_type)
         except Exception as e:
             print(f"✗ Error generating UI schema: {e}")
             print("Using fallback schema...")
             return self._generate_fallback_schema(app_type)
-    
+
     def _generate_fallback_schema(self, app_type):
         """Generate a fallback schema when AI generation fails"""
         print(f"Generating fallback schema for {app_type} application...")
-        
+        return self._fallback_schema(app_type)
+
+    def _fallback_schema(self, app_type):
         if app_type == "crm":
             return [
                 {"type": "frame", "name": "CRM Dashboard", "x": 0, "y": 0, "width": 1440, "height": 900},
@@ -212,15 +359,18 @@ class EnhancedBRDAgent:
                 {"type": "button", "name": "Action 2", "x": 160, "y": 150, "width": 120, "height": 30, "content": "Action 2", "parent": "Main Card"}
             ]
 
-    def convert_schema_to_html(self, schema, app_type="generic", brd_text=None):
-        """Convert UI schema to completely dynamic HTML mockup from BRD"""
+    def convert_schema_to_html(self, schema, app_type="generic", brd_text=None, on_html=None):
+        """Convert UI schema to completely dynamic HTML mockup from BRD.
+
+        on_html(html) receives previews of the page while it streams in.
+        """
         if not schema:
             print("✗ No schema provided")
             return None
         
         try:
             # Generate completely dynamic HTML based on BRD analysis
-            html_content = self._generate_dynamic_html_from_brd(app_type, brd_text)
+            html_content = self._generate_dynamic_html_from_brd(app_type, brd_text, on_html, schema)
             
             print(f"✓ Generated completely dynamic HTML mockup for {app_type} application")
             return html_content
@@ -228,7 +378,77 @@ class EnhancedBRDAgent:
             print(f"✗ Error converting schema to HTML: {e}")
             return None
 
-    def _generate_dynamic_html_from_brd(self, app_type, brd_text=None):
+    def _html_prompt(self, brd_text=None, schema=None):
+        brd_section = f"\n\nBRD Content (for reference):\n{brd_text}\n" if brd_text else ""
+        # The markers let a later version of the mockup replace single components (see incremental_mockup.py)
+        components_section = ""
+        if schema:
+            lines = [
+                f"- {element.get('name')}" + (f" (inside {element['parent']})" if element.get("parent") else "")
+                for element in schema if isinstance(element, dict) and element.get("name")
+            ]
+            components_section = (
+                "\nUI COMPONENTS (from the UI schema, build the page from these):\n" + "\n".join(lines) +
+                f"\nMark the outermost element of each component with {incremental_mockup.MARKER}=\"<component name>\" "
+                "(the exact name), nested as listed.\n"
+            )
+        # The BRD is trimmed before the component list
+        return build_prompt(
+            "mockup_html", HTML_PROMPT_TEMPLATE, priorities={"components_section": 1},
+            brd_section=brd_section, components_section=components_section,
+        )
+
+    def _parse_html(self, response, app_type):
+        if not response or not response.text:
+            print("✗ Empty response from Gemini AI")
+            return self._get_fallback_html(app_type)
+        
+        html_content = response.text.strip()
+        print(f"📥 Received response of {len(html_content)} characters")
+        
+        # Clean up the response to ensure it's valid HTML
+        if html_content.startswith('```html'):
+            html_content = html_content[7:]
+        if html_content.endswith('```'):
+            html_content = html_content[:-3]
+        return self._accept_html(html_content, app_type)
+
+    def _html_reader(self, stream, on_html=None):
+        """on_text callback for llm.generate_stream: parse, preview, and stop reading a non-HTML reply"""
+        last_preview = [0.0]
+
+        def on_text(chunk):
+            if chunk is None:  # The call was retried: the page starts over
+                stream.reset_stream()
+                return True
+            stream.feed(chunk)
+            if stream.rejected:
+                return False
+            now = time.monotonic()
+            if on_html is not None and now - last_preview[0] >= HTML_PREVIEW_INTERVAL:
+                preview = stream.preview()
+                if preview:
+                    last_preview[0] = now
+                    on_html(preview)
+            return True
+        return on_text
+
+    def _parse_html_stream(self, stream, app_type):
+        if stream.rejected:
+            print(f"✗ Stopped reading the response after {stream.received} characters: {stream.rejected}")
+            return self._get_fallback_html(app_type)
+        print(f"📥 Received response of {stream.received} characters ({stream.elements} elements)")
+        return self._accept_html(stream.html, app_type)
+
+    def _accept_html(self, html_content, app_type):
+        if len(html_content) < 100:
+            print("✗ Response too short, likely an error message")
+            return self._get_fallback_html(app_type)
+        
+        print("✓ Generated completely dynamic HTML from BRD")
+        return html_content
+
+    def _generate_dynamic_html_from_brd(self, app_type, brd_text=None, on_html=None, schema=None):
         """Generate completely dynamic HTML from BRD analysis"""
         if not self.client:
             print("✗ No Gemini client available, using fallback HTML")
@@ -236,85 +456,98 @@ class EnhancedBRDAgent:
         
         try:
             print(f"🔍 Generating dynamic HTML for app type: {app_type}")
-            brd_section = f"\n\nBRD Content (for reference):\n{brd_text[:4000]}\n" if brd_text else ""
-            prompt = f"""
-            Based on the following BRD content, generate a complete HTML mockup for a BUSINESS ANALYST DASHBOARD specifically designed for BUSINESS ANALYSTS working in FINTECH companies.
-            {brd_section}
-            BUSINESS ANALYST REQUIREMENTS:
-            1. Create a BUSINESS ANALYST DASHBOARD (not customer-facing interface)
-            2. Show CUSTOMER ANALYTICS and INSIGHTS from analyst perspective
-            3. Include CUSTOMER PROFILES with detailed information
-            4. Display CUSTOMER SEGMENTATION and ANALYSIS
-            5. Show BUSINESS METRICS and KPIs
-            6. Include CUSTOMER BEHAVIOR PATTERNS
-            7. Display FINANCIAL ANALYSIS and TRENDS
-            8. Show CUSTOMER INTERACTION HISTORY
-            9. Include RISK ASSESSMENT and COMPLIANCE data
-            10. Display CUSTOMER SATISFACTION metrics
-            
-            CURRENCY AND CONTEXT REQUIREMENTS:
-            1. Use RUPEES (Rs.) instead of dollars - format as "Rs. 1,25,000" (with commas at thousands)
-            2. Include BANKING CONTEXT: Central Bank regulations, local banks, etc.
-            3. Use INTERNATIONAL BUSINESS TERMINOLOGY: "Account", "Transaction", "Banking Service"
-            4. Use NEPALI NAMES: Common names like Sita, Ram, Gita, Hari, etc.
-            5. Include NEPALI LOCATIONS: Kathmandu, Pokhara, Biratnagar, Lalitpur, etc.
-            6. Use NEPALI CURRENCY FORMAT: Rs. 1,00,000 (not $100,000)
-            7. Include INTERNATIONAL BUSINESS PRACTICES: Standard business hours, calendar references
-            
-            DASHBOARD FEATURES:
-            1. Customer Overview Cards with key metrics
-            2. Customer Segmentation Analysis
-            3. Financial Performance Charts
-            4. Customer Behavior Analytics
-            5. Risk Assessment Dashboard
-            6. Compliance Monitoring
-            7. Customer Interaction Timeline
-            8. Business Intelligence Reports
-            9. Data Export and Filtering
-            10. Real-time Analytics
-            
-            TECHNICAL REQUIREMENTS:
-            1. Generate the ENTIRE HTML structure from scratch - no predefined templates
-            2. Include modern CSS styling with gradients, shadows, and responsive design
-            3. Create interactive JavaScript for buttons, search, and data filtering
-            4. Use content that reflects the actual BRD requirements
-            5. Include charts, graphs, and data visualization elements
-            6. Make it professional and modern looking
-            7. Include clickable buttons with hover effects
-            8. Use a color scheme appropriate for business analytics
-            9. Use ONLY ENGLISH LANGUAGE throughout the interface
-            
-            Return ONLY the complete HTML document. Do not include any explanations or markdown.
-            """
-            
+            prompt = self._html_prompt(brd_text, schema)
+            if HTML_STREAM_ENABLED:
+                print("📤 Streaming response from Gemini AI...")
+                stream = HTMLStream()
+                llm.generate_stream("mockup_html", prompt, self._html_reader(stream, on_html))
+                return self._parse_html_stream(stream, app_type)
             print("📤 Sending request to Gemini AI...")
-            response = self.client.generate_content(prompt)
-            
-            if not response or not response.text:
-                print("✗ Empty response from Gemini AI")
-                return self._get_fallback_html(app_type)
-            
-            html_content = response.text.strip()
-            print(f"📥 Received response of {len(html_content)} characters")
-            
-            # Clean up the response to ensure it's valid HTML
-            if html_content.startswith('```html'):
-                html_content = html_content[7:]
-            if html_content.endswith('```'):
-                html_content = html_content[:-3]
-            
-            if len(html_content) < 100:
-                print("✗ Response too short, likely an error message")
-                return self._get_fallback_html(app_type)
-            
-            print("✓ Generated completely dynamic HTML from BRD")
-            return html_content
-                
+            response = llm.generate("mockup_html", prompt)
+            return self._parse_html(response, app_type)
         except Exception as e:
             print(f"✗ Error generating dynamic HTML: {e}")
             print(f"✗ Error type: {type(e).__name__}")
             return self._get_fallback_html(app_type)
-    
+
+    def _fragment_prompt(self, planned, previous_html, schema, app_type, brd_text=None):
+        blocks = []
+        for root in planned["roots"]:
+            name = root.get("name")
+            block = f"\n### Component: {name}\nSchema:\n{json.dumps(incremental_mockup.subtree(schema, root))}\n"
+            if name in planned["spans"]:
+                start, end, _ = planned["spans"][name]
+                block += f"Previous HTML:\n{previous_html[start:end]}\n"
+            elif root.get("parent"):
+                block += f"New component, placed at the end of {root['parent']}\n"
+            else:
+                block += "New top-level component, placed at the end of the page\n"
+            blocks.append(block)
+        # The BRD is trimmed first, then the styles
+        return build_prompt(
+            "mockup_fragments", FRAGMENT_PROMPT_TEMPLATE, priorities={"components": 2, "styles": 1, "app_type": 2},
+            app_type=app_type.upper(), components="".join(blocks),
+            styles=incremental_mockup.page_styles(previous_html) or "(none)", brd_text=brd_text or "(not available)",
+        )
+
+    def _plan_update(self, previous, schema, app_type, brd_text):
+        """(planned, fragment prompt or None) for update_mockup_html"""
+        planned = incremental_mockup.plan(previous.get("schema"), previous.get("html"), schema)
+        if planned["mode"] == "splice" and planned["roots"]:
+            if not self.client:
+                planned.update(mode="full", reason="no Gemini client")
+            else:
+                return planned, self._fragment_prompt(planned, previous["html"], schema, app_type, brd_text)
+        return planned, None
+
+    def _finish_update(self, previous, planned, text, update_span):
+        """(html or None, summary) for update_mockup_html, given the fragment reply text"""
+        html_content = None
+        if planned["mode"] == "reuse":
+            html_content = previous["html"]
+        elif planned["mode"] == "splice":
+            names = [root.get("name") for root in planned["roots"]]
+            fragments = incremental_mockup.parse_fragments(text, names) if names else {}
+            if fragments is None:
+                planned.update(mode="full", reason="the model did not return every component")
+            else:
+                html_content = incremental_mockup.splice(previous["html"], planned, fragments)
+        summary = incremental_mockup.summary(planned)
+        update_span.set(**{key: value for key, value in summary.items() if key != "reason"})
+        update_span.cache_hit = planned["mode"] == "reuse"
+        version = previous.get("version") or "?"
+        if html_content is None:
+            print(f"🧩 Regenerating the whole mockup: {summary['reason']}")
+        elif planned["mode"] == "reuse":
+            print(f"🧩 The UI schema did not change, reusing version {version} of the mockup")
+        else:
+            print(
+                f"🧩 Reused {summary['reused']} component(s) of version {version}, "
+                f"regenerated {summary['requested']} subtree(s) ({summary['changed']} changed, "
+                f"{summary['added']} added), removed {summary['removed']}"
+            )
+        return html_content, summary
+
+    def update_mockup_html(self, previous, schema, app_type="generic", brd_text=None):
+        """HTML for schema built from a previous version of the mockup.
+
+        previous is a stored mockup ({"schema", "html", "version", ...}). Only
+        the components that changed are regenerated and spliced into the
+        previous page. Returns (html, summary); html is None when the page has
+        to be generated in full (summary["reason"] says why).
+        """
+        with telemetry.span("mockup.incremental") as update_span:
+            planned, prompt = self._plan_update(previous, schema, app_type, brd_text)
+            text = None
+            if prompt:
+                try:
+                    print("📤 Requesting the changed components from Gemini AI...")
+                    response = llm.generate("mockup_fragments", prompt)
+                    text = response.text if response else None
+                except Exception as e:
+                    print(f"✗ Error regenerating mockup components: {e}")
+            return self._finish_update(previous, planned, text, update_span)
+
     def _get_fallback_html(self, app_type):
         """Get fallback HTML when AI generation fails"""
         return f"""<!DOCTYPE html>
@@ -437,6 +670,37 @@ class EnhancedBRDAgent:
 </body>
 </html>"""
     
+    def generate_mockup(self, brd_text, should_cancel=None, app_type=None, on_html=None, previous=None):
+        """BRD text → app type → UI schema → HTML mockup (without saving).
+
+        should_cancel() is checked between steps; a cancelled run returns the
+        steps that finished, with "cancelled": True. A known app_type (e.g.
+        classified while a PDF was still being read) skips the classification.
+        on_html(html) receives previews of the page while it streams in.
+        With a previous version of the mockup (a stored mockup) only the
+        changed components are regenerated; the result's "incremental" holds
+        the diff summary and "previous_id" the version it was derived from.
+        """
+        cancelled = should_cancel or (lambda: False)
+        app_type = app_type or self.analyze_brd_content(brd_text)
+        if cancelled():
+            return self._mockup_result(app_type, cancelled=True)
+        schema = self.generate_ui_schema(brd_text, app_type)
+        if not schema or cancelled():
+            return self._mockup_result(app_type, schema, cancelled=cancelled())
+        html_content, incremental = None, None
+        if previous:
+            html_content, incremental = self.update_mockup_html(previous, schema, app_type, brd_text)
+        if html_content is None:
+            html_content = self.convert_schema_to_html(schema, app_type, brd_text, on_html)
+        return self._mockup_result(app_type, schema, html_content, cancelled(), previous, incremental)
+
+    def _mockup_result(self, app_type, schema=None, html_content=None, cancelled=False, previous=None, incremental=None):
+        return {
+            "app_type": app_type, "schema": schema, "html": html_content, "cancelled": cancelled,
+            "previous_id": previous.get("id") if previous else None, "incremental": incremental,
+        }
+
     def save_outputs(self, schema, html_content, app_type, timestamp):
         """Save all outputs to files"""
         try:
@@ -478,41 +742,98 @@ class EnhancedBRDAgent:
                 'html': html_content if html_content else self._get_fallback_html(app_type)
             }
     
-    def process_pdf_pipeline(self, pdf_path):
-        """Complete pipeline: PDF → Schema → HTML → Save"""
+    def process_pdf_pipeline(self, pdf_path, rerun=None):
+        """Complete pipeline: PDF → Schema → HTML → Save.
+
+        Every step is checkpointed per PDF content (see checkpoints.py), so a
+        rerun resumes after the last successful step. rerun="html" (or any
+        other PIPELINE_STAGES name) runs that step and the ones after it again.
+        """
+        with telemetry.span("agent.pipeline"):
+            return self._run_pdf_pipeline(pdf_path, rerun)
+
+    def _pipeline_checkpoints(self, pdf_path, rerun):
+        if rerun is not None and rerun not in PIPELINE_STAGES:
+            raise ValueError(f"Unknown pipeline step {rerun!r}; expected one of {', '.join(PIPELINE_STAGES)}")
+        if not CHECKPOINTS_ENABLED:
+            return None
+        try:
+            job = JobCheckpoints(file_key(pdf_path), PIPELINE_STAGES)
+        except OSError:
+            return None  # Unreadable PDF; the extract step reports it
+        if rerun:
+            job.invalidate(rerun)
+        return job
+
+    def _pipeline_step(self, job, stage, run, reusable=None):
+        """Output of one pipeline step, from its checkpoint or from run() -> (value, is fallback).
+
+        Fallback outputs are checkpointed as such and run again next time;
+        reusable(value) can reject a checkpoint whose output is gone.
+        """
+        with telemetry.span(f"agent.step.{stage}") as step_span:
+            record = job.get(stage) if job is not None else None
+            if record is not None and not record["fallback"] and (reusable is None or reusable(record["value"])):
+                step_span.cache_hit = True
+                print(f"↩️ Resumed from checkpoint ({stage})")
+                return record["value"]
+            value, fallback = run()
+        if value and job is not None:
+            try:
+                job.save(stage, value, fallback)
+            except (OSError, TypeError) as e:
+                print(f"⚠️ Could not checkpoint step {stage}: {e}")
+        return value
+
+    def _schema_step(self, brd_text, app_type):
+        schema = self.generate_ui_schema(brd_text, app_type)
+        return schema, schema == self._fallback_schema(app_type)
+
+    def _html_step(self, schema, app_type, brd_text):
+        html_content = self.convert_schema_to_html(schema, app_type, brd_text)
+        return html_content, html_content == self._get_fallback_html(app_type)
+
+    def _save_step(self, schema, html_content, app_type):
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return self.save_outputs(schema, html_content, app_type, timestamp), False
+
+    def _run_pdf_pipeline(self, pdf_path, rerun=None):
         print("=" * 60)
         print("Enhanced BRD Agent - Complete Pipeline")
         print("=" * 60)
+        job = self._pipeline_checkpoints(pdf_path, rerun)
         
         # Step 1: Extract text from PDF
         print("\n📄 Step 1: Extracting text from PDF...")
-        brd_text = self.extract_text_from_pdf(pdf_path)
+        brd_text = self._pipeline_step(job, "extract", lambda: (self.extract_text_from_pdf(pdf_path), False))
         if not brd_text:
             print("✗ Failed to extract text from PDF")
             return None
         
         # Step 2: Analyze BRD content
         print("\n🔍 Step 2: Analyzing BRD content...")
-        app_type = self.analyze_brd_content(brd_text)
+        app_type = self._pipeline_step(job, "analyze", lambda: self._classify(brd_text))
         
         # Step 3: Generate UI schema
         print("\n🎨 Step 3: Generating UI schema...")
-        schema = self.generate_ui_schema(brd_text, app_type)
+        schema = self._pipeline_step(job, "schema", lambda: self._schema_step(brd_text, app_type))
         if not schema:
             print("✗ Failed to generate UI schema")
             return None
         
         # Step 4: Convert to HTML
         print("\n🌐 Step 4: Converting to HTML mockup...")
-        html_content = self.convert_schema_to_html(schema, app_type, brd_text)
+        html_content = self._pipeline_step(job, "html", lambda: self._html_step(schema, app_type, brd_text))
         if not html_content:
             print("✗ Failed to convert schema to HTML")
             return None
         
-        # Step 5: Save outputs
+        # Step 5: Save outputs (checkpointed while the saved files exist)
         print("\n💾 Step 5: Saving outputs...")
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        outputs = self.save_outputs(schema, html_content, app_type, timestamp)
+        outputs = self._pipeline_step(
+            job, "save", lambda: self._save_step(schema, html_content, app_type),
+            reusable=lambda saved: all(path and os.path.exists(path) for path in saved.values()),
+        )
         
         print("\n" + "=" * 60)
         print("✅ Pipeline completed successfully!")
@@ -0,0 +1,120 @@
+"""
+Streaming HTML Mockups
+======================
+
+The mockup HTML arrives from the model in chunks (llm.generate_stream).
+HTMLStream feeds them to an incremental parser (html.parser) as they come and
+keeps two things up to date:
+
+- a preview: the document up to the last complete tag or text run, with the
+  elements still open closed again, so the live preview never shows half a
+  tag or a half-received <style> or <script>
+- whether the reply is HTML at all: an apology, an error message or a
+  Markdown answer has no tag within its first HTML_STREAM_SNIFF_CHARS
+  characters, and the caller stops reading it and uses the fallback page
+  instead of paying for the whole response
+
+Markdown code fences (```html ... ```) and any text before the first tag are
+dropped from the document.
+"""
+
+import re
+import sys
+from html.parser import HTMLParser
+from pathlib import Path
+
+# config lives in the project root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from config import HTML_STREAM_SNIFF_CHARS
+
+FENCE = "```"
+VOID_ELEMENTS = frozenset((
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr",
+))
+_TAG_RE = re.compile(r"<(?:!doctype|!--|[a-z])", re.IGNORECASE)
+
+
+class HTMLStream(HTMLParser):
+    """Incrementally parsed HTML reply; feed() it chunks, read .html, .preview() and .rejected"""
+
+    def __init__(self, sniff_chars=HTML_STREAM_SNIFF_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.sniff_chars = sniff_chars
+        self.reset_stream()
+
+    def reset_stream(self):
+        """Forget everything received (the model call restarted)"""
+        self.reset()
+        self.received = 0
+        self.rejected = None
+        self.ended = False  # A closing code fence: anything after it is not part of the page
+        self.elements = 0
+        self._preface = ""
+        self._parts = []
+        self._held = ""  # Trailing backticks that may start a closing fence
+        self._open = []
+        self._body = False
+        self._line = 1  # The parser's line (getpos()) and where it starts in the fed text
+        self._line_start = 0
+
+    @property
+    def started(self):
+        return bool(self._parts)
+
+    @property
+    def html(self):
+        """The page received so far (without fences or preface)"""
+        return "".join(self._parts).strip()
+
+    def feed(self, chunk):
+        self.received += len(chunk)
+        if self.rejected or self.ended:
+            return
+        if not self.started:
+            self._preface += chunk
+            match = _TAG_RE.search(self._preface)
+            if match is None:
+                # Fences, whitespace and a short lead-in ("Here is the page:") may come first
+                if len(self._preface.replace(FENCE, "").strip()) > self.sniff_chars:
+                    self.rejected = f"no HTML tag in the first {self.sniff_chars} characters"
+                return
+            chunk = self._preface[match.start():]
+            self._preface = ""
+        chunk = self._held + chunk
+        fence = chunk.find(FENCE)
+        if fence >= 0:
+            chunk, self.ended = chunk[:fence], True
+        self._held = ""
+        if not self.ended:
+            kept = chunk.rstrip("`")
+            chunk, self._held = kept, chunk[len(kept):]
+        self._parts.append(chunk)
+        super().feed(chunk)
+
+    def handle_starttag(self, tag, attrs):
+        self.elements += 1
+        if tag == "body":
+            self._body = True
+        if tag not in VOID_ELEMENTS:
+            self._open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.elements += 1
+
+    def handle_endtag(self, tag):
+        if tag in self._open:
+            # Close it and anything left open inside it, as a browser would
+            del self._open[len(self._open) - 1 - self._open[::-1].index(tag):]
+
+    def preview(self):
+        """Renderable HTML of what has been received, or None before the <body> starts"""
+        if not self._body:
+            return None
+        document = "".join(self._parts)
+        # getpos() is where parsing stopped: everything fed before it has been handled
+        lineno, offset = self.getpos()
+        while self._line < lineno:
+            self._line_start = document.index("\n", self._line_start) + 1
+            self._line += 1
+        complete = document[:self._line_start + offset]
+        return complete + "".join(f"</{tag}>" for tag in reversed(self._open))
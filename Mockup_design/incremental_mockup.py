@@ -0,0 +1,294 @@
+"""
+Incremental Mockup Regeneration
+===============================
+
+Component-level diff and reuse model for HTML mockups. Every generated mockup
+is stored in the report history as the next version of the mockup it was
+derived from, so each BRD has a chain of UI schema versions. When the BRD
+changes, the new schema is diffed against the previous version by component
+(name, parent):
+
+- unchanged components keep their HTML from the previous mockup
+- changed and added components are re-requested from the model as HTML
+  fragments (one per changed subtree) and spliced into the previous page
+- removed components are cut out of it
+
+Splicing relies on the data-component="<name>" attribute the HTML prompt asks
+the model to put on each component's element. When the previous page lacks a
+marker that is needed, or more than MOCKUP_DIFF_MAX_CHANGED of the components
+changed, the page is generated in full instead. Geometry (x, y, width,
+height) does not count as a change: the HTML page lays itself out.
+
+The agent performs the model calls; this module only diffs, plans and splices.
+"""
+
+import json
+import re
+import sys
+from html.parser import HTMLParser
+from pathlib import Path
+
+# config lives in the project root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from config import MOCKUP_DIFF_MAX_CHANGED
+
+MARKER = "data-component"
+GEOMETRY = frozenset(("x", "y", "width", "height"))
+VOID_ELEMENTS = frozenset((
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr",
+))
+_BLOCKS = frozenset((
+    "address", "article", "aside", "blockquote", "details", "div", "dl", "fieldset", "figure", "footer", "form",
+    "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "main", "nav", "ol", "p", "pre", "section", "table", "ul",
+))
+# Open elements a start tag closes implicitly (HTML's optional end tags)
+_IMPLIED_END = {"li": {"li"}, "dt": {"dt", "dd"}, "dd": {"dt", "dd"}, "option": {"option"},
+                "tr": {"tr", "td", "th"}, "td": {"td", "th"}, "th": {"td", "th"}}
+_IMPLIED_END.update({tag: _IMPLIED_END.get(tag, set()) | {"p"} for tag in _BLOCKS})
+_BODY_END_RE = re.compile(r"</body\s*>", re.IGNORECASE)
+_STYLE_RE = re.compile(r"<style\b[^>]*>.*?</style\s*>", re.IGNORECASE | re.DOTALL)
+
+
+def component_key(element):
+    parent = element.get("parent")
+    return str(element.get("name", "")), str(parent) if parent else None
+
+
+def _content(element):
+    return {key: value for key, value in element.items() if key not in GEOMETRY}
+
+
+def diff_schemas(old, new):
+    """{"added", "removed", "changed", "unchanged"}: lists of elements (new ones, removed ones from old)"""
+    previous = {}
+    for element in old or []:
+        if isinstance(element, dict):
+            previous.setdefault(component_key(element), element)
+    diff = {"added": [], "removed": [], "changed": [], "unchanged": []}
+    seen = set()
+    for element in new or []:
+        if not isinstance(element, dict):
+            continue
+        key = component_key(element)
+        if key in seen:
+            continue
+        seen.add(key)
+        if key not in previous:
+            diff["added"].append(element)
+        elif _content(previous[key]) != _content(element):
+            diff["changed"].append(element)
+        else:
+            diff["unchanged"].append(element)
+    diff["removed"] = [element for key, element in previous.items() if key not in seen]
+    return diff
+
+
+class _ComponentLocator(HTMLParser):
+    """Offsets of the elements carrying a data-component marker"""
+
+    def __init__(self, html):
+        super().__init__(convert_charrefs=True)
+        self.html = html
+        self.spans = {}
+        self._line_starts = [0] + [match.end() for match in re.finditer("\n", html)]
+        self._open = []  # (tag, component name or None, start, inner start)
+
+    def _offset(self):
+        line, column = self.getpos()
+        return self._line_starts[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        name = dict(attrs).get(MARKER)
+        start = self._offset()
+        end = start + len(self.get_starttag_text())
+        closes = _IMPLIED_END.get(tag, ())
+        while self._open and self._open[-1][0] in closes:
+            # A new <li> ends an open <li>, a block ends an open <p>, ...
+            open_tag, open_name, open_start, _ = self._open.pop()
+            if open_name and open_name not in self.spans:
+                self.spans[open_name] = (open_start, start, start)
+        if tag in VOID_ELEMENTS:
+            if name and name not in self.spans:
+                self.spans[name] = (start, end, end)
+            return
+        self._open.append((tag, name, start, end))
+
+    def handle_startendtag(self, tag, attrs):
+        name = dict(attrs).get(MARKER)
+        start = self._offset()
+        if name and name not in self.spans:
+            end = start + len(self.get_starttag_text())
+            self.spans[name] = (start, end, end)
+
+    def handle_endtag(self, tag):
+        if not any(open_tag == tag for open_tag, _, _, _ in self._open):
+            return
+        inner_end = self._offset()
+        end = self.html.find(">", inner_end) + 1 or len(self.html)
+        while self._open:
+            open_tag, name, start, _ = self._open.pop()
+            if name and name not in self.spans:
+                # Elements closed implicitly end where their ancestor's end tag starts
+                self.spans[name] = (start, end if open_tag == tag else inner_end, inner_end)
+            if open_tag == tag:
+                break
+
+
+def component_spans(html):
+    """{component name: (start, end, inner end)} offsets of the marked elements in html"""
+    locator = _ComponentLocator(html)
+    locator.feed(html)
+    locator.close()
+    return locator.spans
+
+
+def plan(previous_schema, previous_html, schema, max_changed=MOCKUP_DIFF_MAX_CHANGED):
+    """What to do with a new schema given the previous version's schema and page.
+
+    Returns {"mode": "reuse" | "splice" | "full", "reason", "diff", "roots",
+    "removed", "spans"}: roots are the changed/added components whose HTML
+    (including their children) must be requested, removed the components to
+    cut out of the previous page.
+    """
+    diff = diff_schemas(previous_schema, schema)
+    result = {"mode": "full", "reason": None, "diff": diff, "roots": [], "removed": [], "spans": {}}
+    if not previous_schema or not previous_html:
+        result["reason"] = "no previous version"
+        return result
+    touched = diff["added"] + diff["changed"] + diff["removed"]
+    if not touched:
+        result["mode"] = "reuse"
+        return result
+    total = len(touched) + len(diff["unchanged"])
+    if len(touched) / total > max_changed:
+        result["reason"] = f"{len(touched)} of {total} components changed"
+        return result
+    redo = {element.get("name") for element in diff["added"] + diff["changed"]}
+    gone = {element.get("name") for element in diff["removed"]}
+    parents, previous_parents = _parents(schema), _parents(previous_schema)
+    roots = [element for element in diff["added"] + diff["changed"] if not _has_ancestor(element, parents, redo)]
+    # Removed components inside a regenerated or removed element go with it
+    removed = [
+        element for element in diff["removed"] if not _has_ancestor(element, previous_parents, redo | gone)
+    ]
+    spans = component_spans(previous_html)
+    added = {id(element) for element in diff["added"]}
+    needed = [element.get("name") for element in roots if id(element) not in added]
+    needed += [element.get("parent") for element in roots if id(element) in added and element.get("parent")]
+    needed += [element.get("name") for element in removed]
+    missing = [name for name in needed if name not in spans]
+    if missing:
+        result["reason"] = f"no {MARKER} marker for {missing[0]!r} in the previous page"
+        return result
+    if any(id(element) in added and not element.get("parent") for element in roots) and not _BODY_END_RE.search(previous_html):
+        result["reason"] = "no </body> in the previous page"
+        return result
+    result.update(mode="splice", roots=roots, removed=removed, spans=spans)
+    return result
+
+
+def _parents(schema):
+    """{component name: parent name}"""
+    return {str(item.get("name", "")): item.get("parent") for item in schema if isinstance(item, dict)}
+
+
+def _has_ancestor(element, parents, names):
+    """True if an ancestor of element (following parents) is one of names"""
+    seen = set()
+    parent = element.get("parent")
+    while parent and parent not in seen:
+        if parent in names:
+            return True
+        seen.add(parent)
+        parent = parents.get(parent)
+    return False
+
+
+def page_styles(html):
+    """The <style> blocks of a page, so regenerated fragments can match it"""
+    return "\n".join(_STYLE_RE.findall(html or ""))
+
+
+def subtree(schema, root):
+    """root and all its descendants in schema, in schema order"""
+    names = {root.get("name")}
+    elements = [root]
+    for element in schema:
+        if isinstance(element, dict) and element is not root and element.get("parent") in names:
+            names.add(element.get("name"))
+            elements.append(element)
+    return elements
+
+
+def parse_fragments(text, names):
+    """{name: html} from the model's JSON reply; None unless every requested name has a fragment"""
+    text = (text or "").strip()
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match is None:
+        return None
+    try:
+        fragments = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(fragments, dict):
+        return None
+    result = {}
+    for name in names:
+        fragment = fragments.get(name)
+        if not isinstance(fragment, str) or not fragment.strip():
+            return None
+        fragment = fragment.strip()
+        if f'{MARKER}="{name}"' not in fragment:
+            fragment = f'<div {MARKER}="{_attribute(name)}">{fragment}</div>'
+        result[name] = fragment
+    return result
+
+
+def _attribute(value):
+    return value.replace("&", "&amp;").replace('"', "&quot;")
+
+
+def splice(previous_html, planned, fragments):
+    """The previous page with the planned roots replaced/inserted and removed components cut out"""
+    spans = planned["spans"]
+    diff = planned["diff"]
+    added = {id(element) for element in diff["added"]}
+    edits = []  # (start, end, replacement)
+    for root in planned["roots"]:
+        name = root.get("name")
+        if id(root) not in added:
+            start, end, _ = spans[name]
+            edits.append((start, end, fragments[name]))
+        elif root.get("parent"):
+            inner_end = spans[root["parent"]][2]
+            edits.append((inner_end, inner_end, fragments[name]))
+        else:
+            body_end = list(_BODY_END_RE.finditer(previous_html))[-1].start()
+            edits.append((body_end, body_end, fragments[name]))
+    for element in planned["removed"]:
+        start, end, _ = spans[element.get("name")]
+        edits.append((start, end, ""))
+    # Outermost edits win: anything inside a replaced or removed element goes with it
+    edits.sort(key=lambda edit: (edit[0], -edit[1]))
+    kept = []
+    for start, end, replacement in edits:
+        if kept and start < kept[-1][1]:
+            continue
+        kept.append((start, end, replacement))
+    html = previous_html
+    for start, end, replacement in reversed(kept):
+        html = html[:start] + replacement + html[end:]
+    return html
+
+
+def summary(planned):
+    diff = planned["diff"]
+    return {
+        "mode": planned["mode"],
+        "reason": planned["reason"],
+        "reused": len(diff["unchanged"]),
+        "changed": len(diff["changed"]),
+        "added": len(diff["added"]),
+        "removed": len(diff["removed"]),
+        "requested": len(planned["roots"]),
+    }
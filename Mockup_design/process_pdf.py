@@ -5,13 +5,24 @@ Direct PDF Processing Script
 
 This script directly processes the user's PDF file and generates custom mockups
 based on the BRD content without requiring interactive input.
+
+Each step is checkpointed, so running it again on the same PDF resumes after
+the last successful step. --rerun repeats one step and the ones after it:
+
+    python process_pdf.py "CRM 360 solution.pdf" --rerun html
 """
 
+import argparse
 import os
-from enhanced_agent import EnhancedBRDAgent
+from enhanced_agent import PIPELINE_STAGES, EnhancedBRDAgent
 
 def main():
     """Process the user's PDF file directly"""
+    parser = argparse.ArgumentParser(description="Generate a mockup from a BRD PDF")
+    parser.add_argument("pdf", nargs="?", help="PDF file (default: choose from the current directory)")
+    parser.add_argument("--rerun", choices=PIPELINE_STAGES, help="Run this step and the later ones again")
+    args = parser.parse_args()
+
     print("🚀 Enhanced BRD Agent - Processing Your PDF")
     print("=" * 50)
     
@@ -27,7 +38,7 @@ def main():
     print("✓ Dynamic HTML generation enabled")
     
     # Look for PDF files in the current directory
-    pdf_files = [f for f in os.listdir('.') if f.endswith('.pdf')]
+    pdf_files = [args.pdf] if args.pdf else [f for f in os.listdir('.') if f.endswith('.pdf')]
     
     if not pdf_files:
         print("✗ No PDF files found in the current directory")
@@ -61,7 +72,7 @@ def main():
     print("=" * 50)
     
     try:
-        outputs = agent.process_pdf_pipeline(pdf_path)
+        outputs = agent.process_pdf_pipeline(pdf_path, rerun=args.rerun)
         
         if outputs:
             print("\n🎉 Success! Your custom mockups have been generated!")
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+UI Schema Layout Checks
+=======================
+
+Schemas from generate_ui_schema place every element with absolute
+x/y/width/height and link it to its container by name ("parent"). Model
+schemas often have hundreds of elements, with overlapping siblings, children
+outside their container and parents that do not exist.
+
+SchemaArrays keeps a schema as numpy arrays, one row per element, with parent
+links resolved to row indices. A uniform grid over the boxes, keyed by parent,
+finds the sibling pairs that can overlap. The overlap, containment and parent
+checks then run vectorized over all elements at once, so even a 10k-element
+schema takes milliseconds.
+
+auto_layout() repairs what validate() reports:
+
+- unknown, self and cyclic parents are re-attached to the root frame (or made top-level)
+- elements are moved (and narrowed if wider than their parent) into their parent
+- sibling groups with overlaps are reflowed into rows, in reading order, children moving along
+- parents grow to fit their children
+
+    python schema_layout.py schemas/banking_schema_20250101_120000.json          # list issues
+    python schema_layout.py schemas/banking_schema_20250101_120000.json --fix    # write <name>.fixed.json
+"""
+
+import argparse
+import json
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# config lives in the project root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from config import SCHEMA_LAYOUT_GAP, SCHEMA_LAYOUT_TOLERANCE
+
+TOP = -1  # parent index of top-level elements
+MISSING = -2  # parent name that no element has
+SELF = -3  # element names itself as parent
+ISSUE_KINDS = ("invalid_box", "duplicate_name", "missing_parent", "self_parent", "parent_cycle", "outside_parent", "overlap")
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _column(elements, key):
+    """float64 array of one box field; missing or non-numeric values become NaN"""
+    values = [element.get(key) for element in elements]
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([_number(value) for value in values], dtype=np.float64)
+
+
+class SchemaArrays:
+    """A schema as per-element numpy arrays (box, resolved parent, depth)"""
+
+    def __init__(self, elements):
+        self.elements = elements
+        n = len(elements)
+        self.names = [str(element.get("name", "")) for element in elements]
+        self.x, self.y = _column(elements, "x"), _column(elements, "y")
+        self.w, self.h = _column(elements, "width"), _column(elements, "height")
+        index = {}
+        duplicates = []
+        for i, name in enumerate(self.names):
+            if name in index:
+                duplicates.append(i)
+            else:
+                index[name] = i  # Parent references resolve to the first element of a name
+        self.duplicates = np.array(duplicates, dtype=np.int64)
+        parents = [element.get("parent") for element in elements]
+        self.parent = np.fromiter(
+            (TOP if not name else index.get(str(name), MISSING) for name in parents), dtype=np.int64, count=n
+        )
+        self.parent[self.parent == np.arange(n)] = SELF
+        self._resolve_depths()
+
+    @classmethod
+    def from_schema(cls, schema):
+        if not isinstance(schema, list):
+            raise TypeError(f"Expected a list of elements, got {type(schema).__name__}")
+        return cls([element for element in schema if isinstance(element, dict)])
+
+    def __len__(self):
+        return len(self.elements)
+
+    def _resolve_depths(self):
+        """Depth of every element by pointer doubling; chains that never reach the top are cycles"""
+        n = len(self)
+        linked = self.parent >= 0
+        up = np.append(np.where(linked, self.parent, n), n)  # n: the top, pointing at itself
+        depth = np.append(linked.astype(np.int64), 0)
+        for _ in range(max(1, math.ceil(math.log2(n + 1))) + 1):
+            depth = depth + depth[up]
+            up = up[up]
+        self.cyclic = up[:n] != n
+        self.depth = np.where(self.cyclic, 0, depth[:n])
+        self.levels = [np.flatnonzero(self.depth == level) for level in range(int(self.depth.max(initial=0)) + 1)]
+
+    def valid_boxes(self):
+        return np.isfinite(self.x) & np.isfinite(self.y) & np.isfinite(self.w) & np.isfinite(self.h) & (self.w >= 0) & (self.h >= 0)
+
+    def linked(self):
+        """Mask of elements with a usable parent (resolved, not part of a cycle)"""
+        return (self.parent >= 0) & ~self.cyclic
+
+    def outside_parent(self, tolerance=SCHEMA_LAYOUT_TOLERANCE):
+        """Indices of elements whose box is not inside their parent's box"""
+        children = np.flatnonzero(self.linked() & self.valid_boxes())
+        p = self.parent[children]
+        x, y, w, h = self.x[children], self.y[children], self.w[children], self.h[children]
+        outside = (
+            (x < self.x[p] - tolerance) | (y < self.y[p] - tolerance)
+            | (x + w > self.x[p] + self.w[p] + tolerance) | (y + h > self.y[p] + self.h[p] + tolerance)
+        )
+        return children[outside]
+
+    def overlap_pairs(self, members=None, tolerance=SCHEMA_LAYOUT_TOLERANCE):
+        """(a, b) index arrays of overlapping siblings (a < b), among members (default: all)
+
+        Boxes are binned into grid cells keyed by (parent, cell); only elements
+        sharing a key are compared.
+        """
+        members = np.arange(len(self)) if members is None else np.asarray(members)
+        members = members[self.valid_boxes()[members] & (self.w[members] > 0) & (self.h[members] > 0)]
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        if len(members) < 2:
+            return empty
+        x, y = self.x[members], self.y[members]
+        right, bottom = x + self.w[members], y + self.h[members]
+        cell = max(8.0, 2.0 * float(np.median(np.maximum(self.w[members], self.h[members]))))
+        cx0, cy0 = np.floor(x / cell).astype(np.int64), np.floor(y / cell).astype(np.int64)
+        cx1 = np.maximum(cx0, np.floor((right - tolerance) / cell).astype(np.int64))
+        cy1 = np.maximum(cy0, np.floor((bottom - tolerance) / cell).astype(np.int64))
+        cx0, cx1 = cx0 - cx0.min(), cx1 - cx0.min()
+        cy0, cy1 = cy0 - cy0.min(), cy1 - cy0.min()
+        columns = int(cx1.max()) + 1
+        rows = int(cy1.max()) + 1
+        span_x = cx1 - cx0 + 1
+        counts = span_x * (cy1 - cy0 + 1)
+        # One entry per (element, covered cell)
+        owner = np.repeat(np.arange(len(members)), counts)
+        offset = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        span = np.repeat(span_x, counts)
+        cell_x = np.repeat(cx0, counts) + offset % span
+        cell_y = np.repeat(cy0, counts) + offset // span
+        group = np.where(self.linked()[members], self.parent[members], TOP) + 1
+        key = (np.repeat(group, counts) * rows + cell_y) * columns + cell_x
+        order = np.argsort(key, kind="stable")
+        key, owner = key[order], owner[order]
+        firsts, seconds = [], []
+        distance = 1
+        while distance < len(key):
+            same = key[distance:] == key[:-distance]
+            if not same.any():
+                break
+            firsts.append(owner[:-distance][same])
+            seconds.append(owner[distance:][same])
+            distance += 1
+        if not firsts:
+            return empty
+        a, b = np.concatenate(firsts), np.concatenate(seconds)
+        a, b = np.minimum(a, b), np.maximum(a, b)
+        unique = np.sort(a * len(members) + b)
+        unique = unique[np.r_[True, unique[1:] != unique[:-1]]]
+        a, b = unique // len(members), unique % len(members)
+        overlap_w = np.minimum(right[a], right[b]) - np.maximum(x[a], x[b])
+        overlap_h = np.minimum(bottom[a], bottom[b]) - np.maximum(y[a], y[b])
+        hit = (overlap_w > tolerance) & (overlap_h > tolerance)
+        return members[a[hit]], members[b[hit]]
+
+    def issues(self, tolerance=SCHEMA_LAYOUT_TOLERANCE):
+        """[{"kind", "element", "other"}] for every problem found (kinds in ISSUE_KINDS)"""
+        found = []
+
+        def add(kind, elements, others=None):
+            for position, i in enumerate(elements.tolist()):
+                other = None if others is None else self.names[int(others[position])]
+                found.append({"kind": kind, "element": self.names[i], "other": other})
+
+        add("invalid_box", np.flatnonzero(~self.valid_boxes()))
+        add("duplicate_name", self.duplicates)
+        add("missing_parent", np.flatnonzero(self.parent == MISSING))
+        add("self_parent", np.flatnonzero(self.parent == SELF))
+        add("parent_cycle", np.flatnonzero(self.cyclic))
+        outside = self.outside_parent(tolerance)
+        add("outside_parent", outside, self.parent[outside])
+        a, b = self.overlap_pairs(tolerance=tolerance)
+        add("overlap", b, a)
+        return found
+
+    def to_schema(self):
+        """The elements with their (possibly repaired) boxes, in whole pixels, and parents, as new dicts"""
+        columns = [np.rint(np.nan_to_num(values)).astype(np.int64).tolist() for values in (self.x, self.y, self.w, self.h)]
+        schema = []
+        for element, x, y, w, h, p in zip(self.elements, *columns, self.parent.tolist()):
+            fixed = dict(element, x=x, y=y, width=w, height=h)
+            if p >= 0 or element.get("parent"):
+                fixed["parent"] = self.names[p] if p >= 0 else None
+            schema.append(fixed)
+        return schema
+
+    # --- Repairs (used by auto_layout) ---
+
+    def repair_parents(self):
+        """Re-attach elements with unknown, self or cyclic parents; returns how many"""
+        broken = (self.parent == MISSING) | (self.parent == SELF) | self.cyclic
+        if not broken.any():
+            return 0
+        top = np.flatnonzero((self.parent == TOP) & self.valid_boxes())
+        frames = [i for i in top.tolist() if self.elements[i].get("type") == "frame"]
+        root = max(frames, key=lambda i: self.w[i] * self.h[i]) if frames else TOP
+        self.parent[broken] = root
+        if root >= 0:
+            self.parent[root] = TOP  # The root itself may have been part of a cycle
+        self._resolve_depths()
+        return int(broken.sum())
+
+    def repair_boxes(self):
+        """Missing positions become the parent's origin, missing or negative sizes 0; returns how many"""
+        invalid = ~self.valid_boxes()
+        if not invalid.any():
+            return 0
+        parent = np.where(self.linked(), self.parent, -1)
+        origin_x = np.where(parent >= 0, np.nan_to_num(self.x[parent]), 0.0)
+        origin_y = np.where(parent >= 0, np.nan_to_num(self.y[parent]), 0.0)
+        self.x = np.where(np.isfinite(self.x), self.x, origin_x)
+        self.y = np.where(np.isfinite(self.y), self.y, origin_y)
+        self.w = np.where(np.isfinite(self.w) & (self.w >= 0), self.w, 0.0)
+        self.h = np.where(np.isfinite(self.h) & (self.h >= 0), self.h, 0.0)
+        return int(invalid.sum())
+
+    def shift(self, dx, dy):
+        """Move each element by its own dx/dy plus those of its ancestors (children move with parents)"""
+        dx, dy = dx.copy(), dy.copy()
+        for members in self.levels[1:]:
+            dx[members] += dx[self.parent[members]]
+            dy[members] += dy[self.parent[members]]
+        self.x += dx
+        self.y += dy
+
+    def contain(self):
+        """Move (and narrow) every element into its parent, top level first.
+
+        Returns a mask of the elements that had to move sideways: their
+        position within the parent is lost, so their group is reflowed.
+        """
+        sideways = np.zeros(len(self), dtype=bool)
+        for members in self.levels[1:]:
+            p = self.parent[members]
+            self.w[members] = np.minimum(self.w[members], self.w[p])
+            new_x = np.clip(self.x[members], self.x[p], self.x[p] + self.w[p] - self.w[members])
+            new_y = np.maximum(self.y[members], self.y[p])
+            dx, dy = np.zeros(len(self)), np.zeros(len(self))
+            dx[members] = new_x - self.x[members]
+            dy[members] = new_y - self.y[members]
+            sideways[members] = dx[members] != 0
+            if dx.any() or dy.any():
+                self.shift(dx, dy)
+        return sideways
+
+    def reflow(self, members, gap):
+        """Lay out each sibling group of members in rows within its parent's width, in reading order"""
+        dx, dy = np.zeros(len(self)), np.zeros(len(self))
+        groups = np.where(self.linked()[members], self.parent[members], TOP)
+        order = np.lexsort((members, self.x[members], self.y[members], groups))
+        members, groups = members[order], groups[order]
+        # Per-group bounds: the parent's box, or for top-level elements the box around them all
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        top_y = np.minimum.reduceat(self.y[members], starts)
+        widest = np.maximum.reduceat(self.w[members], starts)
+        first = groups[starts]
+        left = np.where(first >= 0, self.x[first], np.minimum.reduceat(self.x[members], starts))
+        width = np.where(
+            first >= 0, self.w[first], np.maximum.reduceat(self.x[members] + self.w[members], starts) - left
+        )
+        top_y = np.where(first >= 0, np.maximum(top_y, self.y[first] + gap), top_y)
+        start_x = np.maximum(left, np.minimum(left + gap, left + width - widest))
+        bounds = zip(starts.tolist(), np.r_[starts[1:], len(members)].tolist(), left.tolist(), width.tolist(),
+                     start_x.tolist(), top_y.tolist())
+        x, y, w, h = self.x.tolist(), self.y.tolist(), self.w.tolist(), self.h.tolist()
+        new_x, new_y = {}, {}
+        for start, end, group_left, group_width, group_start, cursor_y in bounds:
+            cursor_x, row_height = group_start, 0.0
+            for i in members[start:end].tolist():
+                if cursor_x > group_start and cursor_x + w[i] > group_left + group_width:
+                    cursor_x, cursor_y, row_height = group_start, cursor_y + row_height + gap, 0.0
+                new_x[i] = min(cursor_x, max(group_left, group_left + group_width - w[i]))
+                new_y[i] = cursor_y
+                cursor_x = new_x[i] + w[i] + gap
+                row_height = max(row_height, h[i])
+        placed = np.fromiter(new_x, dtype=np.int64, count=len(new_x))
+        dx[placed] = np.fromiter(new_x.values(), dtype=np.float64, count=len(new_x)) - self.x[placed]
+        dy[placed] = np.fromiter(new_y.values(), dtype=np.float64, count=len(new_y)) - self.y[placed]
+        self.shift(dx, dy)
+        return int(((dx != 0) | (dy != 0)).sum())
+
+    def grow_parents(self, members, gap):
+        """Grow the parents of members to contain them; returns how many grew"""
+        linked = members[self.linked()[members]]
+        if not len(linked):
+            return 0
+        p = self.parent[linked]
+        needed = self.h.copy()
+        np.maximum.at(needed, p, self.y[linked] + self.h[linked] + gap - self.y[p])
+        grown = needed > self.h
+        self.h = needed
+        return int(grown.sum())
+
+
+def validate(schema, tolerance=SCHEMA_LAYOUT_TOLERANCE):
+    """Layout problems of a schema: [{"kind", "element", "other"}]"""
+    return SchemaArrays.from_schema(schema).issues(tolerance)
+
+
+def auto_layout(schema, gap=SCHEMA_LAYOUT_GAP, tolerance=SCHEMA_LAYOUT_TOLERANCE):
+    """(repaired schema, summary) with overlaps, misplaced children and broken parents fixed"""
+    layout = SchemaArrays.from_schema(schema)
+    before = layout.issues(tolerance)
+    summary = {
+        "elements": len(layout),
+        "issues_before": len(before),
+        "parents_fixed": layout.repair_parents(),
+        "boxes_fixed": layout.repair_boxes(),
+    }
+    sideways = layout.contain()
+    summary["contained"] = int(sideways.sum())
+    summary["reflowed"] = summary["grown"] = 0
+    # Deepest level first: a reflowed group may grow its parent, which then takes part in its own level
+    for level in range(len(layout.levels) - 1, -1, -1):
+        members = layout.levels[level]
+        groups = np.where(layout.linked()[members], layout.parent[members], TOP)
+        marked = np.unique(groups[sideways[members]])
+        a, b = layout.overlap_pairs(members[~np.isin(groups, marked)], tolerance)
+        overlapping = np.unique(np.where(layout.linked()[a], layout.parent[a], TOP))
+        members = members[np.isin(groups, marked) | np.isin(groups, overlapping)]
+        if len(members):
+            summary["reflowed"] += layout.reflow(members, gap)
+        summary["grown"] += layout.grow_parents(layout.levels[level], gap)
+    summary["issues_after"] = len(layout.issues(tolerance))
+    return layout.to_schema(), summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check (and fix) the layout of a UI schema JSON file")
+    parser.add_argument("schema", help="Schema JSON file (a list of elements)")
+    parser.add_argument("--fix", action="store_true", help="Write the repaired schema to <name>.fixed.json")
+    args = parser.parse_args()
+    path = Path(args.schema)
+    schema = json.loads(path.read_text(encoding="utf-8"))
+    started = time.perf_counter()
+    issues = validate(schema)
+    elapsed = (time.perf_counter() - started) * 1000
+    counts = {kind: sum(issue["kind"] == kind for issue in issues) for kind in ISSUE_KINDS}
+    print(f"{len(schema)} elements, {len(issues)} issue(s) in {elapsed:.1f} ms: "
+          + ", ".join(f"{kind} {count}" for kind, count in counts.items() if count))
+    for issue in issues[:20]:
+        other = f" ({issue['other']})" if issue["other"] else ""
+        print(f"  {issue['kind']:<15} {issue['element']}{other}")
+    if args.fix:
+        started = time.perf_counter()
+        fixed, summary = auto_layout(schema)
+        elapsed = (time.perf_counter() - started) * 1000
+        out = path.with_suffix(".fixed.json")
+        out.write_text(json.dumps(fixed, indent=2), encoding="utf-8")
+        print(f"✓ Fixed in {elapsed:.1f} ms, {summary['issues_after']} issue(s) left: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,18 +9,64 @@ import os
 import re
 import time
 import base64
-import tempfile
+import hashlib
+import sqlite3
+import uuid
 import streamlit as st
-from config import MODEL_NAME
-import google.generativeai as genai
-from bs4 import BeautifulSoup, Tag
-import markdown
-from playwright.sync_api import sync_playwright
-import random
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from config import (
+    CPU_PROFILE_ENABLED,
+    HEALTH_CHECK_TTL,
+    MEMORY_PROFILE_ENABLED,
+    MERMAID_CACHE_DIR,
+    MERMAID_CACHE_MAX_FILES,
+    MERMAID_RENDER_TIMEOUT,
+    MOCKUP_INCREMENTAL_ENABLED,
+    MOCKUP_INCREMENTAL_MIN_SIMILARITY,
+    MOCKUP_PREFETCH_ENABLED,
+    NEAR_DUPLICATE_AUTO_SERVE,
+    NEAR_DUPLICATE_ENABLED,
+    NEAR_DUPLICATE_OFFER_THRESHOLD,
+    PDF_EXPORT_SCRIPT,
+    PDF_EXPORT_TIMEOUT,
+    PDF_PRERENDER_ENABLED,
+    REPORT_HISTORY_ENABLED,
+    REPORT_INCREMENTAL_ENABLED,
+    TELEMETRY_SIDEBAR,
+)
+import telemetry
+import memory_profile
+import cpu_profile
+import llm
+import cancellation
+import event_loop
+import pdf_cache
+import near_duplicates
+import report_history
+from cancellation import JobCancelledError, jobs
+from resilience import CircuitOpenError, classify_error
+from scheduler import request_context
+from singleflight import flight, make_key
+from prefetch import prefetcher
+from incremental_report import SECTION_KEYS, ReportState, use_case_key
+from report_model import parse_report
+from prompt_builder import build_prompt
 import subprocess
 import sys
 sys.path.append("Mockup_design")
-from enhanced_agent import EnhancedBRDAgent
+
+# Heavy dependencies (bs4, markdown, the mockup agent with pdfplumber, Playwright
+# in pdf_export.py) are imported inside the functions that use them: Streamlit
+# re-executes this script on every interaction, and most sessions never reach
+# PDF export or the mockup. See benchmarks/startup_profile.py for the budget.
+
+@st.cache_resource(show_spinner=False, ttl=HEALTH_CHECK_TTL)
+def check_gemini():
+    """API key check, done once per process (and again after HEALTH_CHECK_TTL) instead of on every rerun"""
+    test_response = llm.generate("health_check", "Hello")
+    if not test_response or not test_response.text:
+        raise RuntimeError("API key test failed. Please check your API key.")
+    return True
 
 # --- Gemini Model Setup (NEW SDK) ---
 # Set up Gemini model using environment variable
@@ -31,19 +77,16 @@ try:
         st.error("GEMINI_API_KEY not found in environment variables. Please set it in Streamlit Cloud secrets.")
         st.stop()
     
-    # Initialize the Gemini model
-    model = genai.GenerativeModel(MODEL_NAME)
-    # Quick test to verify API key works
-    test_response = model.generate_content("Hello")
-    if not test_response or not test_response.text:
-        st.error("API key test failed. Please check your API key.")
-        st.stop()
+    # Quick test to verify API key works (models are created per task by routing.py)
+    check_gemini()
 except Exception as e:
     st.error(f"Failed to initialize Gemini AI: {str(e)}")
     st.info("Please check your GEMINI_API_KEY in Streamlit Cloud secrets")
     st.stop()
 OUTPUT_DIR = "output"
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+telemetry.start_metrics_server()
 
 # --- Utility Functions (copied from app_playwright.py) ---
 STRICT_MERMAID_TEMPLATES = {
@@ -121,109 +164,248 @@ def validate_mermaid_code(code):
         return False
     return True
 
-def extract_and_render_mermaid(md_text, output_dir=OUTPUT_DIR, business_problem=None):
-    mermaid_blocks = re.findall(r"```mermaid\n(.*?)```", md_text, re.DOTALL)
+def extract_and_render_mermaid(md_text, output_dir=MERMAID_CACHE_DIR, business_problem=None, document=None):
+    document = document or parse_report(md_text)
+    mermaid_blocks = [block.code for block in document.mermaid_blocks]
     image_paths = []
     error_blocks = []
     fixed_blocks = []
     os.makedirs(output_dir, exist_ok=True)
     for idx, code in enumerate(mermaid_blocks, 1):
-        code = sanitize_mermaid_code(code)
-        section_type = None
-        if not validate_mermaid_code(code):
-            if section_type == 'process':
-                code = sanitize_mermaid_code(STRICT_MERMAID_TEMPLATES['process'])
-            elif section_type == 'stakeholder':
-                code = sanitize_mermaid_code(STRICT_MERMAID_TEMPLATES['stakeholder'])
-        mmd_path = os.path.join(output_dir, f"diagram_{idx}.mmd")
-        png_path = os.path.join(output_dir, f"diagram_{idx}.png")
-        try:
-            with open(mmd_path, "w", encoding="utf-8") as f:
-                f.write(code)
-            mmdc_paths = [
-                "mmdc", "/usr/local/bin/mmdc", "/usr/bin/mmdc", r"C:\\Users\\acer\\AppData\\Roaming\\npm\\mmdc.cmd"
-            ]
-            rendered = False
-            for mmdc_path in mmdc_paths:
-                try:
-                    subprocess.run([
-                        mmdc_path, "-i", mmd_path, "-o", png_path,
-                        "--theme", "neutral",
-                        "--backgroundColor", "white",
-                        "--width", "2000",
-                        "--height", "900",
-                        "--scale", "3"
-                    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30)
-                    if os.path.exists(png_path):
-                        image_paths.append(png_path)
-                        rendered = True
-                        break
-                except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-                    continue  # Suppress all errors and warnings
-            if not rendered:
-                error_blocks.append((idx, code, "Mermaid CLI not available - diagrams will be rendered in browser"))
-        except Exception as e:
-            error_blocks.append((idx, code, f"Could not save file: {str(e)}"))
+        if cancellation.cancelled():
+            # Keep the images rendered so far; the rest are shown as Mermaid code
+            error_blocks.append((idx, code, "Rendering cancelled"))
+            fixed_blocks.append((idx, code))
+            continue
+        with telemetry.span("mermaid.sanitize", block=idx) as sanitize_span:
+            code = sanitize_mermaid_code(code)
+            section_type = None
+            valid = validate_mermaid_code(code)
+            sanitize_span.set(valid=valid)
+            if not valid:
+                if section_type == 'process':
+                    code = sanitize_mermaid_code(STRICT_MERMAID_TEMPLATES['process'])
+                elif section_type == 'stakeholder':
+                    code = sanitize_mermaid_code(STRICT_MERMAID_TEMPLATES['stakeholder'])
+        # Content-addressed names: identical diagrams are rendered once and reused
+        render_key = hashlib.sha256(code.encode("utf-8")).hexdigest()[:16]
+        mmd_path = os.path.join(output_dir, f"diagram_{render_key}.mmd")
+        png_path = os.path.join(output_dir, f"diagram_{render_key}.png")
+        with telemetry.span("mermaid.render", block=idx) as render_span:
+            if os.path.exists(png_path):
+                render_span.cache_hit = True
+                os.utime(png_path)  # Recently used: evicted last
+                image_paths.append(png_path)
+                fixed_blocks.append((idx, code))
+                continue
+            try:
+                with open(mmd_path, "w", encoding="utf-8") as f:
+                    f.write(code)
+                mmdc_paths = [
+                    "mmdc", "/usr/local/bin/mmdc", "/usr/bin/mmdc", r"C:\\Users\\acer\\AppData\\Roaming\\npm\\mmdc.cmd"
+                ]
+                rendered = False
+                for mmdc_path in mmdc_paths:
+                    try:
+                        # Killed (with its headless browser) if the job is cancelled
+                        cancellation.run_process([
+                            mmdc_path, "-i", mmd_path, "-o", png_path,
+                            "--theme", "neutral",
+                            "--backgroundColor", "white",
+                            "--width", "2000",
+                            "--height", "900",
+                            "--scale", "3"
+                        ], timeout=MERMAID_RENDER_TIMEOUT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                        if os.path.exists(png_path):
+                            image_paths.append(png_path)
+                            rendered = True
+                            break
+                    except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
+                        _remove_partial(png_path)
+                        continue  # Suppress all errors and warnings
+                render_span.set(rendered=rendered)
+                if not rendered:
+                    error_blocks.append((idx, code, "Mermaid CLI not available - diagrams will be rendered in browser"))
+            except JobCancelledError:
+                _remove_partial(png_path)
+                render_span.set(cancelled=True)
+                error_blocks.append((idx, code, "Rendering cancelled"))
+            except Exception as e:
+                error_blocks.append((idx, code, f"Could not save file: {str(e)}"))
+            finally:
+                _remove_partial(mmd_path)  # Only the PNG is cached
         fixed_blocks.append((idx, code))
+    _evict_diagrams(output_dir)
     return image_paths, error_blocks, fixed_blocks
 
-def extract_use_case_details(report_text):
-    use_cases = []
-    pattern = re.compile(r"\*\*Use Case (\d+):\*\*\s*(.*?)\n\*\*Actors:\*\*\s*(.*?)\n(?:\*\*Preconditions:\*\*\s*(.*?)\n)?\*\*Main Flow:\*\*\s*(.*?)(?:\n\*\*|\Z)", re.DOTALL)
-    for match in pattern.finditer(report_text):
-        idx = int(match.group(1))
-        title = match.group(2).strip()
-        actors = match.group(3).strip()
-        main_flow = match.group(5).strip()
-        use_cases.append({
-            'idx': idx,
-            'title': title,
-            'actors': actors,
-            'main_flow': main_flow
-        })
-    return use_cases
+def _evict_diagrams(output_dir):
+    """Keep the MERMAID_CACHE_MAX_FILES most recently used diagram PNGs"""
+    try:
+        files = [os.path.join(output_dir, name) for name in os.listdir(output_dir) if name.startswith("diagram_") and name.endswith(".png")]
+    except OSError:
+        return
+    if len(files) <= MERMAID_CACHE_MAX_FILES:
+        return
+    files.sort(key=os.path.getmtime)
+    for path in files[:len(files) - MERMAID_CACHE_MAX_FILES]:
+        _remove_partial(path)
 
-def generate_use_case_diagram(business_problem, use_case):
-    prompt = f"""
+def _remove_partial(path):
+    """Drop a half-written render so the content-addressed cache never serves it"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def extract_use_case_details(report_text, document=None):
+    document = document or parse_report(report_text)
+    return [uc.to_dict() for uc in document.use_cases]
+
+USE_CASE_DIAGRAM_PROMPT = """
 Given the following business problem: {business_problem}
-And this use case: {use_case['title']}
-Actors: {use_case['actors']}
-Main Flow: {use_case['main_flow']}
+And this use case: {title}
+Actors: {actors}
+Main Flow: {main_flow}
 Generate a unique Mermaid diagram (flowchart TD) that visualizes the specific actors, steps, and interactions for this use case. Use only rectangles and arrows. No generic diagrams. No advanced formatting. Output only the Mermaid code, no extra text.
 """
+
+def _use_case_diagram_prompt(business_problem, use_case):
+    # The use case itself matters more than the surrounding problem statement
+    return build_prompt(
+        "use_case_diagram", USE_CASE_DIAGRAM_PROMPT, priorities={"main_flow": 1, "title": 2, "actors": 2},
+        business_problem=business_problem, title=use_case['title'],
+        actors=use_case['actors'], main_flow=use_case['main_flow'],
+    )
+
+def _use_case_diagram_code(response):
+    if response.text:
+        code = response.text.strip().replace('```mermaid','').replace('```','').strip()
+        return sanitize_mermaid_code(code)
+    return None
+
+def generate_use_case_diagram(business_problem, use_case):
     try:
-        response = model.generate_content(prompt)
-        if response.text:
-            code = response.text.strip().replace('```mermaid','').replace('```','').strip()
-            code = sanitize_mermaid_code(code)
-            return code
-        else:
-            return None
+        response = llm.generate("use_case_diagram", _use_case_diagram_prompt(business_problem, use_case))
+        return _use_case_diagram_code(response)
+    except Exception:
+        return None
+
+async def generate_use_case_diagram_async(business_problem, use_case):
+    try:
+        response = await llm.generate_async("use_case_diagram", _use_case_diagram_prompt(business_problem, use_case))
+        return _use_case_diagram_code(response)
     except Exception:
         return None
 
-def insert_use_case_diagrams(report_text, business_problem):
-    use_cases = extract_use_case_details(report_text)
-    if not use_cases:
+def insert_use_case_diagrams(report_text, business_problem, diagram_cache=None):
+    """Insert a Mermaid diagram after each use case's Main Flow.
+
+    diagram_cache maps use_case_key(use_case) to diagram code; unchanged use
+    cases reuse their diagram and new ones are added to the cache.
+    """
+    document = parse_report(report_text)
+    if not document.use_cases:
         return report_text
-    new_report = report_text
-    for uc in use_cases:
-        diagram_code = generate_use_case_diagram(business_problem, uc)
+    with telemetry.span("report.use_case_fanout", use_cases=len(document.use_cases)) as fanout_span:
+        codes = []
+        reused = 0
+        for uc in document.use_cases:
+            details = uc.to_dict()
+            code = _cached_diagram(diagram_cache, details)
+            if code is None:
+                code = generate_use_case_diagram(business_problem, details)
+                _store_diagram(diagram_cache, details, code)
+            else:
+                reused += 1
+            codes.append(code)
+            fanout_span.set(reused=reused)
+        return _splice_use_case_diagrams(document, codes)
+
+async def insert_use_case_diagrams_async(report_text, business_problem, diagram_cache=None):
+    """Async variant of insert_use_case_diagrams: uncached diagrams are generated concurrently"""
+    document = parse_report(report_text)
+    if not document.use_cases:
+        return report_text
+    with telemetry.span("report.use_case_fanout", use_cases=len(document.use_cases), mode="async") as fanout_span:
+        details = [uc.to_dict() for uc in document.use_cases]
+        codes = [_cached_diagram(diagram_cache, uc) for uc in details]
+        missing = [i for i, code in enumerate(codes) if code is None]
+        generated = await asyncio.gather(
+            *(generate_use_case_diagram_async(business_problem, details[i]) for i in missing)
+        )
+        for i, code in zip(missing, generated):
+            codes[i] = code
+            _store_diagram(diagram_cache, details[i], code)
+        fanout_span.set(reused=len(details) - len(missing))
+        return _splice_use_case_diagrams(document, codes)
+
+def _cached_diagram(diagram_cache, use_case):
+    if diagram_cache is None:
+        return None
+    return diagram_cache.get(use_case_key(use_case))
+
+def _store_diagram(diagram_cache, use_case, code):
+    if code and diagram_cache is not None:
+        diagram_cache[use_case_key(use_case)] = code
+
+def _splice_use_case_diagrams(document, codes):
+    edits = []
+    for uc, diagram_code in zip(document.use_cases, codes):
         if not diagram_code:
             diagram_code = "Diagram could not be generated for this use case."
-        uc_pattern = re.compile(rf"(\*\*Use Case {uc['idx']}:\*\*.*?\*\*Main Flow:\*\*.*?)(\n\n|\Z)", re.DOTALL)
-        match = uc_pattern.search(new_report)
-        if match:
-            insert_pos = match.end(1)
-            after_main_flow = new_report[insert_pos:insert_pos+200]
-            mermaid_match = re.search(r"```mermaid[\s\S]*?```", after_main_flow)
-            if mermaid_match:
-                start = insert_pos + mermaid_match.start()
-                end = insert_pos + mermaid_match.end()
-                new_report = new_report[:start] + f"```mermaid\n{diagram_code}\n```" + new_report[end:]
+        if uc.diagram is not None:
+            # Replace the diagram the report already has for this use case
+            edits.append((uc.diagram.start, uc.diagram.end, f"```mermaid\n{diagram_code}\n```"))
+        else:
+            edits.append((uc.end, uc.end, f"\n```mermaid\n{diagram_code}\n```"))
+    return document.splice(edits)
+
+def pair_report_images(document, image_paths):
+    """Map the report's Mermaid blocks, in order, to the rendered images that exist"""
+    existing = [path for path in image_paths if os.path.exists(path)]
+    return dict(zip(document.mermaid_blocks, existing))
+
+def embed_report_images(report_text, image_paths, document=None):
+    """Replace the report's Mermaid blocks, in order, with the rendered images"""
+    document = document or parse_report(report_text)
+    edits = []
+    for block, img_path in pair_report_images(document, image_paths).items():
+        with open(img_path, "rb") as img_file:
+            b64 = base64.b64encode(img_file.read()).decode("utf-8")
+        img_tag = f'<img src="data:image/png;base64,{b64}" style="max-width:100%; margin: 20px 0;" />'
+        edits.append((block.start, block.end, img_tag))
+    return document.splice(edits)
+
+def build_report_view(report_text, image_paths):
+    """Split a report into viewer sections of Markdown, image and Mermaid blocks.
+
+    Returns (intro_markdown, [{"title": ..., "blocks": [(kind, value), ...]}]).
+    Images are referenced by path so the viewer can serve them as media files.
+    """
+    document = parse_report(report_text)
+    images = pair_report_images(document, image_paths)
+    headings = document.sections(level=2)
+    intro_end = headings[0].start if headings else len(report_text)
+    sections = []
+    pending = [block for block in document.mermaid_blocks if block.start >= intro_end]
+    position = 0
+    for i, section in enumerate(headings):
+        end = headings[i + 1].start if i + 1 < len(headings) else len(report_text)
+        body_start = section.heading.end
+        blocks = []
+        while position < len(pending) and pending[position].start < end:
+            block = pending[position]
+            position += 1
+            blocks.append(("markdown", report_text[body_start:block.start]))
+            if block in images:
+                blocks.append(("image", images[block]))
             else:
-                new_report = new_report[:insert_pos] + f"\n```mermaid\n{diagram_code}\n```" + new_report[insert_pos:]
-    return new_report
+                blocks.append(("mermaid", block.code))
+            body_start = block.end
+        blocks.append(("markdown", report_text[body_start:end]))
+        blocks = [(kind, value) for kind, value in blocks if kind != "markdown" or value.strip()]
+        sections.append({"title": section.title, "blocks": blocks})
+    return report_text[:intro_end], sections
 
 REPORT_PROMPT_TEMPLATE = '''
 You are an expert Business Analyst specializing in banking and fintech. According to the business problem/objective, generate a complete business analysis report in Markdown format. The report must include:
@@ -270,43 +452,109 @@ Business Problem:
 {business_problem}
 '''
 
-def generate_report_and_images(business_problem):
-    try:
-        prompt = REPORT_PROMPT_TEMPLATE.format(business_problem=business_problem)
-        
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = model.generate_content(prompt)
-                
-                if not response or not response.text:
-                    return "No content generated from Gemini AI. Please try again.", []
-                
-                report_text = response.text
-                report_text = insert_use_case_diagrams(report_text, business_problem)
-                image_paths, error_blocks, fixed_blocks = extract_and_render_mermaid(report_text, business_problem=business_problem)
-                
-                return report_text, image_paths
-                
-            except Exception as e:
-                error_msg = str(e)
-                
-                if "503" in error_msg or "overloaded" in error_msg.lower():
-                    if attempt < max_retries - 1:
-                        wait_time = (attempt + 1) * 2 + random.uniform(0, 1)
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        return f"API is currently overloaded. Please try again in a few minutes. Error: {error_msg}", []
-                else:
-                    return f"Error generating report: {error_msg}", []
-        
-        return "Failed to generate report after multiple attempts. Please try again later.", []
+def generate_report_and_images(business_problem, diagram_cache=None):
+    with telemetry.span("report.generate"):
+        try:
+            prompt = build_prompt("report", REPORT_PROMPT_TEMPLATE, business_problem=business_problem)
+            response = llm.generate("report", prompt)
+            
+            if not response or not response.text:
+                return "No content generated from Gemini AI. Please try again.", []
+            
+            report_text = response.text
+            report_text = insert_use_case_diagrams(report_text, business_problem, diagram_cache)
+            image_paths, error_blocks, fixed_blocks = extract_and_render_mermaid(report_text, business_problem=business_problem)
+            
+            return report_text, image_paths
         
-    except Exception as e:
-        return f"Unexpected error in report generation: {str(e)}", []
+        except JobCancelledError:
+            raise  # Not a result: the caller reports it (and a shared flight re-runs it for others)
+        except Exception as e:
+            return _report_error_message(e), []
+
+async def generate_report_and_images_async(business_problem, diagram_cache=None):
+    """Async variant of generate_report_and_images (use-case diagrams are generated concurrently)"""
+    with telemetry.span("report.generate", mode="async"):
+        try:
+            prompt = build_prompt("report", REPORT_PROMPT_TEMPLATE, business_problem=business_problem)
+            response = await llm.generate_async("report", prompt)
+            
+            if not response or not response.text:
+                return "No content generated from Gemini AI. Please try again.", []
+            
+            report_text = await insert_use_case_diagrams_async(response.text, business_problem, diagram_cache)
+            # Rendering runs mmdc subprocesses; keep it off the event loop
+            image_paths, error_blocks, fixed_blocks = await asyncio.to_thread(
+                extract_and_render_mermaid, report_text, MERMAID_CACHE_DIR, business_problem
+            )
+            return report_text, image_paths
+        except JobCancelledError:
+            raise
+        except Exception as e:
+            return _report_error_message(e), []
+
+def _report_error_message(e):
+    if isinstance(e, JobCancelledError):
+        return f"Report generation was stopped before any content was produced ({str(e)})."
+    if isinstance(e, CircuitOpenError):
+        return f"Gemini AI is temporarily unavailable after repeated failures. {str(e)}"
+    error_msg = str(e)
+    if classify_error(e) in ("overloaded", "rate_limit", "timeout"):
+        return f"API is currently overloaded. Please try again in a few minutes. Error: {error_msg}"
+    return f"Error generating report: {error_msg}"
 
 
+SECTION_PROMPT_TEMPLATE = '''
+You are an expert Business Analyst specializing in banking and fintech. You are updating one section of an existing business analysis report because the business problem/objective was edited. Rewrite ONLY this section in Markdown, starting with the heading "{heading}":
+{instructions}
+
+IMPORTANT:
+- Format the section with Markdown (### for sub-sections, * for bullet points, 1. for numbered lists).
+- Do NOT output any other section, introduction or generic template content—make all content specific to the business problem.
+{context}
+Business Problem:
+{business_problem}
+'''
+
+def generate_report_section(spec, business_problem, context):
+    """Generate one report section; context maps dependency keys to their current text"""
+    context_text = ""
+    if context:
+        context_text = "\nKeep the section consistent with these related sections of the report:\n" + "\n".join(context.values())
+    # Related sections are trimmed before the business problem
+    prompt = build_prompt(
+        "report_section", SECTION_PROMPT_TEMPLATE,
+        priorities={"business_problem": 1, "heading": 2, "instructions": 2},
+        heading=spec["heading"], instructions=spec["instructions"],
+        context=context_text, business_problem=business_problem,
+    )
+    try:
+        response = llm.generate("report_section", prompt)
+        text = response.text.strip() if response and response.text else ""
+    except cancellation.JobCancelledError:
+        raise  # Stops the update; ReportState keeps the remaining sections stale
+    except Exception as e:
+        print(f"⚠️ Could not regenerate the {spec['key']} section: {e}")
+        return None
+    if text and not text.startswith("##"):
+        text = f"{spec['heading']}\n\n{text}"
+    return text or None
+
+def regenerate_report_incrementally(business_problem, state):
+    """Regenerate only the sections of a stored report affected by a problem edit"""
+    with telemetry.span("report.incremental") as incremental_span:
+        summary = state.regenerate(business_problem, generate_report_section)
+        report_text = state.report_text()
+        if "use_cases" in summary["regenerated"]:
+            report_text = insert_use_case_diagrams(report_text, business_problem, state.diagram_cache)
+            state.replace_report(report_text)
+        image_paths, error_blocks, fixed_blocks = extract_and_render_mermaid(report_text, business_problem=business_problem)
+        incremental_span.set(
+            regenerated=len(summary["regenerated"]), reused=len(summary["reused"]),
+            lines_changed=summary["lines_changed"], failed=len(summary["failed"]),
+        )
+        incremental_span.cache_hit = not summary["regenerated"]
+        return report_text, image_paths, summary
 
 def remove_emojis(text):
     emoji_pattern = re.compile(
@@ -334,6 +582,8 @@ def remove_emojis(text):
     return emoji_pattern.sub(r'', text)
 
 def remove_sticker_images(html_content):
+    from bs4 import BeautifulSoup, Tag
+
     soup = BeautifulSoup(html_content, 'html.parser')
     for img in soup.find_all('img'):
         if isinstance(img, Tag):
@@ -343,6 +593,8 @@ def remove_sticker_images(html_content):
     return str(soup)
 
 def remove_llm_intro_paragraph(html_content):
+    from bs4 import BeautifulSoup, Tag
+
     soup = BeautifulSoup(html_content, 'html.parser')
     first_p = soup.find('p')
     if first_p and isinstance(first_p, Tag):
@@ -474,12 +726,495 @@ def wrap_html_with_css(html_content):
     return f'<html><head>{css}</head><body>{html_content}</body></html>'
 
 def html_to_pdf_with_playwright(html_content, output_pdf_path):
-    with sync_playwright() as p:
-        browser = p.chromium.launch()
-        page = browser.new_page()
-        page.set_content(html_content, wait_until="load")
-        page.pdf(path=output_pdf_path, format="A4", print_background=True, margin={"top": "1cm", "bottom": "1cm", "left": "1cm", "right": "1cm"})
-        browser.close()
+    """Export in a child process (pdf_export.py) so a cancelled job can kill it and its browser"""
+    with telemetry.span("pdf.export", html_bytes=len(html_content)):
+        html_path = f"{output_pdf_path}.html"
+        log_path = f"{output_pdf_path}.log"
+        with open(html_path, "w", encoding="utf-8") as f:
+            f.write(html_content)
+        try:
+            with open(log_path, "w", encoding="utf-8") as log:
+                cancellation.run_process(
+                    [sys.executable, os.path.join(APP_DIR, PDF_EXPORT_SCRIPT), html_path, output_pdf_path],
+                    timeout=PDF_EXPORT_TIMEOUT, stdout=subprocess.DEVNULL, stderr=log,
+                )
+        except subprocess.CalledProcessError:
+            with open(log_path, encoding="utf-8", errors="replace") as log:
+                lines = [line.strip() for line in log if line.strip()]
+            errors = [line for line in lines if "Error" in line] or lines or ["unknown error"]
+            raise RuntimeError(f"PDF export failed: {errors[-1]}")
+        finally:
+            _remove_partial(html_path)
+            _remove_partial(log_path)
+
+def build_pdf_html(report_html):
+    """Report HTML -> final printable HTML (CSS included)"""
+    with telemetry.span("pdf.html_postprocess"):
+        html_clean = remove_sticker_images(report_html)
+        html_clean = remove_emojis(html_clean)
+        html_clean = remove_llm_intro_paragraph(html_clean)
+        return wrap_html_with_css(html_clean)
+
+def get_session_id():
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        return ctx.session_id
+    if 'session_id' not in st.session_state:
+        st.session_state['session_id'] = uuid.uuid4().hex
+    return st.session_state['session_id']
+
+def llm_session(status):
+    """Attribute model calls to this session and show its queue position in `status`"""
+    def on_wait(position):
+        status.info(f"Waiting for model capacity: position {position} in the queue")
+    return request_context(session_id=get_session_id(), on_wait=on_wait)
+
+def session_ended(session_id):
+    try:
+        from streamlit.runtime import Runtime
+        return Runtime.exists() and not Runtime.instance().is_active_session(session_id)
+    except Exception:
+        return False
+
+class RunGeneration:
+    """Number of full script runs of a session, kept in st.session_state['run_generation']"""
+
+    def __init__(self):
+        self.value = 0
+
+def advance_run_generation():
+    """Called at the start of every full script run (fragment reruns do not supersede jobs)"""
+    st.session_state.setdefault('run_generation', RunGeneration()).value += 1
+
+def run_superseded(generation, started):
+    """True once the session has started a newer full script run than the job's"""
+    return generation is not None and generation.value != started
+
+def start_job(kind, key, background=False):
+    """Cancellation token for a job of this session (see cancellation.jobs).
+
+    Foreground jobs are cancelled when the user re-submits or leaves;
+    background jobs only when the session ends or starts a newer one.
+    A rerun requested while the job runs stops it at its next Streamlit
+    call; the generation check catches work still running after that.
+    """
+    session_id = get_session_id()
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        abandoned = None
+    elif background:
+        abandoned = lambda: session_ended(session_id)
+    else:
+        generation = st.session_state.get('run_generation')
+        started = generation.value if generation is not None else None
+        abandoned = lambda: session_ended(session_id) or run_superseded(generation, started)
+    return jobs.start(session_id, kind, key, abandoned=abandoned)
+
+def profile_job(kind, key):
+    """CPU profile of a job when CPU_PROFILE_ENABLED, or when the page was opened with ?profile=1"""
+    return cpu_profile.job(kind, key, enabled=CPU_PROFILE_ENABLED or st.query_params.get("profile") == "1")
+
+def show_profile(profile):
+    if profile is not None and profile.summary_path:
+        st.caption(f"CPU profile {profile.job_id}: {profile.summary_path}")
+
+@st.cache_data(show_spinner=False, max_entries=512)
+def section_html(markdown_text, strip_intro=False):
+    """Markdown -> cleaned HTML for one viewer block (cached across reruns and sessions)"""
+    import markdown
+
+    html = markdown.markdown(markdown_text, extensions=['tables', 'fenced_code'])
+    html = remove_emojis(html)
+    if strip_intro:
+        html = remove_llm_intro_paragraph(html)
+    return f'<div class="html-report">{html}</div>'
+
+@st.fragment
+def render_report_view():
+    """Collapsible report sections; closed sections are not computed or sent to the browser"""
+    report_data = st.session_state['report_data']
+    if report_data.get('partial'):
+        st.warning(
+            f"Report generation was stopped early ({report_data['partial']}). "
+            "Showing the parts that finished; missing diagrams are shown as Mermaid code."
+        )
+    if report_data.get('intro', '').strip():
+        st.html(section_html(report_data['intro'], strip_intro=True))
+    for idx, section in enumerate(report_data.get('sections', [])):
+        box = st.expander(
+            section['title'], expanded=idx == 0, key=f"report_section_{report_data['id']}_{idx}", on_change="rerun"
+        )
+        if not box.open:
+            continue
+        with box:
+            for kind, value in section['blocks']:
+                if kind == "image":
+                    st.image(value, width="stretch")
+                elif kind == "mermaid":
+                    st.code(value, language="mermaid")
+                else:
+                    st.html(section_html(value))
+
+@st.fragment
+def render_pdf_controls():
+    pdf_col1, pdf_col2 = st.columns([1, 1])
+    with pdf_col1:
+        if st.button("Download PDF", use_container_width=True):
+            report_html = st.session_state['report_data']['html']
+            pdf_key = pdf_cache.html_key(report_html)
+            job = start_job("pdf", pdf_key)
+            with st.spinner("Generating PDF..."), cancellation.scope(job), profile_job("pdf", pdf_key) as profile:
+                try:
+                    # Reuses the background render (or joins it) when the report is unchanged
+                    st.session_state['pdf_path'] = pdf_cache.render_report(
+                        report_html, build_pdf_html, html_to_pdf_with_playwright
+                    )
+                except JobCancelledError:
+                    st.warning(f"PDF export was stopped ({job.reason}).")
+                finally:
+                    jobs.finish(get_session_id(), "pdf", pdf_key)
+            show_profile(profile)
+    with pdf_col2:
+        if st.session_state['pdf_path']:
+            with open(st.session_state['pdf_path'], "rb") as f:
+                st.download_button(
+                    label="Download PDF File",
+                    data=f,
+                    file_name="business_analysis_report.pdf",
+                    mime="application/pdf",
+                    use_container_width=True
+                )
+
+def render_mockup(mockup):
+    """Preview and download of a generated (or reopened) mockup"""
+    st.subheader("Generated HTML Mockup Preview")
+    st.components.v1.html(mockup['html'], height=600, scrolling=True)
+    timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(mockup['created']))
+    st.download_button(
+        label="Download HTML Mockup",
+        data=mockup['html'],
+        file_name=f"{mockup['app_type']}_mockup_{timestamp}.html",
+        mime="text/html",
+        use_container_width=True
+    )
+
+def show_live_preview(placeholder, html):
+    """Partial mockup page while it streams in (see html_stream.py)"""
+    with placeholder.container():
+        st.caption("Live preview: the mockup is still being generated...")
+        st.components.v1.html(html, height=600, scrolling=True)
+
+@st.fragment
+def render_mockup_controls():
+    brd_text = st.session_state['report_data']['business_problem']
+    force = st.session_state.pop('force_mockup', False)
+    if st.button("Generate Mockup", use_container_width=True) or force:
+        if not force and serve_similar_mockup(brd_text):
+            return
+        queue_status = st.empty()
+        live_preview = st.empty()
+        with st.spinner("Generating HTML mockup..."), llm_session(queue_status):
+            try:
+                agent = get_agent()
+                
+                if not agent.client:
+                    st.error("Gemini AI client not available. Please check your API key.")
+                    return
+                
+                brd_key = make_key(brd_text)
+                classified = known_app_type(brd_text)
+                previous = None if force else previous_mockup(brd_text)
+                # A forced full page never joins (or is joined by) an incremental update, nor updates of other versions
+                flight_key = make_key(brd_text, "full" if force else "incremental", previous['id'] if previous else "")
+                job = start_job("mockup", flight_key)
+
+                def run_mockup():
+                    if MOCKUP_PREFETCH_ENABLED and not force:
+                        prefetched = prefetcher.take(get_session_id(), brd_key, timeout=job.remaining())
+                        if prefetched is not None:
+                            return prefetched
+                    return agent.generate_mockup(
+                        brd_text, lambda: job.cancelled, classified, lambda html: show_live_preview(live_preview, html),
+                        previous,
+                    )
+
+                try:
+                    with cancellation.scope(job), profile_job("mockup", brd_key) as profile:
+                        mockup, shared = flight("mockup").do(flight_key, run_mockup)
+                finally:
+                    jobs.finish(get_session_id(), "mockup", flight_key)
+                queue_status.empty()
+                live_preview.empty()
+                show_profile(profile)
+                if shared:
+                    st.caption("Joined an identical mockup request that was already in progress.")
+                show_incremental_mockup(mockup.get("incremental"), previous)
+                app_type, schema, html_content = mockup["app_type"], mockup["schema"], mockup["html"]
+                if mockup.get("cancelled"):
+                    st.warning(f"Mockup generation was stopped ({job.reason or 'cancelled'}); showing the steps that finished.")
+                    if not schema:
+                        return
+                    if not html_content:
+                        html_content = agent._get_fallback_html(app_type)
+                if not schema:
+                    st.error("Failed to generate UI schema")
+                    return
+                
+                if not html_content:
+                    st.error("Failed to convert schema to HTML")
+                    return
+                
+                timestamp = time.strftime("%Y%m%d_%H%M%S")
+                outputs = agent.save_outputs(schema, html_content, app_type, timestamp)
+                
+                if outputs and outputs.get('html'):
+                    st.success("Mockup generated successfully!")
+                    save_to_history(
+                        report_history.save_mockup, brd_text, app_type, schema, html_content, mockup.get("previous_id")
+                    )
+                    st.session_state['mockup'] = {"app_type": app_type, "html": html_content, "created": time.time()}
+                    render_mockup(st.session_state['mockup'])
+                else:
+                    st.error("Failed to save mockup outputs")
+                    
+            except Exception as e:
+                st.error(f"Error generating mockup: {str(e)}")
+                st.info("This might be due to API limitations on Streamlit Cloud. Try running locally for full functionality.")
+    elif st.session_state.get('mockup'):
+        render_mockup(st.session_state['mockup'])
+    else:
+        similar = find_similar("mockup", brd_text)
+        if similar:
+            st.caption(f"A mockup for a near-identical problem is in the history ({similar_label(similar)}).")
+            if st.button("Open the similar mockup", key="open_similar_mockup"):
+                mockup = report_history.load_mockup(similar['id'])
+                if mockup:
+                    st.session_state['mockup'] = mockup
+                    render_mockup(mockup)
+
+def previous_mockup(brd_text):
+    """Stored mockup a new one is derived from (see incremental_mockup.py): the newest for this BRD, else the most similar, or None"""
+    if not (MOCKUP_INCREMENTAL_ENABLED and REPORT_HISTORY_ENABLED):
+        return None
+    try:
+        previous = report_history.latest_mockup(brd_text)
+        if previous is None:
+            similar = find_similar("mockup", brd_text, MOCKUP_INCREMENTAL_MIN_SIMILARITY)
+            previous = report_history.load_mockup(similar['id']) if similar else None
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not load the previous mockup: {e}")
+        return None
+    return previous
+
+def show_incremental_mockup(summary, previous):
+    """What an incremental mockup update reused and regenerated"""
+    if not summary or not previous:
+        return
+    version = previous.get('version', 1)
+    if summary['mode'] == "reuse":
+        st.caption(f"The UI schema did not change: reused mockup version {version} as it is.")
+    elif summary['mode'] == "splice":
+        st.caption(
+            f"Updated mockup version {version}: reused {summary['reused']} component(s), regenerated "
+            f"{summary['changed'] + summary['added']} ({summary['added']} new) and removed {summary['removed']}."
+        )
+    else:
+        st.caption(f"Regenerated the whole mockup instead of updating version {version} ({summary['reason']}).")
+
+def known_app_type(brd_text):
+    """App type already classified for exactly this BRD text (while its PDF was read), or None"""
+    known = st.session_state.get('brd_app_type')
+    return known['app_type'] if known and known['key'] == make_key(brd_text) else None
+
+def ingest_pdf(uploaded):
+    """Read an uploaded BRD PDF into the input box, classifying it from the first pages (see pdf_ingest.py)"""
+    from contextlib import closing
+
+    import pdf_ingest
+    from enhanced_agent import page_block
+
+    agent = get_agent()
+    progress = st.progress(0.0, text=f"Reading {uploaded.name}...")
+    found = st.empty()
+    state = None
+    try:
+        with request_context(session_id=get_session_id()), closing(pdf_ingest.ingest(
+            agent.iter_pdf_pages(uploaded), agent.analyze_brd_content_async, page_block
+        )) as states:
+            for state in states:
+                if state.total:
+                    progress.progress(state.pages / state.total, text=f"Reading {uploaded.name}: page {state.pages} of {state.total}")
+                if state.app_type:
+                    found.caption(
+                        f"Detected a {state.app_type} application from the first {state.classified_at_page} "
+                        f"page(s) after {state.first_result_s:.1f} s"
+                    )
+    except Exception as e:
+        st.session_state['ingested_pdf'] = {"file_id": uploaded.file_id, "error": str(e)}
+        st.error(f"Could not read {uploaded.name}: {e}")
+        return
+    finally:
+        progress.empty()
+    text = state.text if state else ""
+    st.session_state['ingested_pdf'] = {
+        "file_id": uploaded.file_id, "name": uploaded.name, "pages": state.pages if state else 0,
+        "app_type": state.app_type if state else None, "error": None,
+    }
+    st.session_state['brd_app_type'] = {"key": make_key(text), "app_type": state.app_type if state else None}
+    st.session_state['pending_problem'] = text
+
+def render_pdf_upload():
+    """Optional BRD PDF upload; its condensed text replaces the input box contents"""
+    uploaded = st.file_uploader("Or upload a BRD PDF", type=["pdf"], key="brd_pdf")
+    if uploaded is None:
+        return
+    if st.session_state.get('ingested_pdf', {}).get('file_id') != uploaded.file_id:
+        ingest_pdf(uploaded)
+    info = st.session_state.get('ingested_pdf')
+    if info and not info['error']:
+        st.caption(f"Loaded {info['name']}: {info['pages']} page(s), {info['app_type']} application.")
+
+def get_agent():
+    """The session's mockup agent, created (and enhanced_agent/pdfplumber imported) on first use"""
+    if 'ba_agent' not in st.session_state:
+        from enhanced_agent import EnhancedBRDAgent
+
+        st.session_state['ba_agent'] = EnhancedBRDAgent()
+    return st.session_state['ba_agent']
+
+def store_report(business_problem, report, images, partial=None):
+    """Build the viewer and PDF data for a report and keep it in the session; returns the report HTML.
+
+    partial is the reason the job was stopped early, if it was.
+    """
+    import markdown
+
+    report_markdown = report
+    with telemetry.span("report.embed_images", images=len(images)):
+        report = embed_report_images(report, images)
+    with telemetry.span("report.markdown", chars=len(report)):
+        html_report = markdown.markdown(report, extensions=['tables', 'fenced_code'])
+    with telemetry.span("report.html_postprocess"):
+        html_report = f'<div class="html-report">{html_report}</div>'
+        html_report = remove_emojis(html_report)
+        html_report = remove_llm_intro_paragraph(html_report)
+    with telemetry.span("report.view"):
+        intro, sections = build_report_view(report_markdown, images)
+    st.session_state['report_data'] = {
+        "html": html_report, "business_problem": business_problem,
+        "id": uuid.uuid4().hex[:8], "intro": intro, "sections": sections, "partial": partial,
+    }
+    st.session_state['pdf_path'] = None
+    st.session_state['mockup'] = None
+    return html_report
+
+def save_to_history(save, *args):
+    """Keep a report or mockup in the history; returns its id (None if the history is off or failed)"""
+    if not REPORT_HISTORY_ENABLED:
+        return None
+    try:
+        return save(*args)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ Could not save to the report history: {e}")
+        return None
+
+def open_from_history(entry, business_problem=None):
+    """Show a stored report (with its newest mockup) again, without any model calls; False if it is gone.
+
+    The input box is set to the stored business problem, unless the report is
+    served for a near-identical business_problem the user entered.
+    """
+    if entry['kind'] == "mockup":
+        mockup = report_history.load_mockup(entry['id'])
+        report_id = report_history.latest_report_id(mockup['business_problem']) if mockup else None
+    else:
+        report_id = entry['id']
+        mockup = None
+    stored = report_history.load_report(report_id, MERMAID_CACHE_DIR) if report_id else None
+    if stored is None:
+        return False
+    stored_problem = stored['business_problem']
+    store_report(business_problem or stored_problem, stored['report'], stored['images'], stored['partial'])
+    st.session_state['report_data']['history_id'] = stored['id']
+    st.session_state['report_state'] = ReportState.from_report(stored_problem, stored['report'])
+    st.session_state['mockup'] = mockup or report_history.latest_mockup(stored_problem)
+    if business_problem is None:
+        st.session_state['pending_problem'] = stored_problem
+    return True
+
+def find_similar(kind, text, threshold=NEAR_DUPLICATE_OFFER_THRESHOLD):
+    """Earlier report/mockup for a near-identical business problem (see near_duplicates.py), or None"""
+    if not (REPORT_HISTORY_ENABLED and NEAR_DUPLICATE_ENABLED) or not text.strip():
+        return None
+    try:
+        return near_duplicates.find(kind, text, threshold)
+    except sqlite3.Error as e:
+        print(f"⚠️ Near-duplicate lookup failed: {e}")
+        return None
+
+def similar_label(entry):
+    created = time.strftime("%d %b %H:%M", time.localtime(entry['created']))
+    return f"{entry['similarity']:.0%} similar, from {created}"
+
+def force_generate(kind):
+    """Button callback: generate a new report/mockup on the next run even though a similar one exists"""
+    st.session_state[f'force_{kind}'] = True
+
+def serve_similar_report(entry, business_problem):
+    """Show a near-identical earlier report instead of generating one; False if it is gone"""
+    with telemetry.span("report.near_duplicate", similarity=round(entry['similarity'], 3)) as served:
+        if not open_from_history(entry, business_problem):
+            return False
+        served.cache_hit = True
+    st.caption(f"Reused the report for a near-identical problem ({similar_label(entry)}) without calling the model.")
+    st.button("Generate a new report instead", on_click=force_generate, args=("report",))
+    return True
+
+def serve_similar_mockup(brd_text):
+    """Show the mockup of a near-identical earlier problem instead of generating one; True if served"""
+    similar = find_similar("mockup", brd_text)
+    if similar is None or similar['similarity'] < NEAR_DUPLICATE_AUTO_SERVE:
+        return False
+    with telemetry.span("mockup.near_duplicate", similarity=round(similar['similarity'], 3)) as served:
+        mockup = report_history.load_mockup(similar['id'])
+        if mockup is None:
+            return False
+        served.cache_hit = True
+    st.session_state['mockup'] = mockup
+    st.caption(f"Reused the mockup for a near-identical problem ({similar_label(similar)}) without calling the model.")
+    st.button("Generate a new mockup instead", on_click=force_generate, args=("mockup",))
+    render_mockup(mockup)
+    return True
+
+@st.fragment
+def render_history():
+    """Sidebar search over past reports and mockups; opening one reruns the whole app"""
+    st.markdown("### Report history")
+    query = st.text_input("Search past reports", key="history_query", placeholder="e.g. loan offers mobile app")
+    try:
+        entries = report_history.search(query)
+    except sqlite3.Error as e:
+        st.caption(f"History unavailable: {e}")
+        return
+    if not entries:
+        st.caption("No matching reports." if query.strip() else "Generated reports will appear here.")
+    for entry in entries:
+        created = time.strftime("%d %b %H:%M", time.localtime(entry['created']))
+        label = f"{entry['title']} · {created} · {entry['business_problem'][:60]}"
+        if st.button(label, key=f"history_{entry['kind']}_{entry['id']}", use_container_width=True):
+            if open_from_history(entry):
+                st.rerun()
+            st.warning("This report is no longer in the history.")
+        if entry['section']:
+            st.caption(f"{entry['section']}: {entry['snippet']}" if entry['snippet'] else entry['section'])
+
+def start_pdf_prerender(html_report):
+    """Background PDF render, cancelled if the session ends or generates a newer report"""
+    session_id = get_session_id()
+    key = pdf_cache.html_key(html_report)
+    token = start_job("pdf_prerender", key, background=True)
+    future = pdf_cache.prerender(html_report, build_pdf_html, html_to_pdf_with_playwright, token=token)
+    future.add_done_callback(lambda f: jobs.finish(session_id, "pdf_prerender", key))
 
 # --- Streamlit UI for Agentic BA Dashboard ---
 def main():
@@ -490,123 +1225,143 @@ def main():
     st.markdown("Welcome to your AI-powered business analysis system!")  # Updated for deployment
     
     # Initialize session state
+    advance_run_generation()
     if 'report_data' not in st.session_state:
         st.session_state['report_data'] = {"html": "", "business_problem": ""}
     if 'pdf_path' not in st.session_state:
         st.session_state['pdf_path'] = None
-    # Initialize BA agent only once
-    if 'ba_agent' not in st.session_state:
-        st.session_state['ba_agent'] = EnhancedBRDAgent()
+    if TELEMETRY_SIDEBAR:
+        telemetry.render_sidebar_panel()
+    if MEMORY_PROFILE_ENABLED:
+        memory_profile.render_sidebar_panel()
+    if REPORT_HISTORY_ENABLED:
+        with st.sidebar:
+            render_history()
 
     # Business Problem Input Section
     st.markdown("### Business Problem / Objective")
+    render_pdf_upload()
+    if 'pending_problem' in st.session_state:
+        # Set by reopening a report from the history, before the widget exists in this run
+        st.session_state['business_problem'] = st.session_state.pop('pending_problem')
     business_problem = st.text_area(
         "Business Problem / Objective",
-        value="",
+        key="business_problem",
         height=200,
         placeholder="Paste your business case or objective here..."
     )
     
+    if MOCKUP_PREFETCH_ENABLED and st.session_state['report_data']['html']:
+        # A speculative mockup for a problem the user has since edited is no longer useful
+        prefetcher.cancel_unless(get_session_id(), make_key(business_problem))
+
+    # Earlier report for a near-identical problem: offered here, reused by Generate Report above NEAR_DUPLICATE_AUTO_SERVE
+    similar = find_similar("report", business_problem)
+    offer = st.empty()
+
     # Generate Report button
-    if st.button("Generate Report", type="primary", use_container_width=True):
-        with st.spinner("Generating report... (this may take a moment)"):
+    force = st.session_state.pop('force_report', False)
+    generate = st.button("Generate Report", type="primary", use_container_width=True) or force
+    if generate and similar and not force and similar['similarity'] >= NEAR_DUPLICATE_AUTO_SERVE:
+        generate = not serve_similar_report(similar, business_problem)
+    if generate:
+        queue_status = st.empty()
+        report_key = make_key(business_problem)
+        # Cancelled when the user re-submits or leaves; finished parts are still shown
+        job = start_job("report", report_key)
+        notes = []
+        with st.spinner("Generating report... (this may take a moment)"), llm_session(queue_status), \
+                cancellation.scope(job), profile_job("report", report_key) as profile:
             try:
-                report, images = generate_report_and_images(business_problem)
+                # A forced run is a fresh generation, not an incremental update of the reused report
+                state = st.session_state.get('report_state') if REPORT_INCREMENTAL_ENABLED and not force else None
+                outdated = []  # Sections an incremental update could not regenerate
+                if state is not None and len(state.plan(business_problem)) < len(SECTION_KEYS):
+                    # Small edit: reuse unchanged sections and their diagrams
+                    report, images, summary = regenerate_report_incrementally(business_problem, state)
+                    notes.append(
+                        f"Updated {len(summary['regenerated'])} of {len(SECTION_KEYS)} sections "
+                        f"({summary['lines_changed']} lines changed); the rest were reused."
+                    )
+                    outdated = summary['failed']
+                    if outdated:
+                        notes.append(
+                            f"{len(outdated)} section(s) could not be updated and kept their previous "
+                            "text; they are retried with the next update."
+                        )
+                else:
+                    # Identical problems submitted concurrently share one generation
+                    diagram_cache = {}
+                    try:
+                        (report, images), shared = flight("report").do(
+                            report_key,
+                            lambda: event_loop.run(generate_report_and_images_async(business_problem, diagram_cache)),
+                        )
+                    except JobCancelledError as e:
+                        # Stopped before the report text existed; stored below as a partial result
+                        (report, images), shared = (_report_error_message(e), []), False
+                    if shared:
+                        notes.append("Joined an identical report request that was already in progress.")
+                    st.session_state['report_state'] = ReportState.from_report(business_problem, report, diagram_cache)
+                # Store before any other UI call: an abandoned run stops at the next one
+                partial = job.reason if job.cancelled else None
+                if partial is None and outdated:
+                    # Not offered for near-duplicate reuse while sections are outdated
+                    partial = f"{len(outdated)} section(s) not updated"
+                html_report = store_report(business_problem, report, images, partial)
+                st.session_state['report_data']['history_id'] = save_to_history(
+                    report_history.save_report, business_problem, report, images, partial
+                )
             except Exception as e:
                 st.error(f"Error generating report: {str(e)}")
                 return
-        
-        # Only process images if report generation was successful
-        if 'report' in locals() and 'images' in locals():
-            for idx, img_path in enumerate(images, 1):
-                if os.path.exists(img_path):
-                    with open(img_path, "rb") as img_file:
-                        b64 = base64.b64encode(img_file.read()).decode("utf-8")
-                    img_tag = f'<img src="data:image/png;base64,{b64}" style="max-width:100%; margin: 20px 0;" />'
-                    report = re.sub(r"```mermaid[\s\S]*?```", img_tag, report, count=1)
-            html_report = markdown.markdown(report, extensions=['tables', 'fenced_code'])
-            html_report = f'<div class="html-report">{html_report}</div>'
-            html_report = remove_emojis(html_report)
-            html_report = remove_llm_intro_paragraph(html_report)
-            st.session_state['report_data'] = {"html": html_report, "business_problem": business_problem}
-            st.session_state['pdf_path'] = None
-
-    # PDF buttons (when report exists)
+            finally:
+                jobs.finish(get_session_id(), "report", report_key)
+                queue_status.empty()
+        for note in notes:
+            st.caption(note)
+        show_profile(profile)
+
+        if not job.cancelled:
+            if PDF_PRERENDER_ENABLED:
+                start_pdf_prerender(html_report)
+            agent = get_agent() if MOCKUP_PREFETCH_ENABLED else None
+            if agent is not None and agent.client:
+                prefetch_key = make_key(business_problem)
+                classified = known_app_type(business_problem)
+                previous = previous_mockup(business_problem)
+                session_id = get_session_id()
+                prefetcher.start(
+                    session_id, prefetch_key,
+                    lambda should_cancel: agent.generate_mockup(
+                        business_problem, should_cancel, classified, previous=previous
+                    ),
+                    token=start_job("mockup_prefetch", prefetch_key, background=True),
+                    on_done=lambda: jobs.finish(session_id, "mockup_prefetch", prefetch_key),
+                )
+
+    if similar and similar['id'] != st.session_state['report_data'].get('history_id'):
+        with offer.container():
+            reuse = similar['similarity'] >= NEAR_DUPLICATE_AUTO_SERVE
+            st.info(
+                f"A report for a near-identical problem is in the history ({similar_label(similar)})."
+                + (" Generate Report will reuse it." if reuse else "")
+            )
+            if st.button("Open the similar report", key="open_similar_report"):
+                if open_from_history(similar):
+                    st.rerun()
+                st.warning("This report is no longer in the history.")
+
+    # PDF buttons (when report exists); fragments rerun on their own without re-sending the report
     if st.session_state['report_data']['html']:
-        pdf_col1, pdf_col2 = st.columns([1, 1])
-        with pdf_col1:
-            if st.button("Download PDF", use_container_width=True):
-                with st.spinner("Generating PDF..."):
-                    html_clean = remove_sticker_images(st.session_state['report_data']['html'])
-                    html_clean = remove_emojis(html_clean)
-                    html_clean = remove_llm_intro_paragraph(html_clean)
-                    html_final = wrap_html_with_css(html_clean)
-                    timestamp = time.strftime("%Y%m%d_%H%M%S")
-                    filename = f"business_analysis_report_{timestamp}.pdf"
-                    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-                    html_to_pdf_with_playwright(html_final, temp_file.name)
-                    st.session_state['pdf_path'] = temp_file.name
-        with pdf_col2:
-            if st.session_state['pdf_path']:
-                with open(st.session_state['pdf_path'], "rb") as f:
-                    st.download_button(
-                        label="Download PDF File",
-                        data=f,
-                        file_name="business_analysis_report.pdf",
-                        mime="application/pdf",
-                        use_container_width=True
-                    )
+        render_pdf_controls()
     
     # Full-width section below columns for better report display
     if st.session_state['report_data']['html']:
-        st.components.v1.html(st.session_state['report_data']['html'], height=1000, scrolling=True)
+        render_report_view()
 
         # --- Mockup Generation Integration ---
-        if st.button("Generate Mockup", use_container_width=True):
-            with st.spinner("Generating HTML mockup..."):
-                try:
-                    brd_text = st.session_state['report_data']['business_problem']
-                    agent = st.session_state['ba_agent']
-                    
-                    if not agent.client:
-                        st.error("Gemini AI client not available. Please check your API key.")
-                        return
-                    
-                    app_type = agent.analyze_brd_content(brd_text)
-                    schema = agent.generate_ui_schema(brd_text, app_type)
-                    if not schema:
-                        st.error("Failed to generate UI schema")
-                        return
-                    
-                    html_content = agent.convert_schema_to_html(schema, app_type, brd_text)
-                    if not html_content:
-                        st.error("Failed to convert schema to HTML")
-                        return
-                    
-                    timestamp = time.strftime("%Y%m%d_%H%M%S")
-                    outputs = agent.save_outputs(schema, html_content, app_type, timestamp)
-                    
-                    if outputs and outputs.get('html'):
-                        st.success("Mockup generated successfully!")
-                        
-                        # Display the HTML mockup directly in Streamlit
-                        st.subheader("Generated HTML Mockup Preview")
-                        st.components.v1.html(html_content, height=600, scrolling=True)
-                        
-                        # Download button
-                        st.download_button(
-                            label="Download HTML Mockup",
-                            data=html_content,
-                            file_name=f"{app_type}_mockup_{timestamp}.html",
-                            mime="text/html",
-                            use_container_width=True
-                        )
-                    else:
-                        st.error("Failed to save mockup outputs")
-                        
-                except Exception as e:
-                    st.error(f"Error generating mockup: {str(e)}")
-                    st.info("This might be due to API limitations on Streamlit Cloud. Try running locally for full functionality.")
+        render_mockup_controls()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,332 @@
+"""
+Fake Gemini Backend
+===================
+
+Deterministic local stand-in for `genai.GenerativeModel` used by the offline
+benchmarks. It recognises the prompts sent by the dashboard and the mockup
+agent and answers with canned content (reports with Mermaid and use-case
+blocks, Mermaid flowcharts, app types, UI schemas, HTML pages and mockup
+fragments) after a configurable simulated latency: fixed plus uniform
+jitter, or drawn per call type from a log-normal latency profile
+(LATENCY_PROFILES).
+"""
+
+import asyncio
+import json
+import math
+import random
+import re
+import sys
+import time
+import types
+
+
+# Per call type (median seconds, log-normal sigma), roughly what Gemini takes
+# for these prompts; the long tails are what make p95/p99 interesting
+LATENCY_PROFILES = {
+    "realistic": {
+        "report": (25.0, 0.35),
+        "report_section": (6.0, 0.4),
+        "use_case_diagram": (3.0, 0.45),
+        "classify": (0.8, 0.3),
+        "schema": (9.0, 0.4),
+        "mockup_html": (18.0, 0.4),
+        "mockup_fragments": (6.0, 0.4),
+        "other": (0.6, 0.3),
+    },
+}
+
+
+class FakeBackendConfig:
+    """Latency and content knobs for the fake model.
+
+    latency_profile maps a call type (see FakeGenerativeModel._kind) to a
+    (median, sigma) log-normal latency; time_scale shrinks sampled latencies
+    so load tests finish quickly while keeping the distribution's shape.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=0, use_cases=4, table_rows=8,
+                 report_repeat=1, schema_elements=40, app_type="banking", fail_first=0,
+                 fail_message="503 The model is overloaded", latency_profile=None, time_scale=1.0,
+                 html_reply=None, stream_chunk_chars=200):
+        self.latency = latency
+        self.jitter = jitter
+        self.latency_profile = latency_profile
+        self.time_scale = time_scale
+        self.seed = seed
+        self.use_cases = use_cases
+        self.table_rows = table_rows
+        self.report_repeat = report_repeat
+        self.schema_elements = schema_elements
+        self.app_type = app_type
+        self.fail_first = fail_first
+        self.fail_message = fail_message
+        # Replaces the mockup HTML, e.g. with an apology to exercise the early abort
+        self.html_reply = html_reply
+        self.stream_chunk_chars = stream_chunk_chars
+
+
+class _Usage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text, prompt):
+        self.text = text
+        self.usage_metadata = _Usage(estimate_tokens(prompt), estimate_tokens(text))
+
+
+class FakeStreamResponse:
+    """A `stream=True` response: chunks spread over the call's latency, the first after a tenth of it"""
+
+    FIRST_CHUNK_SHARE = 0.1
+
+    def __init__(self, response, delay, chunk_chars):
+        self.text = response.text
+        self.usage_metadata = response.usage_metadata
+        self._chunks = [self.text[i:i + chunk_chars] for i in range(0, len(self.text), chunk_chars)] or [""]
+        self._first = delay * self.FIRST_CHUNK_SHARE
+        self._between = delay * (1 - self.FIRST_CHUNK_SHARE) / max(1, len(self._chunks) - 1)
+
+    def __iter__(self):
+        for number, chunk in enumerate(self._chunks):
+            time.sleep(self._between if number else self._first)
+            yield types.SimpleNamespace(text=chunk)
+
+    async def __aiter__(self):
+        for number, chunk in enumerate(self._chunks):
+            await asyncio.sleep(self._between if number else self._first)
+            yield types.SimpleNamespace(text=chunk)
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def build_report(use_cases=4, table_rows=8, repeat=1):
+    """Canned Markdown report shaped like the real model output"""
+    parts = [
+        "Here is a complete business analysis report for the business problem.\n",
+        "## 01. Stakeholder Map\n",
+        "```mermaid\nflowchart TD\n    A[Bank Customer] --> B[Mobile App]\n    B --> C[Personalization Engine]\n"
+        "    C --> D[Core Banking System]\n    B --> E[Product Managers (Loans)]\n```\n",
+        "## 02. Process Flow\n",
+        "```mermaid\nflowchart TD\n    A[Customer Login] --> B[View Dashboard]\n    B --> C[Check Offers]\n"
+        "    C --> D[Apply for Loan]\n    D --> E[Receive Decision]\n```\n",
+    ]
+    for section in range(repeat):
+        parts.append(f"## 03. Business Requirement Document (BRD) {section + 1}\n")
+        for i in range(1, 9):
+            parts.append(f"* BR-{section}-{i}: The system shall personalise loan offers using transaction history and KYC data.\n")
+        parts.append(f"\n## 04. Functional Requirement Specification {section + 1}\n")
+        for i in range(1, 9):
+            parts.append(f"{i}. FR-{section}-{i}: The application must display eligible products within 2 seconds.\n")
+    parts.append("\n## 05. Use Case Diagrams and Scenarios\n")
+    for i in range(1, use_cases + 1):
+        parts.append(
+            f"**Use Case {i}:** Customer reviews personalised offer {i}\n"
+            f"**Actors:** Customer, Mobile App, Recommendation Engine\n"
+            f"**Preconditions:** Customer is logged in\n"
+            f"**Main Flow:** 1. Customer opens offers. 2. App requests recommendations. "
+            f"3. Engine returns offer {i}. 4. Customer applies.\n\n"
+        )
+    parts.append("## 06. Data Mapping Sheet\n\n")
+    parts.append("| Data Element | Source System(s) | Data Type | Frequency/Freshness | Purpose for Personalization |\n")
+    parts.append("|---|---|---|---|---|\n")
+    for i in range(table_rows):
+        parts.append(f"| Element {i} | Core Banking | String | Daily | Offer targeting |\n")
+    parts.append("\n## 07. Functional Scope Summary\n\n* In scope: offers\n* Out of scope: branch onboarding\n")
+    parts.append("\n## 08. Suggested KPIs\n\n* Loan uptake rate 😀\n* Offer click-through rate\n")
+    return "".join(parts)
+
+
+def build_section(heading, use_cases=4):
+    """Canned single report section for the incremental regeneration prompt"""
+    lines = [heading, ""]
+    if "Use Case" in heading:
+        for i in range(1, use_cases + 1):
+            lines.append(
+                f"**Use Case {i}:** Customer reviews updated offer {i}\n"
+                f"**Actors:** Customer, Mobile App\n"
+                f"**Main Flow:** 1. Customer opens offers. 2. App shows offer {i}.\n"
+            )
+    else:
+        lines.extend(f"* Updated point {i} for {heading.lstrip('# ')}" for i in range(1, 6))
+    return "\n".join(lines) + "\n"
+
+
+def build_use_case_diagram(seed):
+    return (
+        "```mermaid\nflowchart TD\n"
+        f"    A[Customer] --> B[Open Offers {seed}]\n"
+        "    B --> C[Recommendation Engine]\n"
+        "    C --> D[Show Offer]\n"
+        "    D --> E[Apply]\n```"
+    )
+
+
+def build_schema(elements=40):
+    schema = [{"type": "frame", "name": "Dashboard", "x": 0, "y": 0, "width": 1440, "height": 900}]
+    for i in range(elements):
+        card = f"Card {i // 5}"
+        if i % 5 == 0:
+            schema.append({"type": "rectangle", "name": card, "x": 20 + (i // 5) * 60, "y": 80,
+                           "width": 400, "height": 200, "parent": "Dashboard"})
+        schema.append({"type": "text", "name": f"Field {i}", "x": 30, "y": 90 + (i % 5) * 30,
+                       "width": 200, "height": 20, "content": f"Field {i}", "parent": card})
+    return json.dumps(schema)
+
+
+def build_components(components):
+    """Nested data-component elements for (name, parent) pairs, as the mockup prompts ask for"""
+    names = {name for name, _ in components}
+    children = {}
+    for name, parent in components:
+        children.setdefault(parent if parent in names else None, []).append(name)
+
+    def render(name):
+        inner = "".join(render(child) for child in children.get(name, []))
+        return f'<div class="card" data-component="{name}"><h3>{name}</h3><p>Rs. 1,25,000</p>{inner}</div>'
+    return "\n".join(render(name) for name in children.get(None, []))
+
+
+def prompt_components(text):
+    """(name, parent) pairs from the UI COMPONENTS list of an HTML prompt"""
+    section = re.search(r"UI COMPONENTS[^\n]*\n((?:- [^\n]*\n)+)", text)
+    if section is None:
+        return []
+    lines = re.findall(r"^- (.*?)(?: \(inside (.*)\))?$", section.group(1), re.MULTILINE)
+    return [(name, parent or None) for name, parent in lines]
+
+
+def build_fragments(text):
+    """JSON object of HTML fragments for the components of a fragment prompt"""
+    fragments = {}
+    for name, schema in re.findall(r"### Component: (.*)\nSchema:\n(.*)\n", text):
+        try:
+            elements = json.loads(schema)
+        except json.JSONDecodeError:
+            elements = []
+        pairs = [(element.get("name"), element.get("parent")) for element in elements if isinstance(element, dict)]
+        pairs = [(name, None)] + [pair for pair in pairs if pair[0] != name]
+        fragments[name] = build_components(pairs)
+    return json.dumps(fragments)
+
+
+def build_html(sections=12, components=None):
+    cards = build_components(components) if components else "\n".join(
+        f'<div class="card"><h3>Metric {i}</h3><p>Rs. 1,25,000</p><button>View</button></div>'
+        for i in range(sections)
+    )
+    return (
+        "```html\n<!DOCTYPE html>\n<html lang=\"en\">\n<head><meta charset=\"UTF-8\"><title>Dashboard</title>"
+        "<style>.card{padding:20px}</style></head>\n<body>\n"
+        f"{cards}\n</body>\n</html>\n```"
+    )
+
+
+class FakeGenerativeModel:
+    """Drop-in replacement for `genai.GenerativeModel`"""
+
+    config = FakeBackendConfig()
+    calls = 0
+
+    def __init__(self, model_name="fake-gemini", generation_config=None, **kwargs):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self._rng = random.Random(self.config.seed)
+
+    def _delay(self, kind="other"):
+        cfg = self.config
+        profile = cfg.latency_profile
+        if profile:
+            median, sigma = profile.get(kind, profile.get("other", (cfg.latency or 0.001, 0.0)))
+            return self._rng.lognormvariate(math.log(median), sigma) * cfg.time_scale
+        delay = cfg.latency
+        if cfg.jitter:
+            delay += self._rng.uniform(0, cfg.jitter)
+        return delay * cfg.time_scale
+
+    @staticmethod
+    def _kind(text):
+        """Which dashboard/agent prompt this is, from the instruction parts only (never the user input)"""
+        head, tail = text.lstrip()[:400], text.rstrip()[-400:]
+        if "updating one section" in head:
+            return "report_section"
+        if "updating parts of an existing HTML mockup" in head:
+            return "mockup_fragments"
+        if "complete business analysis report" in head:
+            return "report"
+        if "determine the primary type of application" in head:
+            return "classify"
+        if "JSON schema" in head:
+            return "schema"
+        if "HTML mockup" in head:
+            return "mockup_html"
+        if "Generate a unique Mermaid diagram" in tail:
+            return "use_case_diagram"
+        return "other"
+
+    def _respond(self, text, kind):
+        cfg = self.config
+        type(self).calls += 1
+        if type(self).calls <= cfg.fail_first:
+            raise RuntimeError(cfg.fail_message)
+        if kind == "report_section":
+            heading = re.search(r'starting with the heading "(.*?)"', text)
+            body = build_section(heading.group(1) if heading else "## Section", cfg.use_cases)
+        elif kind == "report":
+            body = build_report(cfg.use_cases, cfg.table_rows, cfg.report_repeat)
+        elif kind == "classify":
+            body = cfg.app_type
+        elif kind == "schema":
+            body = build_schema(cfg.schema_elements)
+        elif kind == "mockup_html":
+            body = build_html(components=prompt_components(text)) if cfg.html_reply is None else cfg.html_reply
+        elif kind == "mockup_fragments":
+            body = build_fragments(text)
+        elif kind == "use_case_diagram":
+            body = build_use_case_diagram(type(self).calls)
+        else:
+            body = "Hello! How can I help you today?"
+        return FakeResponse(body, text)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        text = prompt if isinstance(prompt, str) else str(prompt)
+        kind = self._kind(text)
+        if stream:
+            return FakeStreamResponse(self._respond(text, kind), self._delay(kind), self.config.stream_chunk_chars)
+        time.sleep(self._delay(kind))
+        return self._respond(text, kind)
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        text = prompt if isinstance(prompt, str) else str(prompt)
+        kind = self._kind(text)
+        if stream:
+            return FakeStreamResponse(self._respond(text, kind), self._delay(kind), self.config.stream_chunk_chars)
+        await asyncio.sleep(self._delay(kind))
+        return self._respond(text, kind)
+
+    def count_tokens(self, prompt):
+        return types.SimpleNamespace(total_tokens=estimate_tokens(str(prompt)))
+
+
+def install(config=None):
+    """Replace `google.generativeai.GenerativeModel` with the fake model"""
+    if config is not None:
+        FakeGenerativeModel.config = config
+    FakeGenerativeModel.calls = 0
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        # Benchmarks must run without the SDK installed
+        genai = types.ModuleType("google.generativeai")
+        google_pkg = sys.modules.setdefault("google", types.ModuleType("google"))
+        google_pkg.generativeai = genai
+        sys.modules["google.generativeai"] = genai
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.configure = lambda **kwargs: None
+    return FakeGenerativeModel
@@ -0,0 +1,39 @@
+"""
+Fake PDF Exporter
+=================
+
+Stand-in for pdf_export.py in load tests (PDF_EXPORT_SCRIPT): same command
+line, but instead of launching Chromium it waits a log-normal latency
+(FAKE_PDF_LATENCY median seconds, FAKE_PDF_SIGMA) and writes a tiny PDF.
+It still runs as a child process, so process start-up and cancellation
+behave like the real export.
+"""
+
+import math
+import os
+import random
+import sys
+import time
+
+MINIMAL_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+
+def export_pdf(html_path, pdf_path):
+    median = float(os.environ.get("FAKE_PDF_LATENCY", "2.5"))
+    sigma = float(os.environ.get("FAKE_PDF_SIGMA", "0.3"))
+    with open(html_path, encoding="utf-8") as f:
+        f.read()
+    time.sleep(random.lognormvariate(math.log(median), sigma) if median > 0 else 0)
+    with open(pdf_path, "wb") as f:
+        f.write(MINIMAL_PDF)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python fake_pdf_export.py input.html output.pdf")
+    export_pdf(sys.argv[1], sys.argv[2])
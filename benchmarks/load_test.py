@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Concurrent Session Load Test
+============================
+
+Drives N simulated analysts through the dashboard at the same time, in one
+process, the way a single Streamlit server would host them: each session is
+an AppTest instance of app_streamlit.py that loads the page, generates a
+report, exports the PDF and generates the mockup. Model calls go to the fake
+Gemini backend with per-call-type log-normal latencies
+(fake_gemini.LATENCY_PROFILES) and PDF exports to benchmarks/fake_pdf_export.py,
+so no API key or browser is needed.
+
+    python benchmarks/load_test.py                             # levels 1,2,4,8
+    python benchmarks/load_test.py --levels 1,8,32 --time-scale 0.1
+    python benchmarks/load_test.py --json load.json            # also write the results
+
+For each concurrency level it prints p50/p95/p99 latency per action, the
+error count, throughput (completed flows per minute) and the peak RSS of the
+process while the level ran. --time-scale shrinks every simulated latency
+(model and PDF), so compare levels within one run rather than absolute times
+with production.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app_streamlit.py")
+SAMPLE_PROBLEM = (
+    "A retail bank in Nepal wants to increase personal and home loan uptake by personalising "
+    "loan offers in its mobile app using transaction history, KYC data and customer segments."
+)
+ACTIONS = ("load", "report", "pdf", "mockup")
+
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "Mockup_design"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Session id of the simulated session running on the current worker thread
+_worker = threading.local()
+
+
+def setup(args):
+    """Environment for the app (before it is first imported) and the fake backends"""
+    import fake_gemini
+
+    workdir = tempfile.mkdtemp(prefix="ba_load_")
+    os.environ.setdefault("GEMINI_API_KEY", "offline-load-test")
+    os.environ.setdefault("TELEMETRY_LOG_PATH", os.path.join(workdir, "spans.jsonl"))
+    os.environ.setdefault("TELEMETRY_PROMETHEUS_PATH", os.path.join(workdir, "metrics.prom"))
+    os.environ["PDF_EXPORT_SCRIPT"] = os.path.join("benchmarks", "fake_pdf_export.py")
+    os.environ["FAKE_PDF_LATENCY"] = str(args.pdf_latency * args.time_scale)
+    os.environ["MOCKUP_PREFETCH_ENABLED"] = "0"
+    if not args.quota:
+        # Measure the process, not the API quota (see config.py for the real budgets)
+        os.environ["LLM_REQUESTS_PER_MINUTE"] = str(10 ** 6)
+        os.environ["LLM_TOKENS_PER_MINUTE"] = str(10 ** 12)
+        os.environ["LLM_MAX_CONCURRENT"] = str(10 ** 6)
+    fake_gemini.install(fake_gemini.FakeBackendConfig(
+        latency_profile=fake_gemini.LATENCY_PROFILES[args.profile],
+        time_scale=args.time_scale,
+        use_cases=args.use_cases,
+        seed=args.seed,
+    ))
+    _distinct_session_ids()
+    os.chdir(workdir)
+    return workdir
+
+
+def _distinct_session_ids():
+    """AppTest gives every instance the same session id; give each simulated session its own"""
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    original = LocalScriptRunner.__init__
+
+    def init(self, *args, **kwargs):
+        original(self, *args, **kwargs)
+        session_id = getattr(_worker, "session_id", None)
+        if session_id:
+            self._session_id = session_id
+
+    LocalScriptRunner.__init__ = init
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No /proc: fall back to the lifetime peak (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == "Darwin" else peak * 1024
+
+
+class RssSampler:
+    """Samples RSS in a background thread; peak is the highest value seen while running"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def _button(at, label):
+    for button in at.button:
+        if button.label == label:
+            return button
+    raise LookupError(f"No '{label}' button on the page")
+
+
+def _problem(args, session, iteration):
+    """Business problem for a session; --duplicate-ratio of them are identical (single-flight)"""
+    if (session * 7919 + iteration) % 100 < args.duplicate_ratio * 100:
+        return SAMPLE_PROBLEM
+    return f"{SAMPLE_PROBLEM} Analyst {session} scenario {iteration}: focus on segment {session % 5}."
+
+
+def run_session(session, level, args, samples, errors, flows):
+    """One simulated analyst: load the page, then report -> PDF -> mockup per iteration"""
+    from streamlit.testing.v1 import AppTest
+
+    _worker.session_id = f"load-{level}-{session}"
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+
+    def timed(action, step):
+        started = time.perf_counter()
+        try:
+            step()
+            failed = [str(e.value) for e in at.exception] + [str(e.value) for e in at.error]
+        except Exception as e:
+            failed = [f"{type(e).__name__}: {e}"]
+        samples[action].append(time.perf_counter() - started)
+        if failed:
+            errors[action].append(failed[0][:200])
+        return not failed
+
+    if not timed("load", at.run):
+        return
+    for iteration in range(args.iterations):
+        at.text_area[0].input(_problem(args, session, iteration))
+        if not timed("report", lambda: _button(at, "Generate Report").click().run()):
+            continue
+        if "pdf" in args.flows and not timed("pdf", lambda: _button(at, "Download PDF").click().run()):
+            continue
+        if "mockup" in args.flows and not timed("mockup", lambda: _button(at, "Generate Mockup").click().run()):
+            continue
+        flows.append(time.perf_counter())
+
+
+def run_level(level, args):
+    samples = {action: [] for action in ACTIONS}
+    errors = {action: [] for action in ACTIONS}
+    flows = []
+    gc.collect()
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=run_session, args=(i, level, args, samples, errors, flows), name=f"session-{i}")
+            for i in range(level)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    actions = {}
+    for action in ACTIONS:
+        values = samples[action]
+        if not values and not errors[action]:
+            continue
+        actions[action] = {
+            "count": len(values),
+            "errors": len(errors[action]),
+            "p50_ms": _ms(percentile(values, 50)),
+            "p95_ms": _ms(percentile(values, 95)),
+            "p99_ms": _ms(percentile(values, 99)),
+            "max_ms": _ms(max(values) if values else None),
+            "first_error": errors[action][0] if errors[action] else None,
+        }
+    return {
+        "sessions": level,
+        "elapsed_s": round(elapsed, 3),
+        "flows": len(flows),
+        "flows_per_min": round(len(flows) / elapsed * 60, 2) if elapsed else 0.0,
+        "actions_per_s": round(sum(len(v) for v in samples.values()) / elapsed, 3) if elapsed else 0.0,
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+        "actions": actions,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def print_level(result):
+    print(
+        f"\n{result['sessions']} session(s): {result['flows']} flows in {result['elapsed_s']:.1f} s  "
+        f"{result['flows_per_min']:.1f} flows/min  {result['actions_per_s']:.2f} actions/s  "
+        f"peak RSS {result['peak_rss_mb']:.0f} MB"
+    )
+    for action, stats in result["actions"].items():
+        line = (
+            f"  {action:<8} n={stats['count']:<4} p50 {_fmt(stats['p50_ms'])}  p95 {_fmt(stats['p95_ms'])}  "
+            f"p99 {_fmt(stats['p99_ms'])}  errors {stats['errors']}"
+        )
+        print(line)
+        if stats["first_error"]:
+            print(f"           first error: {stats['first_error']}")
+
+
+def _fmt(ms):
+    return f"{ms:>9.1f} ms" if ms is not None else f"{'-':>12}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test against fake Gemini/PDF backends")
+    parser.add_argument("--levels", default="1,2,4,8", help="Comma-separated concurrent session counts")
+    parser.add_argument("--iterations", type=int, default=1, help="Report/PDF/mockup flows per session")
+    parser.add_argument("--flows", default="report,pdf,mockup", help="Actions after each report (pdf, mockup)")
+    parser.add_argument("--profile", default="realistic", help="Latency profile in fake_gemini.LATENCY_PROFILES")
+    parser.add_argument("--time-scale", type=float, default=0.05, help="Multiply every simulated latency by this")
+    parser.add_argument("--pdf-latency", type=float, default=2.5, help="Median PDF export seconds (before scaling)")
+    parser.add_argument("--use-cases", type=int, default=4)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0,
+                        help="Share of sessions submitting the same problem (exercises single-flight)")
+    parser.add_argument("--quota", action="store_true", help="Keep the configured LLM rate/concurrency budgets")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-action timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show app output while running")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(",") if level.strip()]
+    if not args.verbose:
+        from streamlit.logger import set_log_level
+
+        set_log_level("error")
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = setup(args)
+    print(f"Load test in {workdir} (profile={args.profile}, time scale {args.time_scale})")
+
+    results = []
+    for level in levels:
+        if args.verbose:
+            result = run_level(level, args)
+        else:
+            with open(os.devnull, "w") as devnull:
+                stdout = sys.stdout
+                sys.stdout = devnull
+                try:
+                    result = run_level(level, args)
+                finally:
+                    sys.stdout = stdout
+        results.append(result)
+        print_level(result)
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "args": vars(args),
+                "levels": results,
+            }, f, indent=2)
+        print(f"\nResults written to {json_path}")
+
+
+if __name__ == "__main__":
+    main()
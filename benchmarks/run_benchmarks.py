@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Offline Stage Benchmarks
+========================
+
+Times the report, Mermaid, HTML post-processing, PDF extraction and mockup
+pipeline stages against the fake Gemini backend, so no API key is needed.
+
+    python benchmarks/run_benchmarks.py                      # run and print
+    python benchmarks/run_benchmarks.py --save-baseline      # store results as the baseline
+    python benchmarks/run_benchmarks.py --compare            # fail if slower than the baseline
+
+Baselines are JSON files under benchmarks/baselines/ and are machine specific.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(ROOT, "benchmarks", "baselines")
+SAMPLE_PDF = os.path.join(ROOT, "Mockup_design", "pdf_file", "CRM 360 solution.pdf")
+SAMPLE_PROBLEM = (
+    "A retail bank in Nepal wants to increase personal and home loan uptake by personalising "
+    "loan offers in its mobile app using transaction history, KYC data and customer segments."
+)
+
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "Mockup_design"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+BENCHMARKS = {}
+
+
+def benchmark(name, repeat=None):
+    """Register a benchmark. The function receives the shared context dict."""
+    def decorator(fn):
+        BENCHMARKS[name] = {"fn": fn, "repeat": repeat}
+        return fn
+    return decorator
+
+
+def setup(args):
+    """Install the fake backend and import the app/agent against it"""
+    import fake_gemini
+
+    workdir = tempfile.mkdtemp(prefix="ba_bench_")
+    os.environ.setdefault("GEMINI_API_KEY", "offline-benchmark")
+    os.environ.setdefault("TELEMETRY_LOG_PATH", os.path.join(workdir, "spans.jsonl"))
+    os.environ.setdefault("TELEMETRY_PROMETHEUS_PATH", os.path.join(workdir, "metrics.prom"))
+    # Time every pipeline step, not resumes from the previous repeat's checkpoints
+    os.environ.setdefault("CHECKPOINTS_ENABLED", "0")
+    fake_gemini.install(fake_gemini.FakeBackendConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        use_cases=args.use_cases,
+        report_repeat=args.report_repeat,
+    ))
+    os.chdir(workdir)
+
+    import app_streamlit
+    from enhanced_agent import EnhancedBRDAgent
+
+    report = fake_gemini.build_report(args.use_cases, repeat=args.report_repeat)
+    import markdown
+    html = f'<div class="html-report">{markdown.markdown(report, extensions=["tables", "fenced_code"])}</div>'
+    return {
+        "large_use_cases": args.large_use_cases,
+        "fanout_calls": args.fanout_calls,
+        "fanout_latency": args.fanout_latency,
+        "app": app_streamlit,
+        "agent": EnhancedBRDAgent(),
+        "report": report,
+        "report_html": html,
+        "workdir": workdir,
+    }
+
+
+@benchmark("generate_report_and_images")
+def bench_generate_report(ctx):
+    ctx["app"].generate_report_and_images(SAMPLE_PROBLEM)
+
+
+@benchmark("insert_use_case_diagrams")
+def bench_insert_use_cases(ctx):
+    ctx["app"].insert_use_case_diagrams(ctx["report"], SAMPLE_PROBLEM)
+
+
+@benchmark("incremental_small_edit")
+def bench_incremental_small_edit(ctx):
+    """Re-run a stored report after a one-sentence edit (sections reused where possible)"""
+    from incremental_report import ReportState
+
+    app = ctx["app"]
+    if "incremental_base" not in ctx:
+        diagram_cache = {}
+        report, _ = app.generate_report_and_images(SAMPLE_PROBLEM, diagram_cache)
+        ctx["incremental_base"] = (report, diagram_cache)
+    report, diagram_cache = ctx["incremental_base"]
+    state = ReportState.from_report(SAMPLE_PROBLEM, report, diagram_cache)
+    app.regenerate_report_incrementally(SAMPLE_PROBLEM + " Track the KPI uptake rate weekly.", state)
+
+
+@benchmark("extract_and_render_mermaid")
+def bench_extract_and_render(ctx):
+    ctx["app"].extract_and_render_mermaid(ctx["report"], output_dir=os.path.join(ctx["workdir"], "render"))
+
+
+@benchmark("sanitize_validate_mermaid")
+def bench_sanitize_validate(ctx):
+    app = ctx["app"]
+    for block in ctx["report"].split("```mermaid\n")[1:]:
+        code = app.sanitize_mermaid_code(block.split("```")[0])
+        app.validate_mermaid_code(code)
+
+
+def _large_report(ctx):
+    """Report with many use cases, each already followed by its diagram, plus one image per diagram"""
+    if "large_report" not in ctx:
+        import fake_gemini
+        from incremental_report import use_case_key
+        from report_model import parse_report
+
+        app = ctx["app"]
+        report = fake_gemini.build_report(ctx["large_use_cases"], repeat=20)
+        cache = {
+            use_case_key(uc.to_dict()): fake_gemini.build_use_case_diagram(uc.idx).strip("`\n").replace("mermaid\n", "", 1)
+            for uc in parse_report(report).use_cases
+        }
+        report = app.insert_use_case_diagrams(report, SAMPLE_PROBLEM, cache)
+        image = os.path.join(ctx["workdir"], "large.png")
+        with open(image, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n" + b"\0" * 64)
+        ctx["large_report"] = report
+        ctx["large_cache"] = cache
+        ctx["large_images"] = [image] * len(parse_report(report).mermaid_blocks)
+    return ctx["large_report"]
+
+
+@benchmark("parse_report_large")
+def bench_parse_report_large(ctx):
+    from report_model import parse_report
+
+    parse_report(_large_report(ctx))
+
+
+@benchmark("extract_use_cases_large")
+def bench_extract_use_cases_large(ctx):
+    ctx["app"].extract_use_case_details(_large_report(ctx))
+
+
+@benchmark("insert_use_case_diagrams_large")
+def bench_insert_use_cases_large(ctx):
+    """Diagram insertion with every diagram cached, so only the report edits are timed"""
+    report = _large_report(ctx)
+    ctx["app"].insert_use_case_diagrams(report, SAMPLE_PROBLEM, dict(ctx["large_cache"]))
+
+
+@benchmark("embed_images_large")
+def bench_embed_images_large(ctx):
+    report = _large_report(ctx)
+    ctx["app"].embed_report_images(report, ctx["large_images"])
+
+
+class _Unthrottled:
+    """Fixed fake latency and a private, unlimited scheduler for a fan-out benchmark"""
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    def __enter__(self):
+        import fake_gemini
+        import llm
+        from scheduler import LLMScheduler
+
+        self.model = fake_gemini.FakeGenerativeModel
+        self.saved_config = self.model.config
+        self.model.config = fake_gemini.FakeBackendConfig(latency=self.ctx["fanout_latency"])
+        # The shared scheduler's rate windows must not remember the fan-out
+        self.saved_scheduler = llm.scheduler
+        llm.scheduler = LLMScheduler(requests_per_minute=10 ** 6, tokens_per_minute=10 ** 12, max_concurrent=10 ** 6)
+        return self
+
+    def __exit__(self, *exc):
+        import llm
+
+        self.model.config = self.saved_config
+        llm.scheduler = self.saved_scheduler
+
+
+def _fanout_prompts(ctx):
+    return [f"Hello {i}" for i in range(ctx["fanout_calls"])]
+
+
+@benchmark("async_llm_fanout", repeat=2)
+def bench_async_llm_fanout(ctx):
+    """Hundreds of concurrent calls on the shared event loop (one loop thread)"""
+    import asyncio
+    import threading
+
+    import event_loop
+    import llm
+
+    peak = {"threads": threading.active_count()}
+
+    async def fan_out():
+        async def one(prompt):
+            response = await llm.generate_async("health_check", prompt)
+            peak["threads"] = max(peak["threads"], threading.active_count())
+            return response
+
+        return await asyncio.gather(*(one(p) for p in _fanout_prompts(ctx)))
+
+    with _Unthrottled(ctx):
+        responses = event_loop.run(fan_out())
+    assert len(responses) == ctx["fanout_calls"]
+    return {"calls": len(responses), "peak_threads": peak["threads"]}
+
+
+@benchmark("threaded_llm_fanout", repeat=2)
+def bench_threaded_llm_fanout(ctx):
+    """The same fan-out with the synchronous client (one thread per in-flight call)"""
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    import llm
+
+    peak = {"threads": threading.active_count()}
+
+    def one(prompt):
+        response = llm.generate("health_check", prompt)
+        peak["threads"] = max(peak["threads"], threading.active_count())
+        return response
+
+    prompts = _fanout_prompts(ctx)
+    with _Unthrottled(ctx), ThreadPoolExecutor(max_workers=len(prompts)) as pool:
+        responses = list(pool.map(one, prompts))
+    return {"calls": len(responses), "peak_threads": peak["threads"]}
+
+
+@benchmark("html_postprocess")
+def bench_html_postprocess(ctx):
+    app = ctx["app"]
+    html = app.remove_sticker_images(ctx["report_html"])
+    html = app.remove_emojis(html)
+    html = app.remove_llm_intro_paragraph(html)
+    app.wrap_html_with_css(html)
+
+
+def _near_duplicate_index(ctx):
+    """LSH index of 100k random signatures plus the sample problem's (built once)"""
+    if "near_duplicate_index" not in ctx:
+        import numpy as np
+        import near_duplicates
+
+        hasher = near_duplicates.MinHasher()
+        index = near_duplicates.LSHIndex()
+        signatures = np.random.default_rng(0).integers(0, 2 ** 32, size=(100_000, hasher.permutations), dtype=np.uint32)
+        index.add_many([f"r{i}" for i in range(len(signatures))], signatures)
+        index.add_many(["sample"], hasher.signature(near_duplicates.shingles(SAMPLE_PROBLEM))[None, :])
+        ctx["near_duplicate_index"] = (hasher, index)
+    return ctx["near_duplicate_index"]
+
+
+@benchmark("near_duplicate_lookup_100k", repeat=200)
+def bench_near_duplicate_lookup(ctx):
+    """Signature of a one-word edit of the sample problem + LSH lookup among 100k entries"""
+    import near_duplicates
+
+    hasher, index = _near_duplicate_index(ctx)
+    signature = hasher.signature(near_duplicates.shingles(SAMPLE_PROBLEM.replace("home", "car")))
+    matches = index.query(signature, near_duplicates.NEAR_DUPLICATE_OFFER_THRESHOLD - near_duplicates.ESTIMATE_MARGIN)
+    return {"matches": len(matches)}
+
+
+def _large_schema(ctx):
+    """10k-element schema from the fake backend: overlapping cards, fields outside their cards"""
+    if "large_schema" not in ctx:
+        import fake_gemini
+
+        ctx["large_schema"] = json.loads(fake_gemini.build_schema(10_000))
+    return ctx["large_schema"]
+
+
+@benchmark("schema_validate_10k", repeat=20)
+def bench_schema_validate(ctx):
+    import schema_layout
+
+    return {"issues": len(schema_layout.validate(_large_schema(ctx)))}
+
+
+@benchmark("schema_auto_layout_10k", repeat=20)
+def bench_schema_auto_layout(ctx):
+    import schema_layout
+
+    _, summary = schema_layout.auto_layout(_large_schema(ctx))
+    return {"issues_after": summary["issues_after"]}
+
+
+@benchmark("extract_text_from_pdf", repeat=2)
+def bench_extract_pdf(ctx):
+    ctx["agent"].extract_text_from_pdf(SAMPLE_PDF)
+
+
+@benchmark("process_pdf_pipeline", repeat=2)
+def bench_pdf_pipeline(ctx):
+    ctx["agent"].process_pdf_pipeline(SAMPLE_PDF)
+
+
+@benchmark("pdf_ingest_streaming", repeat=2)
+def bench_pdf_ingest(ctx):
+    """Upload path: pages condensed as they are read, classification started from the first pages"""
+    import pdf_ingest
+    from enhanced_agent import page_block
+
+    agent = ctx["agent"]
+    for state in pdf_ingest.ingest(agent.iter_pdf_pages(SAMPLE_PDF), agent.analyze_brd_content_async, page_block):
+        pass
+    return {"first_result_ms": round(state.first_result_s * 1000), "classified_at_page": state.classified_at_page}
+
+
+def _call(fn, ctx, quiet):
+    if not quiet:
+        return fn(ctx)
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            return fn(ctx)
+        finally:
+            sys.stdout = stdout
+
+
+def run(ctx, names, repeat, quiet=True):
+    results = {}
+    for name in names:
+        entry = BENCHMARKS[name]
+        runs = entry["repeat"] or repeat
+        timings = []
+        _call(entry["fn"], ctx, quiet)  # warm-up
+        info = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            info = _call(entry["fn"], ctx, quiet)
+            timings.append(time.perf_counter() - start)
+        results[name] = {
+            "runs": runs,
+            "median_ms": round(statistics.median(timings) * 1000, 3),
+            "min_ms": round(min(timings) * 1000, 3),
+            "mean_ms": round(statistics.mean(timings) * 1000, 3),
+        }
+        extra = ""
+        if isinstance(info, dict):
+            # Benchmarks may return extra measurements (e.g. peak thread count)
+            results[name]["info"] = info
+            extra = "   " + ", ".join(f"{key}={value}" for key, value in info.items())
+        print(f"{name:<32} median {results[name]['median_ms']:>10.2f} ms   min {results[name]['min_ms']:>10.2f} ms{extra}")
+    return results
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(results, args):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    payload = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "latency": args.latency, "jitter": args.jitter,
+            "use_cases": args.use_cases, "report_repeat": args.report_repeat,
+        },
+        "results": results,
+    }
+    with open(baseline_path(args.baseline), "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    print(f"✓ Baseline saved: {baseline_path(args.baseline)}")
+
+
+def compare(results, args):
+    """Print the change against the baseline; return the names that regressed"""
+    path = baseline_path(args.baseline)
+    if not os.path.exists(path):
+        print(f"✗ No baseline at {path}. Run with --save-baseline first.")
+        return None
+    with open(path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    print(f"\nComparison against {path} (threshold {args.threshold:.0%})")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<32} (new)")
+            continue
+        before = baseline[name]["median_ms"]
+        after = result["median_ms"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        print(f"{name:<32} {before:>10.2f} -> {after:>10.2f} ms  {change:+7.1%}  {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline stage benchmarks against a fake Gemini backend")
+    parser.add_argument("names", nargs="*", help="Benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra uniform random latency in seconds")
+    parser.add_argument("--use-cases", type=int, default=4)
+    parser.add_argument("--report-repeat", type=int, default=1, help="Repeat BRD/FRS sections to grow the report")
+    parser.add_argument("--large-use-cases", type=int, default=500, help="Use cases in the *_large report benchmarks")
+    parser.add_argument("--fanout-calls", type=int, default=300, help="Concurrent calls in the *_llm_fanout benchmarks")
+    parser.add_argument("--fanout-latency", type=float, default=0.5, help="Fake latency per call in the fan-out benchmarks")
+    parser.add_argument("--baseline", default="default", help="Baseline name under benchmarks/baselines/")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown before flagging a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show stage output while timing")
+    args = parser.parse_args()
+
+    names = args.names or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmark(s): {', '.join(unknown)}. Available: {', '.join(BENCHMARKS)}")
+
+    ctx = setup(args)
+    results = run(ctx, names, args.repeat, quiet=not args.verbose)
+    if args.save_baseline:
+        save_baseline(results, args)
+    if args.compare:
+        regressions = compare(results, args)
+        if regressions is None or regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
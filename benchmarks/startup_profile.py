@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Startup Profile and Budget Check
+================================
+
+Measures how long a fresh process takes to serve the dashboard's first page
+(cold start of a new replica) and how long each later script rerun takes,
+with an import-time profile (`python -X importtime`) grouped by top-level
+package. It also checks that heavy dependencies which only some code paths
+need (LAZY_MODULES) are not loaded by the first page view.
+
+    python benchmarks/startup_profile.py                       # profile + budget check
+    python benchmarks/startup_profile.py --cold-budget-ms 3000 --rerun-budget-ms 100
+    python benchmarks/startup_profile.py --json startup.json
+
+Exits with status 1 when a budget is exceeded or a lazy module was imported
+on the cold path. Model calls use the fake Gemini backend, so the numbers
+are import and script time, not API latency.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app_streamlit.py")
+
+# Must not be imported just to show the page (PDF export, PDF ingest, report HTML, mockup agent)
+LAZY_MODULES = ("playwright", "pdfplumber", "bs4", "markdown", "enhanced_agent")
+
+COLD_BUDGET_MS = float(os.environ.get("STARTUP_COLD_BUDGET_MS", "4000"))
+RERUN_BUDGET_MS = float(os.environ.get("STARTUP_RERUN_BUDGET_MS", "150"))
+
+
+def child(reruns):
+    """Runs in the profiled process: first page load, then reruns; prints JSON on stdout"""
+    from streamlit.testing.v1 import AppTest
+
+    sys.path.insert(0, ROOT)
+    sys.path.append(os.path.join(ROOT, "Mockup_design"))
+    sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+    workdir = tempfile.mkdtemp(prefix="ba_startup_")
+    os.environ.setdefault("GEMINI_API_KEY", "offline-startup-profile")
+    os.environ.setdefault("TELEMETRY_LOG_PATH", os.path.join(workdir, "spans.jsonl"))
+    os.environ.setdefault("TELEMETRY_PROMETHEUS_PATH", os.path.join(workdir, "metrics.prom"))
+    os.chdir(workdir)
+    import fake_gemini
+
+    fake_gemini.install()
+
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    started = time.perf_counter()
+    at.run()
+    first_run = time.perf_counter() - started
+    first_load_end = time.time()
+    loaded = [name for name in LAZY_MODULES if name in sys.modules]
+    rerun_times = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        at.run()
+        rerun_times.append(time.perf_counter() - started)
+    errors = [str(e.value) for e in at.exception] + [str(e.value) for e in at.error]
+    print(json.dumps({
+        "first_load_end": first_load_end,
+        "first_run_ms": round(first_run * 1000, 1),
+        "rerun_ms": [round(t * 1000, 1) for t in rerun_times],
+        "lazy_modules_loaded": loaded,
+        "errors": errors,
+    }))
+
+
+def parse_importtime(stderr):
+    """{top-level package: self import time in ms} from -X importtime output"""
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, _cumulative, name = [part.strip() for part in line.split(":", 1)[1].split("|")]
+            self_us = int(self_us)
+        except ValueError:
+            continue
+        top = name.split(".")[0]
+        packages[top] = packages.get(top, 0.0) + self_us / 1000
+    return packages
+
+
+def profile(reruns):
+    started = time.time()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child", "--reruns", str(reruns)],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode or not lines:
+        sys.exit(f"Profiled process failed (exit {proc.returncode}):\n{proc.stderr[-2000:]}")
+    result = json.loads(lines[-1])
+    result["cold_start_ms"] = round((result.pop("first_load_end") - started) * 1000, 1)
+    result["rerun_median_ms"] = round(statistics.median(result["rerun_ms"]), 1) if result["rerun_ms"] else None
+    result["imports_ms"] = {
+        name: round(ms, 1) for name, ms in sorted(parse_importtime(proc.stderr).items(), key=lambda item: -item[1])
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start/rerun profile and budget check for the Streamlit app")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="Packages to list in the import profile")
+    parser.add_argument("--cold-budget-ms", type=float, default=COLD_BUDGET_MS)
+    parser.add_argument("--rerun-budget-ms", type=float, default=RERUN_BUDGET_MS)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.reruns)
+        return
+
+    result = profile(args.reruns)
+    print(f"Cold start (process start -> first page): {result['cold_start_ms']:.0f} ms "
+          f"(app script {result['first_run_ms']:.0f} ms)")
+    print(f"Rerun median over {len(result['rerun_ms'])}: {result['rerun_median_ms']} ms")
+    print(f"\nImport time by top-level package (self time, top {args.top}):")
+    for name, ms in list(result["imports_ms"].items())[:args.top]:
+        print(f"  {name:<28} {ms:>8.1f} ms")
+
+    failures = []
+    if result["cold_start_ms"] > args.cold_budget_ms:
+        failures.append(f"cold start {result['cold_start_ms']:.0f} ms > budget {args.cold_budget_ms:.0f} ms")
+    if result["rerun_median_ms"] is not None and result["rerun_median_ms"] > args.rerun_budget_ms:
+        failures.append(f"rerun {result['rerun_median_ms']:.0f} ms > budget {args.rerun_budget_ms:.0f} ms")
+    if result["lazy_modules_loaded"]:
+        failures.append(f"imported on the cold path: {', '.join(result['lazy_modules_loaded'])}")
+    if result["errors"]:
+        failures.append(f"app error: {result['errors'][0][:200]}")
+    result["failures"] = failures
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if failures:
+        print("\n❌ Startup budget check failed:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("\n✓ Within the startup budget")
+
+
+if __name__ == "__main__":
+    main()
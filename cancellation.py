@@ -0,0 +1,345 @@
+"""
+Cancellation and Job Deadlines
+==============================
+
+A CancelToken is created for every report, mockup and PDF job and carries the
+job's overall deadline. It is made current with scope(); model calls
+(llm.py, scheduler.py, resilience.py), Mermaid CLI renders and PDF exports
+check it between steps, and child processes started with run_process() are
+killed as soon as it is cancelled. Work that was already finished is kept, so
+callers report partial results instead of nothing.
+
+`jobs` tracks which sessions are waiting for which job. A job is cancelled
+when its last session re-submits something else, ends, or (for foreground
+jobs) its script run is abandoned.
+"""
+
+import asyncio
+import contextvars
+import os
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from config import JOB_DEADLINES, JOB_WATCH_INTERVAL
+
+_current = contextvars.ContextVar("cancel_token", default=None)
+
+
+class JobCancelledError(Exception):
+    """Raised when a job's token is cancelled or its overall deadline passes"""
+
+
+class CancelToken:
+    def __init__(self, deadline=None, name="job"):
+        self.name = name
+        self.deadline = deadline  # absolute time.monotonic() value, or None
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._timer = None
+        if deadline is not None:
+            # Fire the callbacks (kill subprocesses, wake waiters) right at the deadline
+            self._timer = threading.Timer(max(0.0, deadline - time.monotonic()), self.cancel, args=("deadline reached",))
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        """Cancel the token and run its callbacks; returns False if it was already cancelled"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        if self._timer is not None:
+            self._timer.cancel()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ Cancellation callback failed: {e}")
+        return True
+
+    def close(self):
+        """The job finished: its deadline no longer applies"""
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def check(self):
+        """Raise JobCancelledError if the token has been cancelled"""
+        if self._event.is_set():
+            raise JobCancelledError(f"{self.name} {self.reason}")
+
+    def remaining(self):
+        """Seconds until the deadline (None if unbounded)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def on_cancel(self, callback):
+        """Call callback() on cancellation (now, if already cancelled); returns an unregister function"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+
+                def unregister():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+
+                return unregister
+        callback()
+        return lambda: None
+
+
+def current_token():
+    return _current.get()
+
+
+@contextmanager
+def scope(token):
+    """Make token current for the calls (and tasks/threads started) inside the block"""
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def check():
+    """Raise JobCancelledError if the current job has been cancelled"""
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+def cancelled():
+    token = _current.get()
+    return token is not None and token.cancelled
+
+
+def effective_deadline(deadline=None):
+    """An absolute deadline tightened by the current job's deadline"""
+    token = _current.get()
+    if token is None or token.deadline is None:
+        return deadline
+    return token.deadline if deadline is None else min(deadline, token.deadline)
+
+
+def sleep(seconds):
+    """time.sleep that ends early when the current job is cancelled"""
+    token = _current.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.wait(seconds)
+
+
+async def sleep_async(seconds):
+    await guard(asyncio.sleep(seconds))
+
+
+async def guard(awaitable, token=None):
+    """Await awaitable, cancelling it and raising JobCancelledError as soon as the token is cancelled"""
+    token = token or _current.get()
+    if token is None:
+        return await awaitable
+    token.check()
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(awaitable)
+    stop = loop.create_future()
+    unregister = token.on_cancel(lambda: loop.call_soon_threadsafe(_wake, stop))
+    try:
+        await asyncio.wait([task, stop], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        unregister()
+        if not task.done():
+            task.cancel()
+    if not task.done() or task.cancelled():
+        token.check()
+    return task.result()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _kill(process):
+    """Kill a child process and everything it started (browser, renderer, node)"""
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+
+def run_process(args, timeout=None, token=None, **kwargs):
+    """subprocess.run(args, check=True) that is killed when the job is cancelled.
+
+    The child runs in its own process group so grandchildren die with it.
+    The timeout is tightened to the job's deadline.
+    """
+    token = token or _current.get()
+    if token is not None:
+        token.check()
+        remaining = token.remaining()
+        if remaining is not None:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+    if os.name == "posix":
+        kwargs.setdefault("start_new_session", True)
+    process = subprocess.Popen(args, **kwargs)
+    unregister = token.on_cancel(lambda: _kill(process)) if token is not None else (lambda: None)
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill(process)
+        process.wait()
+        raise
+    except BaseException:
+        _kill(process)
+        raise
+    finally:
+        unregister()
+    if token is not None:
+        token.check()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args)
+    return process.returncode
+
+
+class JobRegistry:
+    """Jobs per (kind, key), shared by the sessions waiting for them.
+
+    start() cancels the session's previous job of the same kind (if no other
+    session still waits for it) and joins or creates the token for the new
+    key. A background watchdog releases sessions whose abandoned() callback
+    returns True.
+    """
+
+    def __init__(self, watch_interval=JOB_WATCH_INTERVAL):
+        self.watch_interval = watch_interval
+        self._lock = threading.Lock()
+        self._tokens = {}  # (kind, key) -> CancelToken
+        self._holders = {}  # (kind, key) -> {session_id: abandoned callback or None}
+        self._session_jobs = {}  # (session_id, kind) -> key
+        self._watchdog = None
+        self.cancelled = 0
+
+    def start(self, session_id, kind, key, timeout=None, abandoned=None):
+        timeout = timeout if timeout is not None else JOB_DEADLINES.get(kind)
+        with self._lock:
+            released = []
+            previous = self._session_jobs.get((session_id, kind))
+            if previous is not None and previous != key:
+                released = self._release(session_id, kind, previous)
+            job = (kind, key)
+            token = self._tokens.get(job)
+            if token is None or token.cancelled:
+                deadline = time.monotonic() + timeout if timeout else None
+                token = self._tokens[job] = CancelToken(deadline, name=kind)
+                self._holders[job] = {}
+            self._holders[job][session_id] = abandoned
+            self._session_jobs[(session_id, kind)] = key
+            if abandoned is not None:
+                self._ensure_watchdog()
+        self._cancel_all(released, "superseded by a new request")
+        return token
+
+    def finish(self, session_id, kind, key):
+        """The session got its result; forget the job once no session waits for it"""
+        with self._lock:
+            job = (kind, key)
+            holders = self._holders.get(job, {})
+            holders.pop(session_id, None)
+            if self._session_jobs.get((session_id, kind)) == key:
+                del self._session_jobs[(session_id, kind)]
+            if not holders:
+                self._holders.pop(job, None)
+                token = self._tokens.pop(job, None)
+                if token is not None:
+                    token.close()
+
+    def cancel_session(self, session_id, reason="session ended"):
+        """Release every job of the session, cancelling those nobody else waits for"""
+        with self._lock:
+            released = []
+            for (holder, kind), key in list(self._session_jobs.items()):
+                if holder == session_id:
+                    released += self._release(session_id, kind, key)
+        self._cancel_all(released, reason)
+
+    def _release(self, session_id, kind, key):
+        """Drop a holder (caller holds the lock); returns tokens left without holders"""
+        job = (kind, key)
+        if self._session_jobs.get((session_id, kind)) == key:
+            del self._session_jobs[(session_id, kind)]
+        holders = self._holders.get(job)
+        if holders is None:
+            return []
+        holders.pop(session_id, None)
+        if holders:
+            return []
+        del self._holders[job]
+        return [self._tokens.pop(job)]
+
+    def _cancel_all(self, tokens, reason):
+        for token in tokens:
+            if token.cancel(reason):
+                with self._lock:
+                    self.cancelled += 1
+                print(f"🛑 Cancelled {token.name} job: {reason}")
+
+    def _ensure_watchdog(self):
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(target=self._watch, name="job-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            with self._lock:
+                watched = [
+                    (session_id, kind, key, abandoned)
+                    for (kind, key), holders in self._holders.items()
+                    for session_id, abandoned in holders.items()
+                    if abandoned is not None
+                ]
+            if not watched:
+                with self._lock:
+                    if not any(a for holders in self._holders.values() for a in holders.values()):
+                        self._watchdog = None
+                        return
+                continue
+            for session_id, kind, key, abandoned in watched:
+                try:
+                    gone = abandoned()
+                except Exception:
+                    gone = False
+                if gone:
+                    with self._lock:
+                        released = self._release(session_id, kind, key)
+                    self._cancel_all(released, "request abandoned")
+
+    def stats(self):
+        with self._lock:
+            return {"active": len(self._tokens), "cancelled": self.cancelled}
+
+
+# Shared by every session in the process
+jobs = JobRegistry()
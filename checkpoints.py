@@ -0,0 +1,128 @@
+"""
+Pipeline Checkpoints
+====================
+
+Stage outputs of a multi-step job (the agent's PDF pipeline: extracted text,
+app type, schema, HTML, saved files) are written to
+CHECKPOINT_DIR/<job key>/<stage>.json as each stage finishes. A rerun of the
+same job loads the finished stages instead of repeating their model calls and
+resumes at the first stage without a checkpoint. A stage that only produced
+its fallback (a failed model call) is kept as a fallback checkpoint and run
+again next time.
+
+Running a stage again invalidates the stages after it, since their input
+changed. invalidate(stage) forces a stage and everything after it to run
+again, e.g. only re-rendering the HTML from a checkpointed schema.
+
+    python checkpoints.py                 # list checkpointed jobs
+    python checkpoints.py --clear <key>   # forget one job
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from config import CHECKPOINT_DIR
+
+
+def file_key(path):
+    """Job key for a file input: hash of its contents, so a renamed copy resumes too"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class JobCheckpoints:
+    """Checkpoints of one job's stages, in pipeline order"""
+
+    def __init__(self, key, stages, directory=CHECKPOINT_DIR):
+        self.key = key
+        self.stages = tuple(stages)
+        self.path = os.path.join(directory, key[:32])
+
+    def _file(self, stage):
+        if stage not in self.stages:
+            raise ValueError(f"Unknown stage {stage!r}; expected one of {', '.join(self.stages)}")
+        return os.path.join(self.path, f"{stage}.json")
+
+    def get(self, stage):
+        """The stage's checkpoint record ({"value", "fallback", "created"}), or None"""
+        try:
+            with open(self._file(stage), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None  # Missing, or a write that never completed
+
+    def save(self, stage, value, fallback=False):
+        """Checkpoint a stage that just ran; the stages after it are invalidated"""
+        self.invalidate(stage, include=False)
+        os.makedirs(self.path, exist_ok=True)
+        record = {"stage": stage, "created": time.time(), "fallback": fallback, "value": value}
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            os.replace(tmp, self._file(stage))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def invalidate(self, stage, include=True):
+        """Drop the checkpoints of stage (unless include=False) and of every later stage"""
+        start = self.stages.index(stage) + (0 if include else 1)
+        for later in self.stages[start:]:
+            try:
+                os.remove(self._file(later))
+            except FileNotFoundError:
+                pass
+
+    def status(self):
+        """{stage: "done" | "fallback" | "missing"}"""
+        status = {}
+        for stage in self.stages:
+            record = self.get(stage)
+            status[stage] = "missing" if record is None else "fallback" if record["fallback"] else "done"
+        return status
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def list_jobs(directory=CHECKPOINT_DIR):
+    """[(job key prefix, {stage file: modified time})] of the checkpointed jobs, newest first"""
+    jobs = []
+    if not os.path.isdir(directory):
+        return jobs
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            files = {f[:-5]: os.path.getmtime(os.path.join(path, f)) for f in os.listdir(path) if f.endswith(".json")}
+            jobs.append((name, files))
+    jobs.sort(key=lambda job: -max(job[1].values(), default=0))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or clear pipeline checkpoints")
+    parser.add_argument("--clear", metavar="KEY", help="Remove the checkpoints of this job")
+    parser.add_argument("--dir", default=CHECKPOINT_DIR)
+    args = parser.parse_args()
+    if args.clear:
+        shutil.rmtree(os.path.join(args.dir, args.clear[:32]), ignore_errors=True)
+        print(f"✓ Cleared checkpoints of {args.clear[:32]}")
+        return
+    jobs = list_jobs(args.dir)
+    for key, files in jobs:
+        updated = time.strftime("%Y-%m-%d %H:%M", time.localtime(max(files.values(), default=0)))
+        print(f"{key}  {updated}  {', '.join(sorted(files, key=files.get))}")
+    print(f"{len(jobs)} checkpointed job(s) in {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,275 @@
-
+import os
 
 # Default model name for Google Gemini
 MODEL_NAME = "gemini-2.5-flash"
+# Faster, cheaper tier used for small tasks and as the latency fallback
+FAST_MODEL_NAME = "gemini-2.5-flash-lite"
+
+# --- Per-task model routing (see routing.py) ---
+# Each task maps to a model, its generation config, a max output token limit
+# and a latency budget in seconds. When the observed latency of the model for
+# that task would exceed the budget, the call is routed to the fallback tier.
+MODEL_ROUTES = {
+    "health_check": {
+        "model": FAST_MODEL_NAME,
+        "generation_config": {"temperature": 0.0},
+        "max_output_tokens": 16,
+        "latency_budget": 5,
+        "fallback": None,
+    },
+    "classify": {
+        "model": FAST_MODEL_NAME,
+        "generation_config": {"temperature": 0.0},
+        "max_output_tokens": 16,
+        "latency_budget": 5,
+        "fallback": None,
+    },
+    "use_case_diagram": {
+        "model": MODEL_NAME,
+        "generation_config": {"temperature": 0.4},
+        "max_output_tokens": 2048,
+        "latency_budget": 20,
+        "fallback": FAST_MODEL_NAME,
+    },
+    "report": {
+        "model": MODEL_NAME,
+        "generation_config": {"temperature": 0.7},
+        "max_output_tokens": 32768,
+        "latency_budget": 150,
+        "fallback": FAST_MODEL_NAME,
+    },
+    "report_section": {
+        "model": MODEL_NAME,
+        "generation_config": {"temperature": 0.7},
+        "max_output_tokens": 8192,
+        "latency_budget": 45,
+        "fallback": FAST_MODEL_NAME,
+    },
+    "schema": {
+        "model": MODEL_NAME,
+        "generation_config": {"temperature": 0.2, "response_mime_type": "application/json"},
+        "max_output_tokens": 16384,
+        "latency_budget": 60,
+        "fallback": FAST_MODEL_NAME,
+    },
+    "mockup_html": {
+        "model": MODEL_NAME,
+        "generation_config": {"temperature": 0.8},
+        "max_output_tokens": 32768,
+        "latency_budget": 120,
+        "fallback": FAST_MODEL_NAME,
+    },
+    "mockup_fragments": {
+        "model": MODEL_NAME,
+        "generation_config": {"temperature": 0.6, "response_mime_type": "application/json"},
+        "max_output_tokens": 16384,
+        "latency_budget": 60,
+        "fallback": FAST_MODEL_NAME,
+    },
+}
+DEFAULT_MODEL_ROUTE = {
+    "model": MODEL_NAME,
+    "generation_config": {},
+    "max_output_tokens": 8192,
+    "latency_budget": 60,
+    "fallback": FAST_MODEL_NAME,
+}
+
+# --- Telemetry ---
+# Spans are appended as JSON lines to TELEMETRY_LOG_PATH and aggregated into a
+# Prometheus text file. Set TELEMETRY_PROMETHEUS_PORT to also serve /metrics.
+TELEMETRY_ENABLED = os.environ.get("TELEMETRY_ENABLED", "1") != "0"
+TELEMETRY_LOG_PATH = os.environ.get("TELEMETRY_LOG_PATH", os.path.join("output", "telemetry", "spans.jsonl"))
+TELEMETRY_PROMETHEUS_PATH = os.environ.get("TELEMETRY_PROMETHEUS_PATH", os.path.join("output", "telemetry", "metrics.prom"))
+TELEMETRY_PROMETHEUS_PORT = int(os.environ.get("TELEMETRY_PROMETHEUS_PORT", "0"))
+# The span log is rotated once it reaches TELEMETRY_LOG_MAX_BYTES (spans.jsonl.1, .2, ...);
+# TELEMETRY_LOG_BACKUPS old files are kept. Set TELEMETRY_LOG_PATH="" to log nothing.
+TELEMETRY_LOG_MAX_BYTES = int(os.environ.get("TELEMETRY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+TELEMETRY_LOG_BACKUPS = int(os.environ.get("TELEMETRY_LOG_BACKUPS", "3"))
+# Minimum seconds between rewrites of the Prometheus file (done on a background thread)
+TELEMETRY_PROMETHEUS_INTERVAL = float(os.environ.get("TELEMETRY_PROMETHEUS_INTERVAL", "1.0"))
+TELEMETRY_SIDEBAR = os.environ.get("TELEMETRY_SIDEBAR", "0") == "1"
+
+# --- Memory profiling (see memory_profile.py) ---
+# Opt-in: tracemalloc snapshots and peak RSS around the report, PDF and mockup
+# stages, appended as JSON lines to MEMORY_PROFILE_PATH
+MEMORY_PROFILE_ENABLED = os.environ.get("MEMORY_PROFILE_ENABLED", "0") == "1"
+MEMORY_PROFILE_PATH = os.environ.get("MEMORY_PROFILE_PATH", os.path.join("output", "telemetry", "memory.jsonl"))
+# Telemetry span names (prefixes) that are profiled
+MEMORY_PROFILE_STAGES = tuple(os.environ.get(
+    "MEMORY_PROFILE_STAGES",
+    "report.generate,report.incremental,report.embed_images,report.markdown,report.html_postprocess,report.view,pdf.,agent.",
+).split(","))
+# Stack depth kept per allocation, so library allocations are attributed to the project line calling them
+MEMORY_PROFILE_FRAMES = int(os.environ.get("MEMORY_PROFILE_FRAMES", "10"))
+MEMORY_PROFILE_TOP = 10
+# Lazily imported modules loaded before tracing starts, so stages are not charged for their import
+MEMORY_PROFILE_PRELOAD = ("markdown", "bs4", "pdfplumber", "enhanced_agent")
+# Allocation sites keeping more than this after a stage are flagged
+MEMORY_PROFILE_FLAG_MB = float(os.environ.get("MEMORY_PROFILE_FLAG_MB", "5"))
+MEMORY_PROFILE_RSS_INTERVAL = 0.01
+
+# --- CPU profiling (see cpu_profile.py) ---
+# Profile every report/mockup/PDF job, or only those of sessions opened with ?profile=1
+CPU_PROFILE_ENABLED = os.environ.get("CPU_PROFILE_ENABLED", "0") == "1"
+CPU_PROFILE_DIR = os.environ.get("CPU_PROFILE_DIR", os.path.join("output", "profiles"))
+# "sampling" (stack samples of all threads working for the job) or "deterministic" (cProfile)
+CPU_PROFILE_MODE = os.environ.get("CPU_PROFILE_MODE", "sampling")
+CPU_PROFILE_INTERVAL = float(os.environ.get("CPU_PROFILE_INTERVAL", "0.005"))
+CPU_PROFILE_TOP = 25
+
+# --- Resilient Gemini calls ---
+# Consecutive transient failures before the process-wide circuit breaker opens,
+# and how long it stays open before letting a probe request through.
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+LLM_CIRCUIT_RECOVERY_SECONDS = float(os.environ.get("LLM_CIRCUIT_RECOVERY_SECONDS", "30"))
+# Overall deadline per task (seconds), covering all retries
+LLM_DEADLINES = {
+    "health_check": 20,
+    "classify": 30,
+    "use_case_diagram": 60,
+    "report": 240,
+    "report_section": 90,
+    "schema": 120,
+    "mockup_html": 180,
+    "mockup_fragments": 120,
+}
+LLM_DEFAULT_DEADLINE = 120
+
+# The app checks the API key once per process, then again after this many seconds
+HEALTH_CHECK_TTL = int(os.environ.get("HEALTH_CHECK_TTL", "600"))
+
+# --- LLM admission control ---
+# Process-wide budgets shared fairly by all sessions (see scheduler.py)
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get("LLM_REQUESTS_PER_MINUTE", "60"))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", "1000000"))
+LLM_MAX_CONCURRENT = int(os.environ.get("LLM_MAX_CONCURRENT", "16"))
+# Waiting requests gain one priority level per this many seconds, so batch work is never starved
+LLM_PRIORITY_AGING_SECONDS = float(os.environ.get("LLM_PRIORITY_AGING_SECONDS", "20"))
+# Default priority per task; callers can override it with scheduler.request_context()
+LLM_TASK_PRIORITY = {
+    "health_check": "interactive",
+    "classify": "interactive",
+    "schema": "interactive",
+    "mockup_html": "interactive",
+    "mockup_fragments": "interactive",
+    "report": "interactive",
+    "use_case_diagram": "batch",
+    "report_section": "interactive",
+}
+# Expected response size per task, used to reserve tokens before the call returns
+LLM_EXPECTED_OUTPUT_TOKENS = {
+    "health_check": 20,
+    "classify": 10,
+    "use_case_diagram": 400,
+    "report": 8000,
+    "report_section": 1500,
+    "schema": 3000,
+    "mockup_html": 8000,
+    "mockup_fragments": 2000,
+}
+
+# --- Incremental report regeneration ---
+# Re-running "Generate Report" after a small edit only regenerates the affected sections
+REPORT_INCREMENTAL_ENABLED = os.environ.get("REPORT_INCREMENTAL_ENABLED", "1") != "0"
+
+# --- PDF cache ---
+# Rendered PDFs are reused while the final HTML+CSS is unchanged
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", os.path.join("output", "pdf_cache"))
+PDF_CACHE_MAX_FILES = int(os.environ.get("PDF_CACHE_MAX_FILES", "50"))
+# Render the PDF in the background as soon as a report is generated
+PDF_PRERENDER_ENABLED = os.environ.get("PDF_PRERENDER_ENABLED", "1") != "0"
+
+# --- Mermaid diagram cache ---
+# Rendered diagrams are named by a hash of their code and reused; the least recently
+# used PNGs beyond MERMAID_CACHE_MAX_FILES are deleted
+MERMAID_CACHE_DIR = os.environ.get("MERMAID_CACHE_DIR", os.path.join("output", "diagrams"))
+MERMAID_CACHE_MAX_FILES = int(os.environ.get("MERMAID_CACHE_MAX_FILES", "200"))
+
+# --- PDF upload (see pdf_ingest.py) ---
+# Pages extracted ahead of the thread that condenses them and starts the classification
+PDF_INGEST_QUEUE_PAGES = 8
+# Page headers/footers: lines at the same place among the first/last PDF_INGEST_EDGE_LINES lines of at least
+# PDF_INGEST_EDGE_SHARE of the pages (and at least two) are dropped; page body text is kept as is
+PDF_INGEST_EDGE_LINES = 2
+PDF_INGEST_EDGE_SHARE = 0.5
+
+# --- Pipeline checkpoints (see checkpoints.py) ---
+# Stage outputs of the agent's PDF pipeline, so a rerun resumes after the last successful stage
+CHECKPOINTS_ENABLED = os.environ.get("CHECKPOINTS_ENABLED", "1") != "0"
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", os.path.join("output", "checkpoints"))
+
+# --- UI schema layout (see Mockup_design/schema_layout.py) ---
+# Model-generated schemas are checked for overlapping siblings, children outside their
+# parent and unknown/cyclic parents, and repaired before the HTML is generated
+SCHEMA_LAYOUT_FIX = os.environ.get("SCHEMA_LAYOUT_FIX", "1") != "0"
+SCHEMA_LAYOUT_GAP = 10              # px between elements placed by the auto-layout
+SCHEMA_LAYOUT_TOLERANCE = 1.0       # px of overlap/overhang that is not reported
+
+# --- Streaming mockup HTML (see Mockup_design/html_stream.py) ---
+# The mockup page is streamed from the model into a live preview; a reply with no HTML tag
+# in its first HTML_STREAM_SNIFF_CHARS characters is abandoned for the fallback page
+HTML_STREAM_ENABLED = os.environ.get("HTML_STREAM_ENABLED", "1") != "0"
+HTML_STREAM_SNIFF_CHARS = 512
+HTML_PREVIEW_INTERVAL = 1.0         # seconds between live preview updates
+
+# --- Incremental mockup regeneration (see Mockup_design/incremental_mockup.py) ---
+# A mockup for an edited BRD diffs its UI schema against the previous version's and only
+# regenerates the changed components' HTML; the previous version is the latest mockup of
+# the same BRD, else the most similar earlier one (at least MOCKUP_INCREMENTAL_MIN_SIMILARITY)
+MOCKUP_INCREMENTAL_ENABLED = os.environ.get("MOCKUP_INCREMENTAL_ENABLED", "1") != "0"
+MOCKUP_INCREMENTAL_MIN_SIMILARITY = float(os.environ.get("MOCKUP_INCREMENTAL_MIN_SIMILARITY", "0.6"))
+MOCKUP_DIFF_MAX_CHANGED = 0.5       # above this share of changed components the page is regenerated in full
+
+# --- Report history (see report_history.py) ---
+# Generated reports and mockups are kept in a local SQLite database with a full-text index
+REPORT_HISTORY_ENABLED = os.environ.get("REPORT_HISTORY_ENABLED", "1") != "0"
+REPORT_HISTORY_PATH = os.environ.get("REPORT_HISTORY_PATH", os.path.join("output", "history", "reports.db"))
+REPORT_HISTORY_RESULTS = 20
+
+# --- Near-duplicate reuse (see near_duplicates.py) ---
+# Earlier reports/mockups for a business problem this similar (Jaccard over character
+# shingles) are offered before generating; at NEAR_DUPLICATE_AUTO_SERVE they are served
+# without any model calls (set it above 1 to always ask)
+NEAR_DUPLICATE_ENABLED = os.environ.get("NEAR_DUPLICATE_ENABLED", "1") != "0"
+NEAR_DUPLICATE_OFFER_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_OFFER_THRESHOLD", "0.8"))
+NEAR_DUPLICATE_AUTO_SERVE = float(os.environ.get("NEAR_DUPLICATE_AUTO_SERVE", "0.95"))
+NEAR_DUPLICATE_SHINGLE = 5          # characters per shingle
+NEAR_DUPLICATE_PERMUTATIONS = 64    # MinHash signature length
+NEAR_DUPLICATE_BANDS = 16           # LSH bands (of PERMUTATIONS / BANDS rows each)
+
+# --- Speculative mockup prefetch ---
+# Opt-in: start the mockup pipeline at "speculative" priority as soon as a report completes
+MOCKUP_PREFETCH_ENABLED = os.environ.get("MOCKUP_PREFETCH_ENABLED", "0") == "1"
+
+# --- Prompt token budgets ---
+# Input token budget per task; variable inputs are condensed/trimmed to fit (see prompt_builder.py)
+PROMPT_TOKEN_BUDGETS = {
+    "classify": 800,
+    "use_case_diagram": 1500,
+    "report": 6000,
+    "report_section": 5000,
+    "schema": 6000,
+    "mockup_html": 2000,
+    "mockup_fragments": 4000,
+}
+# "estimate" (characters / 4) or "model" (count static template text once with the model tokenizer)
+PROMPT_TOKEN_COUNTER = os.environ.get("PROMPT_TOKEN_COUNTER", "estimate")
 
+# --- Cancellation and job deadlines ---
+# Overall deadline (seconds) per job, covering every stage; work still running
+# at the deadline is cancelled and finished parts are kept (see cancellation.py)
+JOB_DEADLINES = {
+    "report": int(os.environ.get("REPORT_JOB_DEADLINE", "900")),
+    "mockup": int(os.environ.get("MOCKUP_JOB_DEADLINE", "600")),
+    "pdf": int(os.environ.get("PDF_JOB_DEADLINE", "180")),
+    "pdf_prerender": int(os.environ.get("PDF_JOB_DEADLINE", "180")),
+}
+# How often abandoned sessions/script runs are checked for
+JOB_WATCH_INTERVAL = 0.5
+# Per-process limits for the Mermaid CLI and the Playwright PDF export
+MERMAID_RENDER_TIMEOUT = 30
+PDF_EXPORT_TIMEOUT = 120
+# Child-process PDF exporter, called as `python <script> input.html output.pdf`
+# (relative to the project root); the load test swaps in a fake one
+PDF_EXPORT_SCRIPT = os.environ.get("PDF_EXPORT_SCRIPT", "pdf_export.py")
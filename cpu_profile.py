@@ -0,0 +1,274 @@
+"""
+CPU Profiling
+=============
+
+On-demand profiling of single report, mockup and PDF jobs, for finding out
+where a slow request spent its time (model calls, Mermaid sanitising, mmdc,
+BeautifulSoup, Playwright). Turn it on for every job with
+CPU_PROFILE_ENABLED=1, or for one browser session by opening the app with
+`?profile=1`. Each profiled job writes to CPU_PROFILE_DIR:
+
+- <job_id>.folded   collapsed stacks (wall-clock ms) for flamegraph.pl, speedscope or inferno
+- <job_id>.txt      the top CPU_PROFILE_TOP functions by own and total time
+- index.jsonl       one line per profiled job (id, kind, key, duration, files)
+
+CPU_PROFILE_MODE selects the profiler:
+
+- "sampling" (default): every CPU_PROFILE_INTERVAL seconds, records the stack
+  of the job's thread and of every other thread that is running project code
+  (Mermaid render workers, the PDF prerender). While the shared LLM event loop
+  is waiting, the suspended tasks are recorded instead, so waiting on Gemini
+  shows up under the calls that wait for it; mmdc and the Playwright export
+  show up as the process wait in cancellation.run_process. Overhead does not
+  depend on how much Python code runs.
+- "deterministic": cProfile on the job's thread only, with exact call counts
+  but a large slowdown of Python-heavy code. Writes <job_id>.prof (pstats,
+  snakeviz, flameprof) instead of the folded stacks.
+
+Other sessions' work running at the same time is sampled too, so profile
+while the server is quiet. When profiling is off, job() does nothing.
+"""
+
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import event_loop
+from config import CPU_PROFILE_DIR, CPU_PROFILE_ENABLED, CPU_PROFILE_INTERVAL, CPU_PROFILE_MODE, CPU_PROFILE_TOP
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Innermost frames of threads that are parked rather than working
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("cancellation.py", "_watch"),
+    ("memory_profile.py", "_sample_rss"),
+}
+_lock = threading.Lock()
+
+
+class JobProfile:
+    """Profile of one job; paths are filled in when the job finishes"""
+
+    def __init__(self, kind, key, mode):
+        self.kind = kind
+        self.key = key
+        self.mode = mode
+        self.job_id = f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{key[:8]}"
+        self.paths = []
+        self.summary_path = None
+        self.wall = 0.0
+
+
+@contextmanager
+def job(kind, key, enabled=CPU_PROFILE_ENABLED, mode=CPU_PROFILE_MODE):
+    """Profile the block as job kind/key when enabled; yields a JobProfile or None"""
+    if not enabled:
+        yield None
+        return
+    profile = JobProfile(kind, key, mode)
+    if mode == "deterministic":
+        profiler = _Deterministic()
+    else:
+        profiler = _Sampler(threading.get_ident(), CPU_PROFILE_INTERVAL)
+    started = time.perf_counter()
+    running = profiler.start()
+    try:
+        yield profile
+    finally:
+        if running:
+            profiler.stop()
+            profile.wall = time.perf_counter() - started
+            try:
+                _save(profile, profiler)
+            except Exception as e:
+                print(f"⚠️ Could not save CPU profile {profile.job_id}: {e}")  # Profiling must never break the app
+
+
+def _save(profile, profiler):
+    os.makedirs(CPU_PROFILE_DIR, exist_ok=True)
+    base = os.path.join(CPU_PROFILE_DIR, profile.job_id)
+    header = (
+        f"CPU profile of {profile.kind} job {profile.job_id} "
+        f"({profile.mode}, {profile.wall:.2f} s wall)\n"
+    )
+    profile.paths = profiler.write(base)
+    profile.summary_path = f"{base}.txt"
+    with open(profile.summary_path, "w", encoding="utf-8") as f:
+        f.write(header + "\n" + profiler.summary(CPU_PROFILE_TOP))
+    profile.paths.append(profile.summary_path)
+    record = {
+        "job_id": profile.job_id, "kind": profile.kind, "key": profile.key, "mode": profile.mode,
+        "time": time.time(), "wall_s": round(profile.wall, 3), "files": profile.paths,
+    }
+    with _lock:
+        with open(os.path.join(CPU_PROFILE_DIR, "index.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    print(f"⏱️ CPU profile of {profile.kind} job saved: {profile.summary_path}")
+
+
+def _label(code, names):
+    """('function (file:first line)', is project code) for a code object, cached in names"""
+    label = names.get(code)
+    if label is None:
+        path = os.path.abspath(code.co_filename)
+        project = path.startswith(ROOT)
+        if project:
+            filename = os.path.relpath(path, ROOT)
+        elif "site-packages" in path:
+            filename = path.split("site-packages" + os.sep, 1)[1]
+        else:
+            filename = os.path.basename(path)
+        label = names[code] = (f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":"), project)
+    return label
+
+
+def _thread_label(name):
+    """Thread name without its pool index, so workers of one pool share a root frame"""
+    return "thread " + re.sub(r"[-_]\d+$", "", name)
+
+
+class _Sampler:
+    """Wall-clock stack sampler over the job's thread and the threads working for it"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}  # (root, ..., leaf) -> seconds
+        self.samples = 0
+        self._names = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cpu-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample(own, now - last)
+            last = now
+
+    def _sample(self, own, elapsed):
+        self.samples += 1
+        threads = {thread.ident: thread.name for thread in threading.enumerate()}
+        loop, loop_thread = event_loop.loop_and_thread()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            code = frame.f_code
+            idle = (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+            root = _thread_label(threads.get(ident, "unknown"))
+            if loop_thread is not None and ident == loop_thread.ident and idle:
+                self._sample_tasks(loop, root, elapsed)
+                continue
+            if ident != self.thread_id and idle:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_label(frame.f_code, self._names))
+                frame = frame.f_back
+            if ident != self.thread_id and not any(project for _, project in stack):
+                continue  # Streamlit server and other library threads
+            self._add(root, [label for label, _ in reversed(stack)], elapsed)
+
+    def _sample_tasks(self, loop, root, elapsed):
+        """Stacks of the coroutines suspended on the shared loop"""
+        try:
+            tasks = list(asyncio.all_tasks(loop))
+        except RuntimeError:
+            return  # The task set changed while it was read; skip this sample
+        for task in tasks:
+            labels = []
+            coro = task.get_coro()
+            while coro is not None:
+                frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+                if frame is None:
+                    break
+                labels.append(_label(frame.f_code, self._names)[0])
+                coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+            if labels:
+                self._add(root, ["(awaiting)"] + labels, elapsed)
+
+    def _add(self, root, labels, elapsed):
+        stack = (root,) + tuple(labels)
+        self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed
+
+    def write(self, base):
+        path = f"{base}.folded"
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, seconds in sorted(self.stacks.items()):
+                ms = round(seconds * 1000)
+                if ms:
+                    f.write(f"{';'.join(stack)} {ms}\n")
+        return [path]
+
+    def summary(self, top):
+        own = {}
+        total = {}
+        threads = {}
+        for stack, seconds in self.stacks.items():
+            threads[stack[0]] = threads.get(stack[0], 0.0) + seconds
+            own[stack[-1]] = own.get(stack[-1], 0.0) + seconds
+            for function in set(stack[1:]):
+                total[function] = total.get(function, 0.0) + seconds
+        lines = [f"{self.samples} samples every {self.interval * 1000:.0f} ms; threads are sampled in parallel", ""]
+        lines.append("Time per thread:")
+        for name, seconds in sorted(threads.items(), key=lambda item: -item[1]):
+            lines.append(f"  {seconds:9.3f} s  {name}")
+        for title, table in (("own", own), ("total", total)):
+            lines.append("")
+            lines.append(f"Top {top} functions by {title} time:")
+            lines.append(f"  {'own s':>9} {'total s':>9}  function")
+            for function, _ in sorted(table.items(), key=lambda item: -item[1])[:top]:
+                lines.append(f"  {own.get(function, 0.0):9.3f} {total.get(function, 0.0):9.3f}  {function}")
+        return "\n".join(lines) + "\n"
+
+
+class _Deterministic:
+    """cProfile of the calling thread"""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        try:
+            self.profiler.enable()
+        except ValueError as e:
+            # Python 3.12+ allows one active profiler per process
+            print(f"⚠️ CPU profiling skipped: {e}")
+            return False
+        return True
+
+    def stop(self):
+        self.profiler.disable()
+
+    def write(self, base):
+        path = f"{base}.prof"
+        self.profiler.dump_stats(path)
+        return [path]
+
+    def summary(self, top):
+        out = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=out).strip_dirs()
+        stats.sort_stats("tottime").print_stats(top)
+        stats.sort_stats("cumulative").print_stats(top)
+        return out.getvalue()
@@ -0,0 +1,131 @@
+"""
+Shared Event Loop
+=================
+
+One asyncio event loop, running in a daemon thread, for every async Gemini
+call in the process. Streamlit script threads (and any other synchronous
+code) hand coroutines to it with run(); the caller's context variables
+(telemetry span, session/priority) are carried into the task, and callbacks
+wrapped with in_caller() — such as UI queue-position updates — are executed
+back on the calling thread while it waits.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import queue
+import threading
+import time
+
+_loop = None
+_thread = None
+_lock = threading.Lock()
+
+# Queue of (fn, args) to run on the thread blocked in run(); set inside bridged tasks
+_caller_calls = contextvars.ContextVar("event_loop_caller_calls", default=None)
+
+
+def get_loop():
+    """The shared loop, started on first use"""
+    global _loop, _thread
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def serve():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            _thread = threading.Thread(target=serve, name="llm-event-loop", daemon=True)
+            _thread.start()
+            ready.wait()
+            _loop = loop
+        return _loop
+
+
+def loop_and_thread():
+    """(loop, thread) of the shared loop, or (None, None) before it is first used"""
+    return _loop, _thread
+
+
+def in_loop_thread():
+    return _thread is not None and threading.current_thread() is _thread
+
+
+def submit(coro, context=None):
+    """Schedule coro on the shared loop; returns a concurrent.futures.Future.
+
+    The task runs in a copy of the caller's context. Cancelling the returned
+    future cancels the task, also while it runs: like
+    asyncio.run_coroutine_threadsafe, the future stays pending (never
+    "running") until the task has finished.
+    """
+    loop = get_loop()
+    context = context or contextvars.copy_context()
+    future = concurrent.futures.Future()
+
+    def start():
+        if future.cancelled():
+            coro.close()
+            return
+        task = context.run(loop.create_task, coro)
+
+        def copy_result(done):
+            if done.cancelled():
+                future.cancel()
+            elif not future.set_running_or_notify_cancel():
+                return  # Cancelled by the caller
+            elif done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result())
+
+        task.add_done_callback(copy_result)
+        future.add_done_callback(lambda f: f.cancelled() and loop.call_soon_threadsafe(task.cancel))
+
+    loop.call_soon_threadsafe(start)
+    return future
+
+
+def run(coro, timeout=None):
+    """Run coro on the shared loop and block until it finishes (from a non-loop thread)"""
+    if in_loop_thread():
+        coro.close()
+        raise RuntimeError("event_loop.run() cannot be called from the event loop thread; await instead")
+    calls = queue.SimpleQueue()
+    context = contextvars.copy_context()
+    context.run(_caller_calls.set, calls)
+    future = submit(coro, context)
+    future.add_done_callback(lambda f: calls.put(None))
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    try:
+        while True:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = calls.get(timeout=wait)
+            except queue.Empty:
+                raise TimeoutError("Timed out waiting for the event loop task")
+            if item is None:
+                return future.result()
+            fn, args = item
+            fn(*args)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def in_caller(fn):
+    """Wrap fn so that, inside a run() task, it executes on the thread that called run()"""
+    if fn is None:
+        return None
+
+    def call(*args):
+        calls = _caller_calls.get()
+        if calls is not None and in_loop_thread():
+            calls.put((fn, args))
+        else:
+            fn(*args)
+
+    return call
@@ -0,0 +1,333 @@
+"""
+Incremental Report Regeneration
+===============================
+
+Section-level dependency and cache model for business analysis reports. A
+generated report is split into its eight standard sections. When the business
+problem is edited, the change is reduced to the sentences that materially
+changed and each section is checked against it:
+
+- a section is regenerated if the changed content is relevant to it, or if a
+  section it depends on was regenerated with materially different content
+- every other section is reused as-is, including its diagrams
+
+A section that could not be regenerated keeps its previous text and stays
+stale, so the next update retries it.
+
+The app performs the model calls; this module only decides what to redo and
+merges the results back into the stored report.
+"""
+
+import difflib
+import hashlib
+import re
+
+from report_model import parse_report
+
+# Section order, headings, generation instructions and dependencies. The
+# instructions mirror the numbered items of REPORT_PROMPT_TEMPLATE.
+REPORT_SECTIONS = [
+    {
+        "key": "stakeholder_map",
+        "heading": "## 01. Stakeholder Map",
+        "keywords": ("stakeholder",),
+        "depends_on": (),
+        "instructions": (
+            "Stakeholder Map (as a Mermaid diagram in a code block). List all unique stakeholders relevant to this "
+            "scenario. Use ONLY simple Mermaid syntax: flowchart TD with basic rectangles and arrows, "
+            "no special characters, no advanced formatting, no styling."
+        ),
+    },
+    {
+        "key": "process_flow",
+        "heading": "## 02. Process Flow",
+        "keywords": ("process flow", "process"),
+        "depends_on": (),
+        "instructions": (
+            "Process Flow according to the business problem (as a Mermaid diagram in a code block). Describe the "
+            "unique steps for this specific journey. Use ONLY simple Mermaid syntax: flowchart TD with basic "
+            "rectangles and arrows, no special characters, no advanced formatting, no styling."
+        ),
+    },
+    {
+        "key": "brd",
+        "heading": "## 03. Business Requirement Document (BRD)",
+        "keywords": ("business requirement", "brd"),
+        "depends_on": (),
+        "instructions": "Business Requirement Document (BRD).",
+    },
+    {
+        "key": "frs",
+        "heading": "## 04. Functional Requirement Specification (FRS)",
+        "keywords": ("functional requirement", "frs", "non-functional"),
+        "depends_on": ("brd",),
+        "instructions": "Functional Requirement Specification (FRS), including Non-Functional Requirements.",
+    },
+    {
+        "key": "use_cases",
+        "heading": "## 05. Use Case Diagrams and Scenarios",
+        "keywords": ("use case",),
+        "depends_on": ("frs",),
+        "instructions": (
+            "Use Case Diagrams and detailed Scenarios. Write each use case as '**Use Case N:** title', "
+            "'**Actors:**', '**Preconditions:**' and '**Main Flow:**' lines. Each scenario must be specific "
+            "to the business problem."
+        ),
+    },
+    {
+        "key": "data_mapping",
+        "heading": "## 06. Data Mapping Sheet and Data Requirements Analysis",
+        "keywords": ("data mapping", "data requirement"),
+        "depends_on": ("brd",),
+        "instructions": (
+            "Data Mapping Sheet and Data Requirements Analysis as a Markdown table with the columns: | Data Element "
+            "| Source System(s) | Data Type | Frequency/Freshness | Purpose for Personalization | Availability (Y/N) "
+            "| PII/Sensitivity (PII, Sensitive, Public) | Data Owner | Transformation/Processing | Remarks/Privacy "
+            "Concerns |. Be concise and clear."
+        ),
+    },
+    {
+        "key": "scope",
+        "heading": "## 07. Functional Scope Summary",
+        "keywords": ("scope",),
+        "depends_on": ("brd", "frs"),
+        "instructions": "Functional Scope Summary (In/Out of Scope).",
+    },
+    {
+        "key": "kpis",
+        "heading": "## 08. Suggested KPIs",
+        "keywords": ("kpi", "success measurement", "metrics"),
+        "depends_on": ("brd",),
+        "instructions": "Suggested KPIs for success measurement.",
+    },
+]
+SECTION_KEYS = [spec["key"] for spec in REPORT_SECTIONS]
+SECTIONS_BY_KEY = {spec["key"]: spec for spec in REPORT_SECTIONS}
+
+# A report must expose at least this many known sections to be updated incrementally
+MIN_MATCHED_SECTIONS = 5
+# Share of the problem's content words that may change before everything is regenerated
+MAJOR_CHANGE_RATIO = 0.5
+# Share of the changed content words that must occur in a section to make it stale
+SECTION_RELEVANCE_THRESHOLD = 0.25
+# Regenerated upstream sections below this word-set similarity make dependents stale
+DEPENDENCY_SIMILARITY_THRESHOLD = 0.8
+
+STOPWORDS = frozenset(
+    "a an and are as at be been but by can could for from has have how in into is it its of on or our "
+    "should so that the their them there these they this to was we were what when which while who will "
+    "with would you your also more most need needs must shall want wants".split()
+)
+
+_NUMBER_RE = re.compile(r"^(\d{1,2})[.)]?\s")
+
+
+def _fingerprint(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def content_words(text):
+    """Lower-case words that carry meaning (no stopwords, no short tokens)"""
+    return {w for w in re.findall(r"[a-z0-9%]+", text.lower()) if w not in STOPWORDS and (len(w) > 2 or w.isdigit())}
+
+
+def split_sentences(text):
+    parts = re.split(r"(?<=[.!?])\s+|\n+", text or "")
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _normalize_sentence(sentence):
+    return " ".join(re.findall(r"[a-z0-9%]+", sentence.lower()))
+
+
+def problem_delta(old_problem, new_problem):
+    """Describe a problem edit as (changed_words, context_words, changed_ratio).
+
+    changed_words are content words added or removed by the edit,
+    context_words are all content words of the edited sentences and
+    changed_ratio is the share of the problem's content words touched. Sentences that only
+    differ in case, whitespace or punctuation are ignored, and so are edits
+    that only touch stopwords.
+    """
+    old = {_normalize_sentence(s) for s in split_sentences(old_problem)}
+    new = {_normalize_sentence(s) for s in split_sentences(new_problem)}
+    old.discard("")
+    new.discard("")
+    removed, added = old - new, new - old
+    old_words = set().union(*(content_words(s) for s in removed)) if removed else set()
+    new_words = set().union(*(content_words(s) for s in added)) if added else set()
+    changed_words = old_words ^ new_words
+    if not changed_words:
+        return set(), set(), 0.0
+    ratio = len(changed_words) / max(1, len(content_words(old_problem) | content_words(new_problem)))
+    return changed_words, old_words | new_words, ratio
+
+
+def word_similarity(a, b):
+    wa, wb = content_words(a), content_words(b)
+    if not wa and not wb:
+        return 1.0
+    return len(wa & wb) / len(wa | wb)
+
+
+def match_section(heading):
+    """Map a '## ...' heading to a section key (or None)"""
+    number = _NUMBER_RE.match(heading.strip())
+    if number and 1 <= int(number.group(1)) <= len(REPORT_SECTIONS):
+        return REPORT_SECTIONS[int(number.group(1)) - 1]["key"]
+    lowered = heading.lower()
+    for spec in REPORT_SECTIONS:
+        if any(keyword in lowered for keyword in spec["keywords"]):
+            return spec["key"]
+    return None
+
+
+def split_report(report_text):
+    """Split a Markdown report into (intro, {section_key: text}) in report order.
+
+    Unrecognised '##' headings stay attached to the preceding section.
+    """
+    headings = parse_report(report_text).sections(level=2)
+    sections = {}
+    intro_end = headings[0].start if headings else len(report_text)
+    intro = report_text[:intro_end]
+    current = None
+    for i, heading in enumerate(headings):
+        # Sections run to the next '##' heading, so stray '#' headings are kept too
+        end = headings[i + 1].start if i + 1 < len(headings) else len(report_text)
+        text = report_text[heading.start:end]
+        key = match_section(heading.title)
+        if key is not None and key not in sections:
+            current = key
+            sections[key] = text
+        elif current is not None:
+            sections[current] += text
+        else:
+            intro += text
+    return intro, sections
+
+
+class ReportState:
+    """A generated report kept per session for section-level reuse"""
+
+    def __init__(self, business_problem, report_text, diagram_cache=None):
+        self.business_problem = business_problem
+        self.intro, self.sections = split_report(report_text)
+        self.diagram_cache = dict(diagram_cache or {})
+        self.section_hashes = {key: _fingerprint(text) for key, text in self.sections.items()}
+        self.failed = set()  # Stale sections whose regeneration failed or was stopped
+
+    @classmethod
+    def from_report(cls, business_problem, report_text, diagram_cache=None):
+        """Return a ReportState, or None if the report lacks the standard sections"""
+        state = cls(business_problem, report_text, diagram_cache)
+        if len(state.sections) < MIN_MATCHED_SECTIONS:
+            return None
+        return state
+
+    def replace_report(self, report_text):
+        """Re-split after the report text was changed outside this object (e.g. diagrams inserted)"""
+        self.intro, self.sections = split_report(report_text)
+        self.section_hashes = {key: _fingerprint(text) for key, text in self.sections.items()}
+
+    def report_text(self):
+        ordered = [self.sections[key] for key in SECTION_KEYS if key in self.sections]
+        parts = [self.intro] + [text if text.endswith("\n") else text + "\n" for text in ordered]
+        return "".join(parts)
+
+    def plan(self, new_problem):
+        """Sections to regenerate directly because of the problem edit (dependents are decided later).
+
+        Sections that failed to regenerate earlier are always included.
+        """
+        stale = set(self._stale(new_problem)) | self.failed
+        return [key for key in SECTION_KEYS if key in stale]
+
+    def _stale(self, new_problem):
+        changed_words, context_words, ratio = problem_delta(self.business_problem, new_problem)
+        if not changed_words:
+            return []
+        if ratio > MAJOR_CHANGE_RATIO:
+            return list(SECTION_KEYS)
+        section_words = {key: content_words(text) for key, text in self.sections.items()}
+        report_words = set().union(*section_words.values()) if section_words else set()
+        # Words the report never mentions (a new concept) are located through the
+        # rest of the edited sentence instead
+        probe = changed_words if changed_words & report_words else context_words
+        stale = []
+        for key in SECTION_KEYS:
+            if key not in section_words:
+                stale.append(key)
+                continue
+            overlap = len(probe & section_words[key]) / len(probe)
+            if overlap >= SECTION_RELEVANCE_THRESHOLD:
+                stale.append(key)
+        return stale
+
+    def regenerate(self, new_problem, generate_section):
+        """Regenerate stale sections in dependency order.
+
+        generate_section(spec, business_problem, context) returns the new
+        Markdown for one section (None if it failed); context maps dependency
+        keys to their current text. An exception from it stops the run: the
+        sections not yet done stay stale, Exceptions end up in the summary's
+        "stopped" and anything else (e.g. a Streamlit rerun) is re-raised.
+        Returns a summary dict with the regenerated/reused/failed keys and a
+        unified diff of the report.
+        """
+        before = self.report_text()
+        stale = set(self.plan(new_problem))
+        regenerated = []
+        changed_upstream = set()
+        stopped = None
+
+        def due(position):
+            return {
+                spec["key"] for spec in REPORT_SECTIONS[position:]
+                if spec["key"] in stale or set(spec["depends_on"]) & changed_upstream
+            }
+
+        for position, spec in enumerate(REPORT_SECTIONS):
+            key = spec["key"]
+            if key not in stale and not (set(spec["depends_on"]) & changed_upstream):
+                continue
+            context = {dep: self.sections[dep] for dep in spec["depends_on"] if dep in self.sections}
+            try:
+                new_text = generate_section(spec, new_problem, context)
+            except Exception as e:
+                self.failed |= due(position)
+                stopped = str(e) or type(e).__name__
+                break
+            except BaseException:
+                self.failed |= due(position)
+                self.business_problem = new_problem
+                raise
+            if not new_text:
+                self.failed.add(key)  # Keep the previous section rather than losing it; retried next time
+                continue
+            self.failed.discard(key)
+            old_text = self.sections.get(key, "")
+            self.sections[key] = new_text.strip() + "\n\n"
+            self.section_hashes[key] = _fingerprint(self.sections[key])
+            regenerated.append(key)
+            if word_similarity(old_text, new_text) < DEPENDENCY_SIMILARITY_THRESHOLD:
+                changed_upstream.add(key)
+        self.business_problem = new_problem
+        after = self.report_text()
+        diff = list(difflib.unified_diff(before.splitlines(), after.splitlines(), "previous", "updated", lineterm=""))
+        return {
+            "regenerated": regenerated,
+            "reused": [
+                key for key in SECTION_KEYS if key in self.sections and key not in regenerated and key not in self.failed
+            ],
+            "failed": [key for key in SECTION_KEYS if key in self.failed],
+            "stopped": stopped,
+            "diff": "\n".join(diff),
+            "lines_changed": sum(1 for line in diff if line[:1] in "+-" and line[:3] not in ("+++", "---")),
+        }
+
+
+def use_case_key(use_case):
+    """Cache key for a use case's diagram (independent of its number)"""
+    text = "\n".join(_normalize_sentence(use_case.get(field, "")) for field in ("title", "actors", "main_flow"))
+    return _fingerprint(text)
@@ -0,0 +1,298 @@
+"""
+Gemini Call Wrapper
+===================
+
+Single entry point for every `generate_content` call made by the dashboard and
+the mockup agent. Adds telemetry, per-task deadlines, retries with jittered
+backoff and the shared circuit breaker from resilience.py.
+
+generate_async()/generate_content_async() are the coroutine variants built on
+the SDK's `generate_content_async`; run them on the shared loop from
+event_loop.py (event_loop.run() from synchronous code).
+
+generate_stream()/generate_stream_async() request a streamed response and
+hand its text to a callback chunk by chunk, which can stop reading early.
+"""
+
+import time
+from contextlib import contextmanager
+
+import cancellation
+import event_loop
+import routing
+import telemetry
+from config import LLM_DEADLINES, LLM_DEFAULT_DEADLINE, LLM_EXPECTED_OUTPUT_TOKENS, LLM_TASK_PRIORITY
+from resilience import call_with_resilience, call_with_resilience_async, remaining_time
+from scheduler import current_context, scheduler
+
+
+def task_deadline(task, deadline=None):
+    """Absolute monotonic deadline for a task, tightened by an outer deadline"""
+    own = time.monotonic() + LLM_DEADLINES.get(task, LLM_DEFAULT_DEADLINE)
+    return min(own, deadline) if deadline is not None else own
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token)"""
+    return max(1, len(text) // 4)
+
+
+def response_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return (getattr(usage, "prompt_token_count", 0) or 0) + (getattr(usage, "candidates_token_count", 0) or 0)
+
+
+class _ModelCall:
+    """Admission, routing, retry bookkeeping and latency observation for one logical call.
+
+    Shared by generate_content(), generate_stream() and their async variants:
+    each attempt is admitted with admit()/admit_async() and runs inside
+    attempt(ticket), which routes it, releases the admission slot and feeds
+    its latency back to routing.
+    """
+
+    def __init__(self, task, prompt, model, deadline, kwargs):
+        self.task = task
+        self.model = model
+        self.deadline = task_deadline(task, cancellation.effective_deadline(deadline))
+        self.base_options = kwargs.pop("request_options", None) or {}
+        self.context = current_context()
+        self.session_id = self.context.get("session_id", "default")
+        self.priority = self.context.get("priority") or LLM_TASK_PRIORITY.get(task, "batch")
+        self.prompt_chars = len(str(prompt))
+        self.reserved_tokens = estimate_tokens(str(prompt)) + LLM_EXPECTED_OUTPUT_TOKENS.get(task, 1000)
+        self.span = None
+
+    @contextmanager
+    def traced(self, **attributes):
+        with telemetry.span(
+            "llm.generate", task=self.task, priority=self.priority, prompt_chars=self.prompt_chars, **attributes
+        ) as llm_span:
+            self.span = llm_span
+            yield llm_span
+
+    def on_retry(self, retry, error_class, exc, delay):
+        self.span.retries = retry
+        self.span.set(last_error_class=error_class)
+        print(f"⚠️ Gemini {self.task} call failed ({error_class}), retrying in {delay:.1f}s")
+
+    def admit(self):
+        with telemetry.span("llm.queue", task=self.task, priority=self.priority):
+            return scheduler.acquire(
+                self.session_id, self.priority, self.reserved_tokens, self.deadline, self.context.get("on_wait")
+            )
+
+    async def admit_async(self):
+        # Queue-position callbacks run on the thread that called event_loop.run()
+        on_wait = event_loop.in_caller(self.context.get("on_wait"))
+        with telemetry.span("llm.queue", task=self.task, priority=self.priority):
+            return await scheduler.acquire_async(
+                self.session_id, self.priority, self.reserved_tokens, self.deadline, on_wait
+            )
+
+    @contextmanager
+    def attempt(self, ticket):
+        """Run one admitted attempt; yields an _Attempt and always releases the ticket"""
+        current = None
+        try:
+            call_model, model_name = self.model, getattr(self.model, "model_name", None)
+            if call_model is None:
+                call_model, model_name, fell_back = routing.select(self.task)
+                self.span.set(model=model_name, fallback=fell_back)
+            request_options = dict(self.base_options)
+            request_options.setdefault("timeout", remaining_time(self.deadline))
+            current = _Attempt(call_model, model_name, request_options)
+            yield current
+            if current.latency is not None:
+                routing.observe_latency(current.model_name, self.task, current.latency)
+        except Exception:
+            if current is not None:
+                # Slow failures (timeouts) should push the estimate up; fast ones say nothing
+                elapsed = current.elapsed()
+                if elapsed > (routing.expected_latency(current.model_name, self.task) or 0):
+                    routing.observe_latency(current.model_name, self.task, elapsed)
+            raise
+        finally:
+            scheduler.release(ticket, current.tokens if current is not None else None)
+
+    def finish(self, response):
+        if response is not None:
+            self.span.record_usage(response)
+        return response
+
+
+class _Attempt:
+    def __init__(self, model, model_name, request_options):
+        self.model = model
+        self.model_name = model_name
+        self.request_options = request_options
+        self.started = time.perf_counter()
+        self.tokens = None
+        self.latency = None  # Set by done(); an abandoned attempt says nothing about latency
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def done(self, response):
+        """The response is complete: record its token usage and latency"""
+        self.tokens = response_tokens(response)
+        self.latency = self.elapsed()
+        return response
+
+
+def generate(task, prompt, deadline=None, **kwargs):
+    """Call the model routed for `task` (see MODEL_ROUTES in config.py)"""
+    return generate_content(None, prompt, task=task, deadline=deadline, **kwargs)
+
+
+def generate_content(model, prompt, task="llm", deadline=None, **kwargs):
+    """Call model.generate_content(prompt) resiliently and return the response.
+
+    With model=None the model is chosen per attempt by routing.select(task),
+    falling back to a faster tier when the task's latency budget would be
+    blown. Each attempt first waits for an admission slot from the shared
+    scheduler, attributed to the session/priority set with
+    scheduler.request_context(). The deadline is tightened to the current
+    job's (cancellation.scope()), and a cancelled job makes no further attempts.
+    """
+    call = _ModelCall(task, prompt, model, deadline, kwargs)
+    with call.traced():
+        def attempt():
+            with call.attempt(call.admit()) as current:
+                return current.done(
+                    current.model.generate_content(prompt, request_options=current.request_options, **kwargs)
+                )
+
+        return call.finish(call_with_resilience(attempt, deadline=call.deadline, on_retry=call.on_retry))
+
+
+async def generate_async(task, prompt, deadline=None, **kwargs):
+    """Async variant of generate()"""
+    return await generate_content_async(None, prompt, task=task, deadline=deadline, **kwargs)
+
+
+async def generate_content_async(model, prompt, task="llm", deadline=None, **kwargs):
+    """Async variant of generate_content(): same routing, admission, retries and telemetry.
+
+    Queue-position callbacks from request_context(on_wait=...) run on the
+    thread that called event_loop.run(), not on the loop thread. Cancelling
+    the current job cancels the in-flight request.
+    """
+    call = _ModelCall(task, prompt, model, deadline, kwargs)
+    with call.traced(mode="async"):
+        async def attempt():
+            with call.attempt(await call.admit_async()) as current:
+                return current.done(await current.model.generate_content_async(
+                    prompt, request_options=current.request_options, **kwargs
+                ))
+
+        # A cancelled job abandons the request (and its admission slot) immediately
+        return call.finish(await call_with_resilience_async(
+            lambda: cancellation.guard(attempt()), deadline=call.deadline, on_retry=call.on_retry
+        ))
+
+
+def _chunk_text(chunk):
+    try:
+        return chunk.text or ""
+    except ValueError:  # A chunk without text parts (e.g. only a finish reason)
+        return ""
+
+
+def _close_stream(response, chunks):
+    """Stop reading a streamed response (abandoned, failed or finished): close our iterator and the response"""
+    for closeable in (chunks, response):
+        close = getattr(closeable, "close", None)
+        if callable(close):
+            close()
+
+
+async def _close_stream_async(response, chunks):
+    for closeable in (chunks, response):
+        close = getattr(closeable, "aclose", None) or getattr(closeable, "close", None)
+        if callable(close):
+            result = close()
+            if hasattr(result, "__await__"):
+                await result
+
+
+def generate_stream(task, prompt, on_text, deadline=None, **kwargs):
+    """Streaming variant of generate(): on_text(chunk) is called with the text as it arrives.
+
+    Admission, routing, retries and telemetry work as in generate_content().
+    on_text returning False abandons the response (the call then returns
+    None); otherwise the finished response is returned. The stream is closed
+    however reading it ends. A retry after text was
+    already delivered first calls on_text(None): drop what was received.
+    """
+    call = _ModelCall(task, prompt, None, deadline, kwargs)
+    with call.traced(mode="stream") as llm_span:
+        delivered = {"chars": 0}
+
+        def attempt():
+            if delivered["chars"]:
+                on_text(None)
+                delivered["chars"] = 0
+            with call.attempt(call.admit()) as current:
+                response = current.model.generate_content(
+                    prompt, stream=True, request_options=current.request_options, **kwargs
+                )
+                chunks = iter(response)
+                try:
+                    for chunk in chunks:
+                        text = _chunk_text(chunk)
+                        if not text:
+                            continue
+                        if delivered["chars"] == 0:
+                            llm_span.set(first_chunk_s=round(current.elapsed(), 3))
+                        delivered["chars"] += len(text)
+                        if on_text(text) is False:
+                            llm_span.set(abandoned=True)
+                            return None
+                        cancellation.check()
+                finally:
+                    _close_stream(response, chunks)
+                return current.done(response)
+
+        response = call_with_resilience(attempt, deadline=call.deadline, on_retry=call.on_retry)
+        llm_span.set(chars=delivered["chars"])
+        return call.finish(response)
+
+
+async def generate_stream_async(task, prompt, on_text, deadline=None, **kwargs):
+    """Async variant of generate_stream(); on_text runs on the event loop"""
+    call = _ModelCall(task, prompt, None, deadline, kwargs)
+    with call.traced(mode="async_stream") as llm_span:
+        delivered = {"chars": 0}
+
+        async def attempt():
+            if delivered["chars"]:
+                on_text(None)
+                delivered["chars"] = 0
+            with call.attempt(await call.admit_async()) as current:
+                response = await current.model.generate_content_async(
+                    prompt, stream=True, request_options=current.request_options, **kwargs
+                )
+                chunks = response.__aiter__()
+                try:
+                    async for chunk in chunks:
+                        text = _chunk_text(chunk)
+                        if not text:
+                            continue
+                        if delivered["chars"] == 0:
+                            llm_span.set(first_chunk_s=round(current.elapsed(), 3))
+                        delivered["chars"] += len(text)
+                        if on_text(text) is False:
+                            llm_span.set(abandoned=True)
+                            return None
+                finally:
+                    await _close_stream_async(response, chunks)
+                return current.done(response)
+
+        response = await call_with_resilience_async(
+            lambda: cancellation.guard(attempt()), deadline=call.deadline, on_retry=call.on_retry
+        )
+        llm_span.set(chars=delivered["chars"])
+        return call.finish(response)
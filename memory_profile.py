@@ -0,0 +1,354 @@
+"""
+Memory Profiling
+================
+
+Opt-in (MEMORY_PROFILE_ENABLED=1) memory instrumentation for the pipeline
+stages. Telemetry spans whose name starts with one of MEMORY_PROFILE_STAGES
+(report generation, image embedding, HTML post-processing, PDF export and the
+mockup agent) also record:
+
+- the peak RSS of the process while the stage ran, sampled in the background
+- the peak Python memory traced by tracemalloc, and what the stage left allocated
+- the project source lines that allocated the most during the stage
+
+Records are appended as JSON lines to MEMORY_PROFILE_PATH, and sites that kept
+more than MEMORY_PROFILE_FLAG_MB are printed as warnings. For a per-stage
+report across runs:
+
+    python memory_profile.py [output/telemetry/memory.jsonl] [--top 15]
+
+Memory is shared by the whole process, so stages running at the same time in
+other sessions or background jobs (the PDF prerender) show up in each other's
+numbers; profile with a single session for clean attribution. tracemalloc
+slows allocation-heavy code down noticeably, so leave this off in production.
+"""
+
+import argparse
+import importlib
+import json
+import linecache
+import os
+import platform
+import resource
+import statistics
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from config import (
+    MEMORY_PROFILE_ENABLED,
+    MEMORY_PROFILE_FLAG_MB,
+    MEMORY_PROFILE_FRAMES,
+    MEMORY_PROFILE_PATH,
+    MEMORY_PROFILE_PRELOAD,
+    MEMORY_PROFILE_RSS_INTERVAL,
+    MEMORY_PROFILE_STAGES,
+    MEMORY_PROFILE_TOP,
+)
+
+MB = 2 ** 20
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Frames that are never reported as the allocating site
+_INFRASTRUCTURE = (os.path.abspath(__file__), os.path.join(ROOT, "telemetry.py"))
+# Allocations made here are skipped (Snapshot.filter_traces is far slower than skipping them in top_sites)
+_IGNORED_ALLOCATORS = (
+    __file__, tracemalloc.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>", "<unknown>",
+)
+
+_lock = threading.Lock()
+_preloaded = False
+_open = []  # stages being profiled right now, in every thread
+_sampler = None
+_stage_stats = {}
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No /proc: fall back to the lifetime peak (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def enabled_for(name):
+    return MEMORY_PROFILE_ENABLED and name.startswith(MEMORY_PROFILE_STAGES)
+
+
+class StageUsage:
+    """Memory measurements of one run of a stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.span = None  # telemetry span of the stage, linked by telemetry.span()
+        self.thread = threading.current_thread().name
+        self.rss_start = self.rss_peak = current_rss()
+        self.traced_start = self.traced_peak = 0
+        self.snapshot = None
+        self.started = time.perf_counter()
+
+
+@contextmanager
+def stage(name):
+    """Profile the block if name is one of MEMORY_PROFILE_STAGES; yields a StageUsage or None"""
+    if not enabled_for(name):
+        yield None
+        return
+    usage = _enter(name)
+    try:
+        yield usage
+    finally:
+        try:
+            _exit(usage)
+        except Exception as e:
+            print(f"⚠️ Memory profile of {name} failed: {e}")  # Profiling must never break the app
+
+
+def _preload():
+    """Import the app's lazily loaded modules before tracing starts.
+
+    Otherwise the first run of a stage is dominated (and slowed down by
+    seconds) by tracing the import of markdown, bs4 or pdfplumber.
+    """
+    global _preloaded
+    if _preloaded:
+        return
+    _preloaded = True
+    for module in MEMORY_PROFILE_PRELOAD:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def _enter(name):
+    _preload()
+    usage = StageUsage(name)
+    with _lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_PROFILE_FRAMES)
+        _fold_peak()
+        usage.traced_start = usage.traced_peak = tracemalloc.get_traced_memory()[0]
+        usage.snapshot = tracemalloc.take_snapshot()
+        _open.append(usage)
+        _ensure_sampler()
+    return usage
+
+
+def _exit(usage):
+    with _lock:
+        _fold_peak()
+        traced_end = tracemalloc.get_traced_memory()[0]
+        after = tracemalloc.take_snapshot()
+        _open.remove(usage)
+        if not _open:
+            tracemalloc.stop()  # No tracing overhead between profiled stages
+    usage.rss_peak = max(usage.rss_peak, current_rss())
+    record = {
+        "stage": usage.name,
+        "time": time.time(),
+        "duration_ms": round((time.perf_counter() - usage.started) * 1000, 3),
+        "thread": usage.thread,
+        "trace_id": usage.span.trace_id if usage.span else None,
+        "span_id": usage.span.span_id if usage.span else None,
+        "attrs": usage.span.attrs if usage.span else {},
+        "rss_start_mb": round(usage.rss_start / MB, 2),
+        "rss_peak_mb": round(usage.rss_peak / MB, 2),
+        "rss_growth_mb": round((usage.rss_peak - usage.rss_start) / MB, 2),
+        "traced_peak_mb": round((usage.traced_peak - usage.traced_start) / MB, 2),
+        "net_alloc_mb": round((traced_end - usage.traced_start) / MB, 2),
+        "top_sites": top_sites(after.compare_to(usage.snapshot, "traceback")),
+    }
+    usage.snapshot = None
+    _finish(record)
+    return record
+
+
+def _fold_peak():
+    """Credit the traced peak so far to every open stage, then restart peak tracking (caller holds the lock)"""
+    peak = tracemalloc.get_traced_memory()[1]
+    for usage in _open:
+        usage.traced_peak = max(usage.traced_peak, peak)
+    tracemalloc.reset_peak()
+
+
+def _ensure_sampler():
+    global _sampler
+    if _sampler is None or not _sampler.is_alive():
+        _sampler = threading.Thread(target=_sample_rss, name="memory-rss-sampler", daemon=True)
+        _sampler.start()
+
+
+def _sample_rss():
+    global _sampler
+    while True:
+        time.sleep(MEMORY_PROFILE_RSS_INTERVAL)
+        rss = current_rss()
+        with _lock:
+            if not _open:
+                _sampler = None
+                return
+            for usage in _open:
+                usage.rss_peak = max(usage.rss_peak, rss)
+
+
+def _short_name(filename, names):
+    """(display name, is project code) of a source file, cached in names"""
+    if filename not in names:
+        path = os.path.abspath(filename)
+        if path.startswith(ROOT):
+            names[filename] = (os.path.relpath(path, ROOT), path not in _INFRASTRUCTURE)
+        elif "site-packages" in path:
+            names[filename] = (path.split("site-packages" + os.sep, 1)[1], False)
+        else:
+            names[filename] = (os.path.basename(path), False)
+    return names[filename]
+
+
+def top_sites(diffs, limit=MEMORY_PROFILE_TOP):
+    """Largest net allocations grouped by the project line responsible for them.
+
+    A library allocation (base64, bs4, ...) is attributed to the innermost
+    project frame on its stack; "via" is where the memory was actually allocated.
+    """
+    names = {}
+    sites = {}
+    for diff in diffs:
+        if diff.size_diff <= 0:
+            continue
+        innermost = frame = diff.traceback[-1]
+        if innermost.filename in _IGNORED_ALLOCATORS:
+            continue
+        for candidate in reversed(diff.traceback):
+            if _short_name(candidate.filename, names)[1]:
+                frame = candidate
+                break
+        where = f"{_short_name(frame.filename, names)[0]}:{frame.lineno}"
+        site = sites.setdefault(where, {"size": 0, "count": 0, "frame": frame, "via": {}})
+        site["size"] += diff.size_diff
+        site["count"] += diff.count_diff
+        via = f"{_short_name(innermost.filename, names)[0]}:{innermost.lineno}"
+        site["via"][via] = site["via"].get(via, 0) + diff.size_diff
+    ranked = sorted(sites.items(), key=lambda item: -item[1]["size"])[:limit]
+    return [
+        {
+            "site": name,
+            "line": linecache.getline(site["frame"].filename, site["frame"].lineno).strip()[:120],
+            "size_mb": round(site["size"] / MB, 3),
+            "count": site["count"],
+            "via": max(site["via"], key=site["via"].get),
+            "flagged": site["size"] >= MEMORY_PROFILE_FLAG_MB * MB,
+        }
+        for name, site in ranked
+    ]
+
+
+def _finish(record):
+    with _lock:
+        stats = _stage_stats.setdefault(record["stage"], {
+            "count": 0, "rss_growth_max": 0.0, "traced_peak_max": 0.0, "net_alloc_sum": 0.0, "sites": {},
+        })
+        stats["count"] += 1
+        stats["rss_growth_max"] = max(stats["rss_growth_max"], record["rss_growth_mb"])
+        stats["traced_peak_max"] = max(stats["traced_peak_max"], record["traced_peak_mb"])
+        stats["net_alloc_sum"] += record["net_alloc_mb"]
+        for site in record["top_sites"]:
+            stats["sites"][site["site"]] = max(stats["sites"].get(site["site"], 0.0), site["size_mb"])
+    print(
+        f"🧠 {record['stage']}: peak RSS {record['rss_peak_mb']:.0f} MB (+{record['rss_growth_mb']:.1f}), "
+        f"traced peak +{record['traced_peak_mb']:.1f} MB, net {record['net_alloc_mb']:+.1f} MB"
+    )
+    for site in record["top_sites"]:
+        if site["flagged"]:
+            print(f"⚠️ {record['stage']}: {site['site']} kept {site['size_mb']:.1f} MB  {site['line']}")
+    _write_jsonl(record)
+
+
+def _write_jsonl(record):
+    if not MEMORY_PROFILE_PATH:
+        return
+    try:
+        os.makedirs(os.path.dirname(MEMORY_PROFILE_PATH) or ".", exist_ok=True)
+        line = json.dumps(record, default=str)
+        with _lock:
+            with open(MEMORY_PROFILE_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError:
+        pass
+
+
+def stage_summary():
+    """Per-stage aggregates for display"""
+    with _lock:
+        return [
+            {
+                "stage": name,
+                "runs": s["count"],
+                "max_rss_growth_mb": round(s["rss_growth_max"], 1),
+                "max_traced_peak_mb": round(s["traced_peak_max"], 1),
+                "avg_net_mb": round(s["net_alloc_sum"] / s["count"], 2),
+                "top_site": max(s["sites"], key=s["sites"].get) if s["sites"] else "",
+            }
+            for name, s in sorted(_stage_stats.items())
+        ]
+
+
+def render_sidebar_panel():
+    """Streamlit sidebar panel with the per-stage memory aggregates"""
+    import streamlit as st
+
+    with st.sidebar.expander("Memory profile", expanded=False):
+        rows = stage_summary()
+        if not rows:
+            st.caption("No profiled stages yet.")
+            return
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        st.caption(f"Full records: {MEMORY_PROFILE_PATH}")
+
+
+def report(records, top=15):
+    """Text report: per-stage memory over all runs, then the allocation sites to look at first"""
+    stages = {}
+    sites = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record)
+        for site in record["top_sites"]:
+            entry = sites.setdefault(site["site"], {"size_mb": 0.0, "stages": set(), "line": site["line"], "via": site["via"]})
+            entry["size_mb"] = max(entry["size_mb"], site["size_mb"])
+            entry["stages"].add(record["stage"])
+    lines = [f"{'stage':<26} {'runs':>5} {'RSS growth p50/max':>20} {'traced peak max':>16} {'net avg':>9}"]
+    for name, runs in sorted(stages.items()):
+        growth = [r["rss_growth_mb"] for r in runs]
+        lines.append(
+            f"{name:<26} {len(runs):>5} {statistics.median(growth):>9.1f}/{max(growth):<7.1f} MB "
+            f"{max(r['traced_peak_mb'] for r in runs):>13.1f} MB {statistics.fmean(r['net_alloc_mb'] for r in runs):>+7.1f} MB"
+        )
+    lines.append("")
+    lines.append(f"Top allocation sites (largest net allocation in one run, top {top}):")
+    for name, site in sorted(sites.items(), key=lambda item: -item[1]["size_mb"])[:top]:
+        flag = "⚠️ " if site["size_mb"] >= MEMORY_PROFILE_FLAG_MB else "   "
+        via = f" via {site['via']}" if site["via"] != name else ""
+        lines.append(f"{flag}{site['size_mb']:>8.2f} MB  {name}{via}  [{', '.join(sorted(site['stages']))}]")
+        if site["line"]:
+            lines.append(f"               {site['line']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage memory report from the memory profile log")
+    parser.add_argument("path", nargs="?", default=MEMORY_PROFILE_PATH)
+    parser.add_argument("--top", type=int, default=15, help="Allocation sites to list")
+    args = parser.parse_args()
+    try:
+        with open(args.path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        raise SystemExit(f"No memory profile at {args.path} (run the app with MEMORY_PROFILE_ENABLED=1)")
+    print(report(records, args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Near-Duplicate Reuse
+====================
+
+Exact-match reuse (single-flight keys, report_history.latest_mockup) misses a
+business problem that comes back with other whitespace, casing or a word or
+two changed. Every stored report and mockup gets a MinHash signature of its
+normalized business problem / BRD text (character shingles), and a banded LSH
+index finds the earlier entries that may be similar without comparing
+against all of them. The best candidates are then checked exactly (Jaccard
+similarity of the shingle sets) against their stored text.
+
+Per band, the band hashes of all entries are kept in one sorted numpy array,
+so a lookup is NEAR_DUPLICATE_BANDS binary searches plus a comparison with
+the few candidates: well under a millisecond with 100k entries.
+
+The index is derived from the history database: each lookup first picks up
+entries added since the last one (by any process) and stores the signatures
+it had to compute, so a restart does not rehash the whole history.
+
+    python near_duplicates.py "retail bank wants personalised loan offers"
+"""
+
+import argparse
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import report_history
+from config import (
+    NEAR_DUPLICATE_BANDS,
+    NEAR_DUPLICATE_OFFER_THRESHOLD,
+    NEAR_DUPLICATE_PERMUTATIONS,
+    NEAR_DUPLICATE_SHINGLE,
+    REPORT_HISTORY_PATH,
+)
+from singleflight import normalize_input
+
+# History table per kind, and which of its rows may be reused (not reports stopped early)
+TABLES = {"report": ("reports", "AND t.partial IS NULL"), "mockup": ("mockups", "")}
+SEED = 20240611
+# Candidates are kept down to this far below the threshold (64-value estimates are rough) ...
+ESTIMATE_MARGIN = 0.1
+# ... and the best few of them are checked exactly
+VERIFY = 3
+MERGE_EVERY = 4096  # entries added before the sorted band arrays are rebuilt
+_BLOCK = 4096  # shingles hashed at once, so long BRDs need little temporary memory
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize(text):
+    """Lowercase words separated by single spaces: whitespace, casing and punctuation do not count"""
+    return " ".join(_WORD_RE.findall(normalize_input(text)))
+
+
+def shingles(text, size=NEAR_DUPLICATE_SHINGLE):
+    """Set of overlapping character size-grams of the normalized text"""
+    normalized = normalize(text)
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class MinHasher:
+    """MinHash signatures of shingle sets: one uint32 minimum per hash function"""
+
+    def __init__(self, permutations=NEAR_DUPLICATE_PERMUTATIONS, seed=SEED):
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing of the 32-bit shingle hashes: top half of (a * x + b) mod 2**64
+        self.a = rng.integers(1, 2 ** 63, size=permutations, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=permutations, dtype=np.uint64)
+        self.permutations = permutations
+
+    def signature(self, shingle_set):
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingle_set), dtype=np.uint64, count=len(shingle_set)
+        )
+        signature = np.full(self.permutations, np.iinfo(np.uint32).max, dtype=np.uint64)
+        for start in range(0, len(hashes), _BLOCK):
+            block = hashes[start:start + _BLOCK]
+            values = (self.a[:, None] * block[None, :] + self.b[:, None]) >> np.uint64(32)
+            np.minimum(signature, values.min(axis=1), out=signature)
+        return signature.astype(np.uint32)
+
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures, in numpy arrays rather than one list per bucket.
+
+    Entries added since the last rebuild are compared with the query directly.
+    """
+
+    def __init__(self, permutations=NEAR_DUPLICATE_PERMUTATIONS, bands=NEAR_DUPLICATE_BANDS):
+        if permutations % bands:
+            raise ValueError(f"{permutations} permutations do not split into {bands} bands")
+        self.bands = bands
+        self.rows = permutations // bands
+        self.refs = []
+        self.signatures = np.empty((0, permutations), dtype=np.uint32)
+        self._multipliers = np.random.default_rng(SEED + 1).integers(
+            1, 2 ** 63, size=self.rows, dtype=np.uint64
+        ) | np.uint64(1)
+        self._sorted_keys = np.empty((bands, 0), dtype=np.uint64)
+        self._sorted_ids = np.empty((bands, 0), dtype=np.int32)
+        self._pending_keys = np.empty((0, bands), dtype=np.uint64)
+        self._indexed = 0  # entries covered by the sorted arrays
+
+    def __len__(self):
+        return len(self.refs)
+
+    def band_keys(self, signatures):
+        """(entries, bands) array: one hash per band of each signature"""
+        values = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        return (values * self._multipliers).sum(axis=2, dtype=np.uint64)
+
+    def add_many(self, refs, signatures):
+        count = len(self.refs)
+        needed = count + len(refs)
+        if needed > len(self.signatures):
+            grown = np.empty((max(needed, 2 * len(self.signatures), 1024), self.signatures.shape[1]), dtype=np.uint32)
+            grown[:count] = self.signatures[:count]
+            self.signatures = grown
+        self.signatures[count:needed] = signatures
+        self.refs.extend(refs)
+        self._pending_keys = np.concatenate([self._pending_keys, self.band_keys(np.asarray(signatures))])
+        if len(self._pending_keys) >= MERGE_EVERY:
+            self._rebuild()
+
+    def _rebuild(self):
+        keys = self.band_keys(self.signatures[:len(self.refs)]).T
+        order = np.argsort(keys, axis=1, kind="stable")
+        self._sorted_keys = np.take_along_axis(keys, order, axis=1)
+        self._sorted_ids = order.astype(np.int32)
+        self._pending_keys = np.empty((0, self.bands), dtype=np.uint64)
+        self._indexed = len(self.refs)
+
+    def query(self, signature, threshold):
+        """[(estimated similarity, ref)] for entries sharing a band with signature, best (then newest) first"""
+        keys = self.band_keys(signature[None, :])[0]
+        found = []
+        for band in range(self.bands):
+            row = self._sorted_keys[band]
+            start = np.searchsorted(row, keys[band], "left")
+            end = np.searchsorted(row, keys[band], "right")
+            if end > start:
+                found.append(self._sorted_ids[band, start:end])
+        if len(self._pending_keys):
+            found.append(np.flatnonzero((self._pending_keys == keys).any(axis=1)) + self._indexed)
+        if not found:
+            return []
+        ids = np.unique(np.concatenate(found))
+        estimates = (self.signatures[ids] == signature).mean(axis=1)
+        keep = estimates >= threshold
+        ids, estimates = ids[keep], estimates[keep]
+        order = np.lexsort((-ids, -estimates))
+        return [(float(estimates[i]), self.refs[ids[i]]) for i in order]
+
+
+class HistoryIndex:
+    """LSH indexes of the reports and mockups in one history database, kept in step with it"""
+
+    def __init__(self, path=REPORT_HISTORY_PATH):
+        self.path = path
+        self.hasher = MinHasher()
+        self.scheme = f"minhash-{NEAR_DUPLICATE_SHINGLE}-{NEAR_DUPLICATE_PERMUTATIONS}-{SEED}"
+        self.indexes = {kind: LSHIndex() for kind in TABLES}
+        self._last_rowid = dict.fromkeys(TABLES, 0)
+        self._lock = threading.Lock()
+
+    def sync(self, kind):
+        """Index the entries added since the last sync, hashing (and storing) those without a signature"""
+        table, condition = TABLES[kind]
+        db = report_history.connect(self.path)
+        rows = db.execute(
+            f"SELECT t.rowid, t.id, s.signature, "
+            f"CASE WHEN s.signature IS NULL THEN t.business_problem END AS business_problem "
+            f"FROM {table} AS t LEFT JOIN signatures AS s ON s.kind = ? AND s.ref_id = t.id AND s.scheme = ? "
+            f"WHERE t.rowid > ? {condition} ORDER BY t.rowid",
+            (kind, self.scheme, self._last_rowid[kind]),
+        ).fetchall()
+        if not rows:
+            return
+        signatures = np.empty((len(rows), self.hasher.permutations), dtype=np.uint32)
+        computed = []
+        for position, row in enumerate(rows):
+            if row["signature"] is None:
+                signatures[position] = self.hasher.signature(shingles(row["business_problem"]))
+                computed.append((kind, row["id"], self.scheme, signatures[position].tobytes()))
+            else:
+                signatures[position] = np.frombuffer(row["signature"], dtype=np.uint32)
+        if computed:
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO signatures (kind, ref_id, scheme, signature) VALUES (?, ?, ?, ?)", computed
+                )
+        self.indexes[kind].add_many([row["id"] for row in rows], signatures)
+        self._last_rowid[kind] = rows[-1]["rowid"]
+
+    def find(self, kind, text, threshold):
+        query = shingles(text)
+        with self._lock:
+            self.sync(kind)
+            candidates = self.indexes[kind].query(self.hasher.signature(query), threshold - ESTIMATE_MARGIN)
+        best = None
+        for _, ref_id in candidates[:VERIFY]:
+            entry = report_history.describe(kind, ref_id, self.path)
+            if entry is None:
+                continue
+            entry["similarity"] = jaccard(query, shingles(entry["business_problem"]))
+            if entry["similarity"] >= threshold and (best is None or entry["similarity"] > best["similarity"]):
+                best = entry
+        return best
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def history_index(path=REPORT_HISTORY_PATH):
+    """This process's index of the history database at path (built on first use)"""
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = HistoryIndex(path)
+        return _indexes[path]
+
+
+def find(kind, text, threshold=NEAR_DUPLICATE_OFFER_THRESHOLD, path=REPORT_HISTORY_PATH):
+    """The most similar earlier report/mockup ("report"/"mockup") at or above threshold, or None.
+
+    Returns a report_history entry with an extra "similarity" (0-1).
+    """
+    return history_index(path).find(kind, text, threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find earlier reports and mockups for a near-identical business problem")
+    parser.add_argument("text", help="Business problem / BRD text")
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_OFFER_THRESHOLD)
+    parser.add_argument("--path", default=REPORT_HISTORY_PATH)
+    args = parser.parse_args()
+    index = history_index(args.path)
+    for kind in TABLES:
+        started = time.perf_counter()
+        index.sync(kind)
+        loaded = time.perf_counter() - started
+        started = time.perf_counter()
+        entry = index.find(kind, args.text, args.threshold)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{kind}: {len(index.indexes[kind])} indexed in {loaded:.2f} s, lookup {elapsed:.2f} ms")
+        if entry is not None:
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["created"]))
+            print(f"  {entry['similarity']:.0%} similar: {entry['id']}  {created}  {entry['business_problem'][:80]}")
+
+
+if __name__ == "__main__":
+    main()
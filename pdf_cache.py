@@ -0,0 +1,172 @@
+"""
+PDF Render Cache
+================
+
+Rendered report PDFs are stored under PDF_CACHE_DIR, named by a hash of the
+final HTML (CSS included), so an unchanged report is only rendered once. A
+single low-priority background worker pre-renders reports as soon as they are
+generated. A download click reuses its file; if the pre-render is still
+queued or running, the click cancels it and renders in the foreground at
+normal priority, so it neither waits behind the niced worker nor inherits the
+background job's cancellation. Rendering itself is done by the caller's render
+function (Playwright in the app), under the caller's cancellation token; a
+cancelled render leaves no file behind.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cancellation
+import telemetry
+from config import PDF_CACHE_DIR, PDF_CACHE_MAX_FILES
+from singleflight import flight
+# Final HTML per report HTML, so the bs4 post-processing also runs once per report
+_prepared = OrderedDict()
+_prepared_lock = threading.Lock()
+_PREPARED_MAX = 16
+
+
+
+def _lower_priority():
+    """Background renders (and the browser they launch) yield the CPU to interactive work"""
+    try:
+        os.nice(10)  # Per-thread on Linux; inherited by the browser process
+    except (AttributeError, OSError):
+        pass
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-prerender", initializer=_lower_priority)
+_pending = {}  # report HTML key -> (Future, CancelToken) of queued/running pre-renders
+_pending_lock = threading.Lock()
+
+
+def html_key(html):
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+def cache_path(final_html, cache_dir=PDF_CACHE_DIR):
+    return os.path.join(cache_dir, f"report_{html_key(final_html)[:24]}.pdf")
+
+
+def cached_pdf(final_html, cache_dir=PDF_CACHE_DIR):
+    """Path of the cached PDF for this final HTML, or None"""
+    path = cache_path(final_html, cache_dir)
+    return path if os.path.exists(path) else None
+
+
+def prepare(report_html, build_html):
+    """build_html(report_html) -> final HTML, memoized per report"""
+    key = html_key(report_html)
+    with _prepared_lock:
+        if key in _prepared:
+            _prepared.move_to_end(key)
+            return _prepared[key]
+    final_html = build_html(report_html)
+    with _prepared_lock:
+        _prepared[key] = final_html
+        while len(_prepared) > _PREPARED_MAX:
+            _prepared.popitem(last=False)
+    return final_html
+
+
+def _evict(cache_dir):
+    try:
+        files = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".pdf")]
+    except OSError:
+        return
+    if len(files) <= PDF_CACHE_MAX_FILES:
+        return
+    files.sort(key=os.path.getmtime)
+    for path in files[:len(files) - PDF_CACHE_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def render(final_html, render_pdf, cache_dir=PDF_CACHE_DIR):
+    """Return the PDF path for final_html, rendering it with render_pdf(html, path) if needed"""
+    with telemetry.span("pdf.render") as render_span:
+        path = cached_pdf(final_html, cache_dir)
+        if path:
+            render_span.cache_hit = True
+            os.utime(path)
+            return path
+
+        def do_render():
+            existing = cached_pdf(final_html, cache_dir)
+            if existing:
+                return existing
+            os.makedirs(cache_dir, exist_ok=True)
+            target = cache_path(final_html, cache_dir)
+            partial = f"{target}.{threading.get_ident()}.part"
+            try:
+                render_pdf(final_html, partial)
+                os.replace(partial, target)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            _evict(cache_dir)
+            return target
+
+        path, shared = flight("pdf").do(html_key(final_html), do_render)
+        render_span.cache_hit = shared
+        return path
+
+
+def render_report(report_html, build_html, render_pdf, cache_dir=PDF_CACHE_DIR):
+    """Final HTML + cached render for a report's HTML (preempting its pre-render)"""
+    final_html = prepare(report_html, build_html)
+    if cached_pdf(final_html, cache_dir) is None:
+        _preempt_prerender(html_key(report_html))
+    return render(final_html, render_pdf, cache_dir)
+
+
+def _preempt_prerender(key):
+    """Drop a queued pre-render of this report, or cancel a running one (a foreground render takes over)"""
+    with _pending_lock:
+        pending = _pending.get(key)
+        if pending is None:
+            return
+        future, token = pending
+        if future.cancel():
+            _pending.pop(key, None)
+            return
+    token.cancel("preempted by a download")
+
+
+def prerender(report_html, build_html, render_pdf, cache_dir=PDF_CACHE_DIR, token=None):
+    """Queue a background render of the report; returns a Future (shared for queued duplicates).
+
+    A render whose token (cancellation.CancelToken) is cancelled before or
+    while it runs is dropped.
+    """
+    key = html_key(report_html)
+    # Always cancellable, so a foreground render can preempt it
+    token = token or cancellation.CancelToken(name="pdf_prerender")
+    with _pending_lock:
+        if key in _pending:
+            return _pending[key][0]
+
+        def job():
+            try:
+                with cancellation.scope(token), telemetry.span("pdf.prerender"):
+                    cancellation.check()
+                    # Not render_report(): that would preempt this very job
+                    return render(prepare(report_html, build_html), render_pdf, cache_dir)
+            except cancellation.JobCancelledError as e:
+                print(f"🛑 Background PDF render stopped: {e}")
+                return None
+            except Exception as e:
+                print(f"⚠️ Background PDF render failed: {e}")
+                return None
+            finally:
+                with _pending_lock:
+                    _pending.pop(key, None)
+
+        future = _executor.submit(job)
+        _pending[key] = (future, token)
+        return future
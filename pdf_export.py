@@ -0,0 +1,31 @@
+"""
+Playwright PDF Export
+=====================
+
+Renders an HTML file to an A4 PDF with headless Chromium. The app runs it as
+a child process (python pdf_export.py input.html output.pdf) so that a
+cancelled or overdue export can be killed together with its browser.
+"""
+
+import sys
+
+from playwright.sync_api import sync_playwright
+
+
+def export_pdf(html_path, pdf_path):
+    with open(html_path, encoding="utf-8") as f:
+        html_content = f.read()
+    with sync_playwright() as p:
+        browser = p.chromium.launch()
+        try:
+            page = browser.new_page()
+            page.set_content(html_content, wait_until="load")
+            page.pdf(path=pdf_path, format="A4", print_background=True, margin={"top": "1cm", "bottom": "1cm", "left": "1cm", "right": "1cm"})
+        finally:
+            browser.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python pdf_export.py input.html output.pdf")
+    export_pdf(sys.argv[1], sys.argv[2])
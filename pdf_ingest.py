@@ -0,0 +1,200 @@
+"""
+Streaming PDF Ingest
+====================
+
+Uploaded BRD PDFs are read one page at a time on a worker thread, while the
+calling thread condenses each page as it arrives (whitespace only) and starts
+classifying the application type on the shared event loop as soon as the
+condensed text fills the classification prompt's token budget. The
+classification sees the same opening pages it would have seen after the last
+page was read, so the time to the first result depends on the first few
+pages rather than the page count.
+
+Once every page is read, page headers and footers are dropped: lines found
+at the same place among the first or last PDF_INGEST_EDGE_LINES lines of most
+pages (page numbers ignored). Repeated lines in the page bodies, such as requirement rows
+or acceptance criteria, are kept.
+
+    for state in ingest(agent.iter_pdf_pages(upload), agent.analyze_brd_content_async):
+        show(state.pages, state.total, state.app_type)
+"""
+
+import math
+import queue
+import re
+import threading
+import time
+
+import event_loop
+import telemetry
+from config import PDF_INGEST_EDGE_LINES, PDF_INGEST_EDGE_SHARE, PDF_INGEST_QUEUE_PAGES, PROMPT_TOKEN_BUDGETS
+from prompt_builder import estimate_tokens
+
+_DONE = object()
+
+
+class IngestState:
+    """Progress of one ingest; updated in place and yielded after every change"""
+
+    def __init__(self):
+        self.pages = 0
+        self.total = None
+        self.app_type = None
+        self.classified_at_page = None
+        self.first_result_s = None
+        self.done = False
+        self.parts = []
+        self.page_lines = []  # (page number, condensed lines) of every page read
+        self.started = time.perf_counter()
+
+    @property
+    def text(self):
+        """Condensed BRD text of the pages read so far"""
+        return "\n\n".join(self.parts)
+
+
+def page_lines(text):
+    """Lines of a page with whitespace collapsed and runs of blank lines merged"""
+    lines = []
+    for line in (text or "").splitlines():
+        line = re.sub(r"[ \t]+", " ", line).strip()
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _edge_key(line):
+    """Page numbers and dates differ from page to page"""
+    return re.sub(r"\d+", "#", line.lower())
+
+
+def _edges(lines, edge_lines):
+    """{line index: (position from the top or bottom, key)} for the first and last edge_lines non-empty lines"""
+    filled = [i for i, line in enumerate(lines) if line]
+    edges = {}
+    for position, i in enumerate(reversed(filled[-edge_lines:])):
+        edges[i] = (-1 - position, _edge_key(lines[i]))
+    for position, i in enumerate(filled[:edge_lines]):
+        edges[i] = (position, _edge_key(lines[i]))
+    return edges
+
+
+def page_furniture(pages, edge_lines=PDF_INGEST_EDGE_LINES, share=PDF_INGEST_EDGE_SHARE):
+    """(position, key) of the lines found at the same place at the top or bottom of most pages"""
+    counts = {}
+    for lines in pages:
+        for edge in set(_edges(lines, edge_lines).values()):
+            counts[edge] = counts.get(edge, 0) + 1
+    needed = max(2, math.ceil(share * len(pages)))
+    return {edge for edge, count in counts.items() if count >= needed}
+
+
+def strip_furniture(lines, furniture, edge_lines=PDF_INGEST_EDGE_LINES):
+    """Page lines without the header/footer runs at its top and bottom"""
+    edges = _edges(lines, edge_lines)
+    drop = set()
+    for run in (sorted(i for i, (position, _) in edges.items() if position >= 0),
+                sorted((i for i, (position, _) in edges.items() if position < 0), reverse=True)):
+        for i in run:
+            if edges[i] not in furniture:
+                break  # Only the outermost lines: the body below a header is kept
+            drop.add(i)
+    return page_lines("\n".join(line for i, line in enumerate(lines) if i not in drop))
+
+
+def _read_pages(pages, out, stop):
+    """Worker: move pages into the queue until they run out or the reader goes away"""
+    try:
+        for page in pages:
+            while not stop.is_set():
+                try:
+                    out.put(page, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+        out.put(_DONE)
+    except Exception as e:  # Handed to the reading thread
+        out.put(e)
+    finally:
+        close = getattr(pages, "close", None)
+        if close is not None:
+            close()
+
+
+def ingest(pages, classify, format_page=None, classify_tokens=None):
+    """Condense pages as they are extracted and classify early; yields an IngestState after each change.
+
+    pages yields (page number, page count, text); classify(text) is a
+    coroutine returning the app type; format_page(number, text) adds the page
+    marker used in the BRD text. Closing the generator early stops both the
+    extraction and the classification.
+    """
+    classify_tokens = classify_tokens or PROMPT_TOKEN_BUDGETS.get("classify", 800)
+    format_page = format_page or (lambda number, text: text)
+    state = IngestState()
+    condensed_tokens = 0
+    classification = None
+    stop = threading.Event()
+    pending = queue.Queue(maxsize=PDF_INGEST_QUEUE_PAGES)
+    worker = threading.Thread(target=_read_pages, args=(pages, pending, stop), name="pdf-ingest", daemon=True)
+    with telemetry.span("pdf.ingest") as ingest_span:
+        worker.start()
+        try:
+            while True:
+                try:
+                    item = pending.get(timeout=0.05)
+                except queue.Empty:
+                    item = None
+                if isinstance(item, Exception):
+                    raise item
+                if item is _DONE:
+                    break
+                if item is not None:
+                    number, state.total, page_text = item
+                    lines = page_lines(page_text)
+                    state.page_lines.append((number, lines))
+                    part = format_page(number, "\n".join(lines))
+                    state.parts.append(part)
+                    state.pages += 1
+                    condensed_tokens += estimate_tokens(part)
+                if classification is None and condensed_tokens >= classify_tokens:
+                    classification = event_loop.submit(classify(state.text))
+                    state.classified_at_page = state.pages
+                if _collect(state, classification) or item is not None:
+                    yield state
+            if classification is None:
+                # Short document: classify all of it
+                classification = event_loop.submit(classify(state.text))
+                state.classified_at_page = state.pages
+            furniture = page_furniture([lines for _, lines in state.page_lines])
+            if furniture:
+                state.parts = [
+                    format_page(number, "\n".join(strip_furniture(lines, furniture)))
+                    for number, lines in state.page_lines
+                ]
+            classification.result()
+            _collect(state, classification)
+            state.done = True
+            ingest_span.set(
+                pages=state.pages, chars=len(state.text), classified_at_page=state.classified_at_page,
+                furniture_lines=len(furniture),
+                first_result_s=state.first_result_s,
+            )
+            yield state
+        finally:
+            stop.set()
+            if classification is not None and not state.done:
+                classification.cancel()
+
+
+def _collect(state, classification):
+    """Take the classification result once it is ready; True if the state changed"""
+    if state.app_type is not None or classification is None or not classification.done():
+        return False
+    state.app_type = classification.result()
+    state.first_result_s = time.perf_counter() - state.started
+    return True
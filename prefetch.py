@@ -0,0 +1,160 @@
+"""
+Speculative Mockup Prefetch
+===========================
+
+Once a report completes, the mockup pipeline for the same business problem
+can be started in the background at "speculative" scheduler priority. If the
+user clicks "Generate Mockup" for that problem, the finished (or still
+running, then promoted to interactive) result is handed over instead of
+starting cold. A prefetch is cancelled when the session's input changes, a
+newer prefetch replaces it or its cancellation token is cancelled (deadline,
+session end); its in-flight model call is abandoned at once.
+
+Hits, misses, cancellations and the latency saved by hand-overs are counted
+in `prefetcher.stats()` and recorded as "mockup.handover" telemetry spans.
+"""
+
+import threading
+import time
+
+import cancellation
+import telemetry
+from config import JOB_DEADLINES
+from scheduler import request_context
+
+
+class _Prefetch:
+    def __init__(self, key, token):
+        self.key = key
+        self.token = token
+        self.done = threading.Event()
+        self.context = None  # request_context values, shared with the worker thread
+        self.result = None
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+
+
+class MockupPrefetcher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.saved_seconds = 0.0
+
+    def start(self, session_id, key, run, token=None, on_done=None):
+        """Prefetch run(should_cancel) for this session unless the same key is already prefetched.
+
+        token (a cancellation.CancelToken) defaults to one with the mockup job
+        deadline. on_done() is called once the prefetch started here has
+        stopped, however it ended.
+        """
+        with self._lock:
+            current = self._sessions.get(session_id)
+            if current is not None and current.key == key and not current.token.cancelled:
+                return current  # Its own on_done still runs
+            if current is not None:
+                self._count_cancel(current)
+            if token is None:
+                token = cancellation.CancelToken(time.monotonic() + JOB_DEADLINES["mockup"], name="mockup prefetch")
+            entry = self._sessions[session_id] = _Prefetch(key, token)
+            self.started += 1
+        if current is not None:
+            current.token.cancel("prefetch superseded")
+        # Cancelled from outside (deadline, session end): forget the entry too
+        token.on_cancel(lambda: self._discard(session_id, entry))
+        thread = threading.Thread(
+            target=self._run, args=(session_id, entry, run, on_done), name="mockup-prefetch", daemon=True
+        )
+        thread.start()
+        return entry
+
+    def _run(self, session_id, entry, run, on_done=None):
+        with request_context(session_id=session_id, priority="speculative") as context, cancellation.scope(entry.token):
+            entry.context = context
+            with telemetry.span("mockup.prefetch") as prefetch_span:
+                try:
+                    entry.result = run(lambda: entry.token.cancelled)
+                except Exception as e:
+                    entry.error = e
+                    print(f"⚠️ Speculative mockup failed: {e}")
+                finally:
+                    entry.finished = time.monotonic()
+                    entry.token.close()
+                    prefetch_span.set(cancelled=entry.token.cancelled)
+                    entry.done.set()
+                    if on_done is not None:
+                        on_done()
+
+    def _count_cancel(self, entry):
+        """Count an entry about to be cancelled (caller holds the lock; cancel it after releasing)"""
+        if not entry.token.cancelled and not entry.done.is_set():
+            self.cancelled += 1
+
+    def _discard(self, session_id, entry):
+        with self._lock:
+            if self._sessions.get(session_id) is entry:
+                del self._sessions[session_id]
+                if not entry.done.is_set():
+                    self.cancelled += 1
+
+    def cancel_unless(self, session_id, key):
+        """Cancel the session's prefetch if it was started for a different input"""
+        with self._lock:
+            current = self._sessions.get(session_id)
+            if current is None or current.key == key:
+                return
+            self._count_cancel(current)
+            del self._sessions[session_id]
+        current.token.cancel("input changed")
+
+    def take(self, session_id, key, timeout=None):
+        """Hand over the prefetched result for key (waiting if still running), or None on a miss"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            usable = entry is not None and entry.key == key and not entry.token.cancelled
+            if usable:
+                del self._sessions[session_id]
+        with telemetry.span("mockup.handover") as handover_span:
+            if not usable:
+                with self._lock:
+                    self.misses += 1
+                handover_span.cache_hit = False
+                return None
+            clicked = time.monotonic()
+            if not entry.done.is_set() and entry.context is not None:
+                # The user is waiting now: remaining steps run at interactive priority
+                entry.context["priority"] = "interactive"
+            entry.done.wait(timeout)
+            if not entry.done.is_set() or entry.error is not None or not entry.result or entry.result.get("cancelled"):
+                with self._lock:
+                    self.misses += 1
+                handover_span.cache_hit = False
+                return None
+            # Work already done when the user clicked is latency the user did not wait for
+            saved = min(entry.finished, clicked) - entry.started
+            with self._lock:
+                self.hits += 1
+                self.saved_seconds += saved
+            handover_span.cache_hit = True
+            handover_span.set(saved_ms=round(saved * 1000, 1))
+            return entry.result
+
+    def stats(self):
+        with self._lock:
+            taken = self.hits + self.misses
+            return {
+                "started": self.started,
+                "hits": self.hits,
+                "misses": self.misses,
+                "cancelled": self.cancelled,
+                "hit_rate": self.hits / taken if taken else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+# Shared by every session in the process
+prefetcher = MockupPrefetcher()
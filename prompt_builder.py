@@ -0,0 +1,165 @@
+"""
+Token-Budget Prompt Builder
+===========================
+
+Builds prompts from `str.format` templates with a per-task input token
+budget (PROMPT_TOKEN_BUDGETS in config.py). The static text of each template
+is split and counted once and cached; variable inputs (business problem,
+BRD text, related sections) are counted per call and, when the prompt would
+exceed the budget, condensed (whitespace, repeated lines) and then trimmed,
+lowest-priority field first, keeping the beginning and end of each text.
+
+Every build is recorded as a "prompt.build" telemetry span with the token
+counts, so input size can be compared with the llm.generate latency of the
+same trace.
+"""
+
+import re
+import string
+import threading
+from functools import lru_cache
+
+import telemetry
+from config import PROMPT_TOKEN_BUDGETS, PROMPT_TOKEN_COUNTER
+
+TRIM_MARKER = "\n[... {tokens} tokens omitted ...]\n"
+# Share of a trimmed text kept from its beginning (the rest comes from the end)
+TRIM_HEAD_RATIO = 0.75
+
+_chars_per_token = 4.0
+_static_counts = {}
+_static_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Token count from the calibrated characters-per-token ratio"""
+    return max(0, int(round(len(text) / _chars_per_token))) if text else 0
+
+
+def _model_count(task, text):
+    """Exact count from the task's model tokenizer (one API call, cached by caller)"""
+    import routing
+
+    model = routing.get_model(routing.route_for(task)["model"])
+    return model.count_tokens(text).total_tokens
+
+
+def static_tokens(task, text):
+    """Token count for static template text, cached per text.
+
+    With PROMPT_TOKEN_COUNTER="model" the first count of each static text uses
+    the model's tokenizer and recalibrates the ratio used for variable parts.
+    """
+    global _chars_per_token
+    with _static_lock:
+        if text in _static_counts:
+            return _static_counts[text]
+    count = estimate_tokens(text)
+    if PROMPT_TOKEN_COUNTER == "model" and len(text) > 200:
+        try:
+            count = _model_count(task, text)
+            if count:
+                _chars_per_token = len(text) / count
+        except Exception as e:
+            print(f"⚠️ Token count failed, using estimate: {e}")
+    with _static_lock:
+        _static_counts[text] = count
+    return count
+
+
+@lru_cache(maxsize=64)
+def _parse_template(template):
+    """Static text and field names of a template, parsed once"""
+    static, fields = [], []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        static.append(literal)
+        if field is not None:
+            if spec or conversion or not field.isidentifier():
+                raise ValueError(f"Prompt templates only support plain fields, got {{{field}}}")
+            fields.append(field)
+    return "".join(static), tuple(dict.fromkeys(fields))
+
+
+def condense(text):
+    """Cheap lossless-ish shrinking: collapse whitespace and drop repeated lines"""
+    seen = set()
+    lines = []
+    for line in text.splitlines():
+        line = re.sub(r"[ \t]+", " ", line).strip()
+        key = line.lower()
+        if not line:
+            if lines and lines[-1] == "":
+                continue
+        elif key in seen and len(key) > 20:
+            continue
+        seen.add(key)
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def trim_to_tokens(text, tokens):
+    """Keep the beginning and end of text within about `tokens` tokens, cut at sentence/line breaks"""
+    total = estimate_tokens(text)
+    if total <= tokens:
+        return text
+    if tokens <= 0:
+        return ""
+    keep_chars = int(tokens * _chars_per_token)
+    head_chars = int(keep_chars * TRIM_HEAD_RATIO)
+    tail_chars = keep_chars - head_chars
+    head = text[:head_chars]
+    cut = max(head.rfind(". "), head.rfind("\n"))
+    if cut > head_chars // 2:
+        head = head[:cut + 1]
+    tail = text[len(text) - tail_chars:] if tail_chars else ""
+    start = min((i for i in (tail.find(". "), tail.find("\n")) if i >= 0), default=-1)
+    if 0 <= start < len(tail) // 2:
+        tail = tail[start + 1:]
+    omitted = total - estimate_tokens(head) - estimate_tokens(tail)
+    return head.rstrip() + TRIM_MARKER.format(tokens=omitted) + tail.lstrip()
+
+
+def fit_fields(fields, available, priorities=None):
+    """Condense, then trim, the variable fields until they fit `available` tokens.
+
+    Fields with a lower priority (default 0) are trimmed first; within a
+    priority the largest field is trimmed first. Returns (fields, trimmed_tokens).
+    """
+    priorities = priorities or {}
+    fitted = {name: str(value) for name, value in fields.items()}
+    counts = {name: estimate_tokens(value) for name, value in fitted.items()}
+    before = sum(counts.values())
+    if before <= available:
+        return fitted, 0
+    for name in fitted:
+        fitted[name] = condense(fitted[name])
+        counts[name] = estimate_tokens(fitted[name])
+    order = sorted(fitted, key=lambda name: (priorities.get(name, 0), -counts[name]))
+    for name in order:
+        excess = sum(counts.values()) - available
+        if excess <= 0:
+            break
+        fitted[name] = trim_to_tokens(fitted[name], max(0, counts[name] - excess))
+        counts[name] = estimate_tokens(fitted[name])
+    return fitted, max(0, before - sum(counts.values()))
+
+
+def build_prompt(task, template, priorities=None, budget=None, **fields):
+    """Format `template` with `fields`, fitting the result into the task's token budget"""
+    static, names = _parse_template(template)
+    missing = [name for name in names if name not in fields]
+    if missing:
+        raise KeyError(f"Missing prompt fields: {', '.join(missing)}")
+    budget = budget or PROMPT_TOKEN_BUDGETS.get(task)
+    with telemetry.span("prompt.build", task=task) as build_span:
+        fixed = static_tokens(task, static)
+        values = {name: fields[name] for name in names}
+        trimmed = 0
+        if budget:
+            values, trimmed = fit_fields(values, max(0, budget - fixed), priorities)
+        prompt = template.format(**values)
+        tokens = fixed + sum(estimate_tokens(str(value)) for value in values.values())
+        build_span.set(estimated_tokens=tokens, static_tokens=fixed, budget=budget, trimmed_tokens=trimmed)
+        if trimmed:
+            print(f"✂️ {task} prompt trimmed by ~{trimmed} tokens to fit its {budget}-token budget")
+        return prompt
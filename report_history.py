@@ -0,0 +1,372 @@
+"""
+Report History
+==============
+
+Every generated report (with its diagram images) and mockup is kept in a
+local SQLite database, REPORT_HISTORY_PATH, with an FTS5 full-text index
+over the business problems, the report sections and the mockup schemas.
+Analysts can search it from the sidebar and reopen a past report or mockup
+without any model calls. Diagram PNGs are stored once per content-hashed
+file name and written back to the output directory when a report is
+reopened. Each mockup records the version it was derived from (see
+Mockup_design/incremental_mockup.py), so the mockups of an edited BRD form a
+chain of versions.
+
+    python report_history.py "loan personalisation"     # search from the terminal
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import REPORT_HISTORY_PATH, REPORT_HISTORY_RESULTS
+from report_model import parse_report
+from singleflight import make_key
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id TEXT PRIMARY KEY,
+    problem_key TEXT NOT NULL,
+    created REAL NOT NULL,
+    business_problem TEXT NOT NULL,
+    report TEXT NOT NULL,
+    partial TEXT
+);
+CREATE INDEX IF NOT EXISTS reports_by_problem ON reports (problem_key, created);
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    png BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS report_images (
+    report_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (report_id, position)
+);
+CREATE TABLE IF NOT EXISTS mockups (
+    id TEXT PRIMARY KEY,
+    problem_key TEXT NOT NULL,
+    created REAL NOT NULL,
+    business_problem TEXT NOT NULL,
+    app_type TEXT,
+    schema TEXT,
+    html TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mockups_by_problem ON mockups (problem_key, created);
+-- Version chains: lineage is the id of the chain's first mockup
+CREATE TABLE IF NOT EXISTS mockup_versions (
+    mockup_id TEXT PRIMARY KEY,
+    lineage TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    previous_id TEXT
+);
+CREATE INDEX IF NOT EXISTS mockup_versions_by_lineage ON mockup_versions (lineage, version);
+-- MinHash signatures of the business problems (see near_duplicates.py)
+CREATE TABLE IF NOT EXISTS signatures (
+    kind TEXT NOT NULL,
+    ref_id TEXT NOT NULL,
+    scheme TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    PRIMARY KEY (kind, ref_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5 (
+    kind UNINDEXED, ref_id UNINDEXED, title, body, tokenize = 'porter unicode61'
+);
+"""
+# bm25 column weights (kind, ref_id, title, body): matches in section titles count more
+RANK = "bm25(search, 0.0, 0.0, 4.0, 1.0)"
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+_local = threading.local()
+
+
+def connect(path=REPORT_HISTORY_PATH):
+    """This thread's connection to the history database (created on first use)"""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if path not in connections:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(path, timeout=10)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(SCHEMA)
+        connections[path] = db
+    return connections[path]
+
+
+def _new_id():
+    return uuid.uuid4().hex[:12]
+
+
+def save_report(business_problem, report, image_paths, partial=None, path=REPORT_HISTORY_PATH):
+    """Keep a generated report and its diagrams; returns its id.
+
+    Reports without any "## " section (error messages) are not kept; returns None.
+    """
+    document = parse_report(report)
+    sections = document.sections(level=2)
+    if not sections:
+        return None
+    report_id = _new_id()
+    db = connect(path)
+    with db:
+        db.execute(
+            "INSERT INTO reports (id, problem_key, created, business_problem, report, partial) VALUES (?, ?, ?, ?, ?, ?)",
+            (report_id, make_key(business_problem), time.time(), business_problem, report, partial),
+        )
+        for position, image_path in enumerate(image_paths):
+            name = os.path.basename(image_path)
+            if db.execute("SELECT 1 FROM images WHERE name = ?", (name,)).fetchone() is None:
+                with open(image_path, "rb") as f:
+                    db.execute("INSERT INTO images (name, png) VALUES (?, ?)", (name, f.read()))
+            db.execute(
+                "INSERT INTO report_images (report_id, position, name) VALUES (?, ?, ?)", (report_id, position, name)
+            )
+        rows = [("report", report_id, "Business problem", business_problem)]
+        rows += [("report", report_id, section.title, _section_text(document, section)) for section in sections]
+        db.executemany("INSERT INTO search (kind, ref_id, title, body) VALUES (?, ?, ?, ?)", rows)
+    return report_id
+
+
+def _section_text(document, section):
+    """Section body without its Mermaid code, which would only add noise to matches and snippets"""
+    parts = []
+    position = section.heading.end
+    for block in document.mermaid_blocks:
+        if position <= block.start < section.end:
+            parts.append(document.slice(position, block.start))
+            position = block.end
+    parts.append(document.slice(position, section.end))
+    return "".join(parts)
+
+
+def save_mockup(business_problem, app_type, schema, html, previous_id=None, path=REPORT_HISTORY_PATH):
+    """Keep a generated mockup, as the next version of previous_id if given; returns its id"""
+    mockup_id = _new_id()
+    db = connect(path)
+    with db:
+        lineage, version = mockup_id, 1
+        if previous_id:
+            row = db.execute("SELECT lineage, version FROM mockup_versions WHERE mockup_id = ?", (previous_id,)).fetchone()
+            lineage, version = (row["lineage"], row["version"] + 1) if row is not None else (previous_id, 2)
+        db.execute(
+            "INSERT INTO mockup_versions (mockup_id, lineage, version, previous_id) VALUES (?, ?, ?, ?)",
+            (mockup_id, lineage, version, previous_id),
+        )
+        db.execute(
+            "INSERT INTO mockups (id, problem_key, created, business_problem, app_type, schema, html) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (mockup_id, make_key(business_problem), time.time(), business_problem, app_type, json.dumps(schema), html),
+        )
+        db.execute(
+            "INSERT INTO search (kind, ref_id, title, body) VALUES (?, ?, ?, ?)",
+            ("mockup", mockup_id, f"{app_type} mockup", business_problem + "\n" + " ".join(_strings(schema))),
+        )
+    return mockup_id
+
+
+def _strings(value):
+    """All string values in a JSON-like schema (component names, labels, ...)"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _strings(item)
+
+
+def match_query(text, any_word=False):
+    """FTS5 query for free text: every (or any) word must match, the last one also as a prefix.
+
+    The last word is matched whole as well, because prefixes are compared with
+    the stemmed index ("onboarding*" does not match the stored "onboard").
+    """
+    words = _WORD_RE.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]]
+    terms.append(f'("{words[-1]}" OR "{words[-1]}" *)')
+    return (" OR " if any_word else " AND ").join(terms)
+
+
+def search(text, limit=REPORT_HISTORY_RESULTS, path=REPORT_HISTORY_PATH):
+    """Best-matching reports and mockups, one entry each, with a snippet of the best matching section"""
+    query = match_query(text)
+    if query is None:
+        return recent(limit, path)
+    db = connect(path)
+    sql = (
+        f"SELECT kind, ref_id, title, snippet(search, 3, '**', '**', '…', 16) AS snippet, {RANK} AS rank "
+        f"FROM search WHERE search MATCH ? ORDER BY rank LIMIT ?"
+    )
+    rows = db.execute(sql, (query, limit * 10)).fetchall()
+    if not rows:
+        # Words spread over several sections: rank sections matching any of them
+        rows = db.execute(sql, (match_query(text, any_word=True), limit * 10)).fetchall()
+    best = {}
+    for row in rows:
+        best.setdefault((row["kind"], row["ref_id"]), row)
+    entries = []
+    for (kind, ref_id), row in list(best.items())[:limit]:
+        entry = _describe(db, kind, ref_id)
+        if entry is not None:
+            entry["section"] = row["title"]
+            entry["snippet"] = " ".join(row["snippet"].split())
+            entries.append(entry)
+    return entries
+
+
+def recent(limit=REPORT_HISTORY_RESULTS, path=REPORT_HISTORY_PATH):
+    """Most recent reports and mockups, newest first"""
+    db = connect(path)
+    rows = db.execute(
+        "SELECT 'report' AS kind, id, created FROM reports "
+        "UNION ALL SELECT 'mockup' AS kind, id, created FROM mockups "
+        "ORDER BY created DESC LIMIT ?",
+        (limit,),
+    ).fetchall()
+    return [entry for entry in (_describe(db, row["kind"], row["id"]) for row in rows) if entry is not None]
+
+
+def describe(kind, ref_id, path=REPORT_HISTORY_PATH):
+    """Search-result entry for one stored report or mockup (None if unknown)"""
+    return _describe(connect(path), kind, ref_id)
+
+
+def _describe(db, kind, ref_id):
+    if kind == "report":
+        row = db.execute("SELECT id, created, business_problem, partial FROM reports WHERE id = ?", (ref_id,)).fetchone()
+        title = "Report"
+    else:
+        row = db.execute("SELECT id, created, business_problem, app_type FROM mockups WHERE id = ?", (ref_id,)).fetchone()
+        title = f"{row['app_type'] or 'App'} mockup" if row is not None else ""
+    if row is None:
+        return None
+    return {
+        "kind": kind,
+        "id": row["id"],
+        "title": title,
+        "created": row["created"],
+        "business_problem": row["business_problem"],
+        "section": None,
+        "snippet": None,
+    }
+
+
+def load_report(report_id, output_dir, path=REPORT_HISTORY_PATH):
+    """A stored report with its diagram images written back to output_dir (None if unknown)"""
+    db = connect(path)
+    row = db.execute("SELECT * FROM reports WHERE id = ?", (report_id,)).fetchone()
+    if row is None:
+        return None
+    os.makedirs(output_dir, exist_ok=True)
+    image_paths = []
+    images = db.execute(
+        "SELECT report_images.name, images.png FROM report_images JOIN images ON images.name = report_images.name "
+        "WHERE report_id = ? ORDER BY position",
+        (report_id,),
+    ).fetchall()
+    for image in images:
+        image_path = os.path.join(output_dir, image["name"])
+        if not os.path.exists(image_path):
+            with open(image_path, "wb") as f:
+                f.write(image["png"])
+        image_paths.append(image_path)
+    return {
+        "id": row["id"],
+        "created": row["created"],
+        "business_problem": row["business_problem"],
+        "report": row["report"],
+        "images": image_paths,
+        "partial": row["partial"],
+    }
+
+
+_MOCKUP_QUERY = (
+    "SELECT mockups.*, lineage, version, previous_id FROM mockups "
+    "LEFT JOIN mockup_versions ON mockup_versions.mockup_id = mockups.id "
+)
+
+
+def load_mockup(mockup_id, path=REPORT_HISTORY_PATH):
+    row = connect(path).execute(_MOCKUP_QUERY + "WHERE id = ?", (mockup_id,)).fetchone()
+    return _mockup(row)
+
+
+def latest_mockup(business_problem, path=REPORT_HISTORY_PATH):
+    """The newest mockup generated for this business problem, or None"""
+    row = connect(path).execute(
+        _MOCKUP_QUERY + "WHERE problem_key = ? ORDER BY created DESC LIMIT 1", (make_key(business_problem),)
+    ).fetchone()
+    return _mockup(row)
+
+
+def mockup_versions(mockup_id, path=REPORT_HISTORY_PATH):
+    """Every version in the chain of this mockup, oldest first (id, version, created, previous_id)"""
+    db = connect(path)
+    row = db.execute("SELECT lineage FROM mockup_versions WHERE mockup_id = ?", (mockup_id,)).fetchone()
+    if row is None:
+        return [{"id": mockup_id, "version": 1, "created": None, "previous_id": None}]
+    rows = db.execute(
+        "SELECT mockup_id, version, created, previous_id FROM mockup_versions "
+        "JOIN mockups ON mockups.id = mockup_versions.mockup_id WHERE lineage = ? ORDER BY version, created",
+        (row["lineage"],),
+    ).fetchall()
+    return [
+        {"id": row["mockup_id"], "version": row["version"], "created": row["created"], "previous_id": row["previous_id"]}
+        for row in rows
+    ]
+
+
+def latest_report_id(business_problem, path=REPORT_HISTORY_PATH):
+    """Id of the newest report for this business problem, or None"""
+    row = connect(path).execute(
+        "SELECT id FROM reports WHERE problem_key = ? ORDER BY created DESC LIMIT 1", (make_key(business_problem),)
+    ).fetchone()
+    return row["id"] if row is not None else None
+
+
+def _mockup(row):
+    if row is None:
+        return None
+    return {
+        "id": row["id"],
+        "created": row["created"],
+        "business_problem": row["business_problem"],
+        "app_type": row["app_type"],
+        "schema": json.loads(row["schema"]) if row["schema"] else None,
+        "html": row["html"],
+        # Mockups saved before versioning are the first version of their own chain
+        "lineage": row["lineage"] or row["id"],
+        "version": row["version"] or 1,
+        "previous_id": row["previous_id"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the report history")
+    parser.add_argument("query", nargs="?", default="", help="Words to search for (empty: most recent)")
+    parser.add_argument("--limit", type=int, default=REPORT_HISTORY_RESULTS)
+    parser.add_argument("--path", default=REPORT_HISTORY_PATH)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    entries = search(args.query, args.limit, args.path)
+    elapsed = (time.perf_counter() - started) * 1000
+    for entry in entries:
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["created"]))
+        print(f"{entry['kind']:<6} {entry['id']}  {created}  {entry['business_problem'][:80]}")
+        if entry["snippet"]:
+            print(f"       {entry['section']}: {entry['snippet']}")
+    print(f"{len(entries)} result(s) in {elapsed:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
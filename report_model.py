@@ -0,0 +1,278 @@
+"""
+Parsed Report Model
+===================
+
+Parses the Markdown report once, in a single line-by-line pass, into typed
+nodes (headings, use cases, Mermaid blocks, tables and plain text) with their
+character offsets and a heading-based section tree. Stages that used to
+rescan the whole string with their own regexes (use-case extraction,
+use-case diagram insertion, Mermaid extraction, image embedding, section
+splitting) work on this model instead, and edits are applied with one linear
+splice.
+"""
+
+import re
+
+# As in Markdown, the hashes must be followed by whitespace: "#1 priority" and "#hashtag" are text
+_HEADING_RE = re.compile(r"^(#{1,6})(?:\s+|$)(.*?)\s*$")
+# Use cases and their fields may be written as list items ("* **Use Case 1:**", "1. **Actors:**")
+_LIST_MARKER = r"(?:(?:[*+-]|\d+[.)])\s+)?"
+_USE_CASE_RE = re.compile(rf"^{_LIST_MARKER}\*\*Use Case (\d+):\*\*\s*(.*)$")
+_FIELD_RE = re.compile(rf"^{_LIST_MARKER}\*\*(Actors|Preconditions|Main Flow):\*\*\s*(.*)$")
+
+
+class Node:
+    kind = "text"
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+
+class Text(Node):
+    kind = "text"
+
+
+class Heading(Node):
+    kind = "heading"
+
+    def __init__(self, start, end, level, title):
+        super().__init__(start, end)
+        self.level = level
+        self.title = title
+
+
+class MermaidBlock(Node):
+    kind = "mermaid"
+
+    def __init__(self, start, end, code):
+        super().__init__(start, end)
+        self.code = code
+
+
+class Table(Node):
+    kind = "table"
+
+    def __init__(self, start, end, rows):
+        super().__init__(start, end)
+        self.rows = rows
+
+    @property
+    def header(self):
+        return self.rows[0] if self.rows else []
+
+
+class UseCase(Node):
+    """A '**Use Case N:**' block. `end` is the end of its Main Flow paragraph."""
+
+    kind = "use_case"
+
+    def __init__(self, start, end, idx, title, actors, preconditions, main_flow):
+        super().__init__(start, end)
+        self.idx = idx
+        self.title = title
+        self.actors = actors
+        self.preconditions = preconditions
+        self.main_flow = main_flow
+        self.diagram = None  # MermaidBlock directly following the use case, if any
+
+    def to_dict(self):
+        return {"idx": self.idx, "title": self.title, "actors": self.actors, "main_flow": self.main_flow}
+
+
+class Section:
+    """A heading and everything up to the next heading of the same or higher level"""
+
+    def __init__(self, heading, start):
+        self.heading = heading
+        self.start = start
+        self.end = start
+        self.nodes = []
+        self.children = []
+
+    @property
+    def title(self):
+        return self.heading.title if self.heading else ""
+
+    @property
+    def level(self):
+        return self.heading.level if self.heading else 0
+
+
+class ReportDocument:
+    def __init__(self, text, nodes):
+        self.text = text
+        self.nodes = nodes
+        self.headings = [n for n in nodes if n.kind == "heading"]
+        self.use_cases = [n for n in nodes if n.kind == "use_case"]
+        self.mermaid_blocks = [n for n in nodes if n.kind == "mermaid"]
+        self.tables = [n for n in nodes if n.kind == "table"]
+        self.root = self._build_tree()
+
+    def _build_tree(self):
+        root = Section(None, 0)
+        root.end = len(self.text)
+        stack = [root]
+        for node in self.nodes:
+            if node.kind == "heading":
+                while len(stack) > 1 and stack[-1].level >= node.level:
+                    stack.pop().end = node.start
+                section = Section(node, node.start)
+                stack[-1].children.append(section)
+                stack.append(section)
+            else:
+                stack[-1].nodes.append(node)
+        for section in stack[1:]:
+            section.end = len(self.text)
+        return root
+
+    def sections(self, level=2):
+        """All sections with headings of the given level, in document order"""
+        found = []
+
+        def walk(section):
+            for child in section.children:
+                if child.level == level:
+                    found.append(child)
+                elif child.level < level:
+                    walk(child)
+
+        walk(self.root)
+        return found
+
+    def slice(self, start, end):
+        return self.text[start:end]
+
+    def splice(self, edits):
+        """Apply non-overlapping (start, end, replacement) edits in one pass"""
+        parts = []
+        position = 0
+        for start, end, replacement in sorted(edits, key=lambda edit: (edit[0], edit[1])):
+            if start < position:
+                raise ValueError("Overlapping report edits")
+            parts.append(self.text[position:start])
+            parts.append(replacement)
+            position = end
+        parts.append(self.text[position:])
+        return "".join(parts)
+
+
+def parse_report(text):
+    """Parse Markdown report text into a ReportDocument (single pass)"""
+    nodes = []
+    lines = text.splitlines(keepends=True)
+    offsets = []
+    position = 0
+    for line in lines:
+        offsets.append(position)
+        position += len(line)
+    offsets.append(position)
+
+    def line_end(i):
+        """Offset of the end of line i, excluding its newline"""
+        return offsets[i] + len(lines[i].rstrip("\r\n"))
+
+    i = 0
+    count = len(lines)
+    while i < count:
+        raw = lines[i]
+        stripped = raw.strip()
+        start = offsets[i]
+
+        if stripped.startswith("```mermaid"):
+            # Fence runs until a line starting with ``` or ending with ```
+            fence_start = offsets[i] + raw.index("```mermaid")
+            code_lines = []
+            j = i + 1
+            end = None
+            while j < count:
+                candidate = lines[j]
+                if candidate.strip().startswith("```"):
+                    end = offsets[j] + candidate.index("```") + 3
+                    break
+                if candidate.rstrip().endswith("```"):
+                    code_lines.append(candidate.rstrip()[:-3])
+                    end = offsets[j] + len(candidate.rstrip())
+                    break
+                code_lines.append(candidate)
+                j += 1
+            if end is None:
+                nodes.append(Text(start, offsets[count]))
+                break
+            nodes.append(MermaidBlock(fence_start, end, "".join(code_lines)))
+            i = j + 1
+            continue
+
+        if stripped.startswith("```"):
+            # Other fenced code is opaque text (a '# comment' inside is not a heading)
+            j = i + 1
+            while j < count and not lines[j].strip().startswith("```"):
+                j += 1
+            last = min(j, count - 1)
+            nodes.append(Text(start, line_end(last)))
+            i = last + 1
+            continue
+
+        heading = _HEADING_RE.match(stripped)
+        if heading and not raw.startswith("    "):
+            nodes.append(Heading(start, line_end(i), len(heading.group(1)), heading.group(2)))
+            i += 1
+            continue
+
+        use_case = _USE_CASE_RE.match(stripped)
+        if use_case:
+            fields = {"Actors": None, "Preconditions": None, "Main Flow": None}
+            j = i + 1
+            current = None
+            flow_lines = []
+            last = i
+            while j < count:
+                candidate = lines[j].strip()
+                field = _FIELD_RE.match(candidate)
+                if field and fields.get(field.group(1)) is None and current != "done":
+                    current = field.group(1)
+                    fields[current] = field.group(2).strip()
+                    if current == "Main Flow":
+                        flow_lines = [field.group(2)] if field.group(2).strip() else []
+                    last = j
+                    j += 1
+                    continue
+                if current == "Main Flow" and not candidate:
+                    j += 1  # Blank lines inside the steps; the use case ends at its last step
+                    continue
+                if (current == "Main Flow" and not candidate.startswith(("**", "```", "|"))
+                        and not _HEADING_RE.match(candidate) and not _USE_CASE_RE.match(candidate) and not field):
+                    flow_lines.append(candidate)
+                    last = j
+                    j += 1
+                    continue
+                break
+            if fields["Actors"] is not None and fields["Main Flow"] is not None:
+                nodes.append(UseCase(
+                    start, line_end(last), int(use_case.group(1)), use_case.group(2).strip(),
+                    fields["Actors"], fields["Preconditions"], "\n".join(l.strip() for l in flow_lines).strip(),
+                ))
+                i = last + 1
+                continue
+
+        if stripped.startswith("|"):
+            j = i
+            rows = []
+            while j < count and lines[j].strip().startswith("|"):
+                cells = [cell.strip() for cell in lines[j].strip().strip("|").split("|")]
+                if not all(re.fullmatch(r":?-+:?", cell) for cell in cells if cell):
+                    rows.append(cells)
+                j += 1
+            nodes.append(Table(start, line_end(j - 1), rows))
+            i = j
+            continue
+
+        if stripped:
+            nodes.append(Text(start, line_end(i)))
+        i += 1
+
+    # Attach each use case to a Mermaid block that directly follows it
+    for current, following in zip(nodes, nodes[1:]):
+        if current.kind == "use_case" and following.kind == "mermaid":
+            current.diagram = following
+    return ReportDocument(text, nodes)
@@ -0,0 +1,254 @@
+"""
+Resilient Model Calls
+=====================
+
+Shared retry/backoff/deadline handling and a process-wide circuit breaker for
+Gemini calls. Errors are classified (overloaded, rate limit, timeout, server,
+client) and each class has its own retry policy. When the breaker is open,
+calls fail fast with CircuitOpenError instead of adding load to an overloaded
+quota.
+"""
+
+import random
+import threading
+import time
+
+import cancellation
+from config import (
+    LLM_CIRCUIT_FAILURE_THRESHOLD,
+    LLM_CIRCUIT_RECOVERY_SECONDS,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker rejects a call"""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a call cannot finish before its deadline"""
+
+
+class CapacityTimeoutError(DeadlineExceededError):
+    """Raised when the deadline passes while waiting for local admission (scheduler.py).
+
+    The model was never called, so this is neither retried nor counted
+    against the circuit breaker.
+    """
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts, base_delay, max_delay):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given (0-based) retry"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+# Per error class retry policies. "client" errors (bad request, auth, safety
+# blocks) are never retried and never trip the breaker.
+ERROR_POLICIES = {
+    "overloaded": RetryPolicy(max_attempts=4, base_delay=2.0, max_delay=30.0),
+    "rate_limit": RetryPolicy(max_attempts=5, base_delay=4.0, max_delay=60.0),
+    "timeout": RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=10.0),
+    "server": RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=15.0),
+    "client": RetryPolicy(max_attempts=1, base_delay=0.0, max_delay=0.0),
+}
+TRANSIENT_ERRORS = {"overloaded", "rate_limit", "timeout", "server"}
+
+
+def classify_error(exc):
+    """Map an exception from the Gemini SDK to an error class"""
+    try:
+        from google.api_core import exceptions as gexc
+
+        if isinstance(exc, gexc.ServiceUnavailable):
+            return "overloaded"
+        if isinstance(exc, (gexc.ResourceExhausted, gexc.TooManyRequests)):
+            return "rate_limit"
+        if isinstance(exc, (gexc.DeadlineExceeded, gexc.GatewayTimeout)):
+            return "timeout"
+        if isinstance(exc, gexc.ServerError):
+            return "server"
+        if isinstance(exc, gexc.ClientError):
+            return "client"
+    except ImportError:
+        pass
+    if isinstance(exc, (TimeoutError, DeadlineExceededError)):
+        return "timeout"
+    if isinstance(exc, ConnectionError):
+        return "server"
+    message = str(exc).lower()
+    if "503" in message or "overloaded" in message or "unavailable" in message:
+        return "overloaded"
+    if "429" in message or "quota" in message or "rate limit" in message or "resource exhausted" in message:
+        return "rate_limit"
+    if "504" in message or "timed out" in message or "timeout" in message or "deadline" in message:
+        return "timeout"
+    if "500" in message or "internal" in message:
+        return "server"
+    return "client"
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive transient failures -> half-open after a cool-down"""
+
+    def __init__(self, failure_threshold=LLM_CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_timeout=LLM_CIRCUIT_RECOVERY_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._half_open_probe = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.recovery_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError unless the call may proceed; True if the call is the half-open probe"""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return False
+            if state == "half_open" and not self._half_open_probe:
+                self._half_open_probe = True  # Let exactly one probe through
+                return True
+            retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+            raise CircuitOpenError(
+                f"Gemini calls are paused after repeated failures; retry in {retry_in:.0f}s"
+            )
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._half_open_probe = False
+
+    def record_failure(self, error_class):
+        if error_class not in TRANSIENT_ERRORS:
+            with self._lock:
+                self._half_open_probe = False
+            return
+        with self._lock:
+            self._failures += 1
+            if self._half_open_probe or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._half_open_probe = False
+
+    def release_probe(self):
+        """The probe ended without an outcome (cancelled): let the next call probe instead"""
+        with self._lock:
+            self._half_open_probe = False
+
+    def reset(self):
+        self.record_success()
+
+
+# Shared by every Gemini caller in the process
+breaker = CircuitBreaker()
+
+
+def _retry_delay(exc, attempts, policies, circuit, deadline, probe=False):
+    """Record a failed attempt; return (error_class, delay), or None if it must not be retried"""
+    if isinstance(exc, (cancellation.JobCancelledError, CapacityTimeoutError)):
+        # Abandoned work and our own queueing are neither retried nor counted against the breaker
+        if probe:
+            circuit.release_probe()
+        return None
+    error_class = classify_error(exc)
+    circuit.record_failure(error_class)
+    policy = policies.get(error_class, policies["client"])
+    attempts[error_class] = attempts.get(error_class, 0) + 1
+    if attempts[error_class] >= policy.max_attempts:
+        return None
+    delay = policy.backoff(attempts[error_class] - 1)
+    if deadline is not None and time.monotonic() + delay >= deadline:
+        return None
+    return error_class, delay
+
+
+def call_with_resilience(fn, deadline=None, policies=None, circuit=None, on_retry=None, sleep=cancellation.sleep):
+    """Call fn() with per-error-class retries, jittered backoff and the circuit breaker.
+
+    deadline is an absolute time.monotonic() value; a retry is only attempted
+    if its backoff still ends before the deadline. Use remaining_time(deadline)
+    inside fn to bound the request itself. on_retry(retry_number, error_class,
+    exc, delay) is called before each backoff sleep. A cancelled job
+    (cancellation.current_token()) stops before the next attempt.
+    """
+    policies = policies or ERROR_POLICIES
+    circuit = circuit or breaker
+    attempts = {}
+    retries = 0
+    while True:
+        cancellation.check()
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceededError("Deadline reached before the model call could start")
+        probe = circuit.before_call()
+        try:
+            result = fn()
+        except Exception as e:
+            retry = _retry_delay(e, attempts, policies, circuit, deadline, probe)
+            if retry is None:
+                raise
+            retries += 1
+            if on_retry:
+                on_retry(retries, retry[0], e, retry[1])
+            sleep(retry[1])
+            continue
+        except BaseException:
+            # asyncio.CancelledError, Streamlit's stop/rerun exceptions: no outcome to record
+            if probe:
+                circuit.release_probe()
+            raise
+        circuit.record_success()
+        return result
+
+
+async def call_with_resilience_async(fn, deadline=None, policies=None, circuit=None, on_retry=None, sleep=cancellation.sleep_async):
+    """Async variant of call_with_resilience: awaits fn() and backs off without blocking the loop"""
+    policies = policies or ERROR_POLICIES
+    circuit = circuit or breaker
+    attempts = {}
+    retries = 0
+    while True:
+        cancellation.check()
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceededError("Deadline reached before the model call could start")
+        probe = circuit.before_call()
+        try:
+            result = await fn()
+        except Exception as e:
+            retry = _retry_delay(e, attempts, policies, circuit, deadline, probe)
+            if retry is None:
+                raise
+            retries += 1
+            if on_retry:
+                on_retry(retries, retry[0], e, retry[1])
+            await sleep(retry[1])
+            continue
+        except BaseException:
+            if probe:
+                circuit.release_probe()
+            raise
+        circuit.record_success()
+        return result
+
+
+def remaining_time(deadline):
+    """Seconds left until an absolute monotonic deadline (None if unbounded)"""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
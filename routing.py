@@ -0,0 +1,87 @@
+"""
+Per-Task Model Routing
+======================
+
+Resolves each task (classify, use-case diagram, report, schema, mockup HTML,
+...) to a Gemini model and generation config from MODEL_ROUTES in config.py.
+Observed call latencies are tracked per model and task; when the expected
+latency of the primary model would exceed the task's latency budget, the call
+is routed to the faster fallback tier instead.
+"""
+
+import threading
+import time
+
+from config import DEFAULT_MODEL_ROUTE, MODEL_ROUTES
+
+# Weight of the newest observation in the latency moving average
+LATENCY_EWMA_ALPHA = 0.3
+# Estimates older than this are ignored, so a slow primary model gets probed again
+LATENCY_STALE_SECONDS = 120
+
+_lock = threading.Lock()
+_models = {}
+_latency = {}
+
+
+def route_for(task):
+    return MODEL_ROUTES.get(task, DEFAULT_MODEL_ROUTE)
+
+
+def _generation_config(route):
+    config = dict(route.get("generation_config") or {})
+    if route.get("max_output_tokens"):
+        config["max_output_tokens"] = route["max_output_tokens"]
+    return config
+
+
+def get_model(model_name, generation_config=None):
+    """Cached GenerativeModel instance for a model name and generation config"""
+    import google.generativeai as genai
+
+    key = (model_name, tuple(sorted((generation_config or {}).items())))
+    with _lock:
+        if key not in _models:
+            _models[key] = genai.GenerativeModel(model_name, generation_config=generation_config or None)
+        return _models[key]
+
+
+def expected_latency(model_name, task):
+    """Moving-average latency of recent calls, or None if unknown/stale"""
+    with _lock:
+        entry = _latency.get((model_name, task))
+    if entry is None or time.monotonic() - entry[1] > LATENCY_STALE_SECONDS:
+        return None
+    return entry[0]
+
+
+def observe_latency(model_name, task, seconds):
+    with _lock:
+        previous = _latency.get((model_name, task))
+        if previous is not None and time.monotonic() - previous[1] <= LATENCY_STALE_SECONDS:
+            seconds = LATENCY_EWMA_ALPHA * seconds + (1 - LATENCY_EWMA_ALPHA) * previous[0]
+        _latency[(model_name, task)] = (seconds, time.monotonic())
+
+
+def select(task):
+    """Return (model, model_name, fell_back) for a task"""
+    route = route_for(task)
+    model_name = route["model"]
+    fell_back = False
+    fallback = route.get("fallback")
+    if fallback and fallback != model_name:
+        expected = expected_latency(model_name, task)
+        if expected is not None and expected > route["latency_budget"]:
+            model_name = fallback
+            fell_back = True
+    return get_model(model_name, _generation_config(route)), model_name, fell_back
+
+
+def latency_table():
+    """Observed latency per (model, task) for display"""
+    with _lock:
+        return [
+            {"model": model_name, "task": task, "ewma_s": round(entry[0], 2),
+             "budget_s": route_for(task)["latency_budget"]}
+            for (model_name, task), entry in sorted(_latency.items())
+        ]
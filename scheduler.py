@@ -0,0 +1,331 @@
+"""
+LLM Admission Scheduler
+=======================
+
+Process-wide admission control for Gemini calls. Every call made through
+llm.generate_content waits here for a slot that fits the requests-per-minute,
+tokens-per-minute and concurrency budgets. Waiting requests are ordered by
+priority (interactive > batch > speculative, with aging) and, within a
+priority, by the session that was served least recently, so one large report
+cannot starve other analysts.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import cancellation
+from config import (
+    LLM_MAX_CONCURRENT,
+    LLM_PRIORITY_AGING_SECONDS,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+)
+from resilience import CapacityTimeoutError
+
+PRIORITIES = {"interactive": 0, "batch": 1, "speculative": 2}
+WINDOW_SECONDS = 60.0
+
+_context = contextvars.ContextVar("llm_request_context", default={})
+
+
+@contextmanager
+def request_context(session_id=None, priority=None, on_wait=None):
+    """Attribute model calls made inside the block to a session/priority.
+
+    on_wait(position) is called whenever the queue position of a waiting
+    call changes (1 = next in line).
+    """
+    values = dict(_context.get())
+    if session_id is not None:
+        values["session_id"] = session_id
+    if priority is not None:
+        values["priority"] = priority
+    if on_wait is not None:
+        values["on_wait"] = on_wait
+    token = _context.set(values)
+    try:
+        yield values
+    finally:
+        _context.reset(token)
+
+
+def current_context():
+    return _context.get()
+
+
+class Ticket:
+    def __init__(self, seq, session_id, priority, tokens):
+        self.seq = seq
+        self.session_id = session_id
+        self.priority = PRIORITIES.get(priority, PRIORITIES["batch"])
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.usage = None  # [timestamp, tokens] entry in the token window once granted
+
+
+class LLMScheduler:
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 max_concurrent=LLM_MAX_CONCURRENT, aging_seconds=LLM_PRIORITY_AGING_SECONDS):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrent = max_concurrent
+        self.aging_seconds = aging_seconds
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = []
+        self._requests = deque()  # grant timestamps
+        self._token_usage = deque()  # [timestamp, tokens]
+        self._in_flight = 0
+        self._last_served = {}
+        self._async_waiters = {}  # ticket -> (loop, future) for acquire_async callers
+        self._version = 0  # Bumped whenever the queue or the grants change
+        self._positions = (None, {})  # (version, {ticket: 1-based position}) computed once per change
+
+    # --- ordering ---
+    def _effective_priority(self, ticket, now):
+        if not self.aging_seconds:
+            return ticket.priority
+        return ticket.priority - int((now - ticket.enqueued_at) / self.aging_seconds)
+
+    def _order(self):
+        """Predicted service order of the waiting tickets.
+
+        One heap entry per session, keyed by its best ticket; serving a
+        session pushes it back with its next ticket, so the prediction is
+        O(n log n) rather than a min() over all waiters per position.
+        """
+        now = time.monotonic()
+        sessions = {}
+        for ticket in self._waiting:
+            sessions.setdefault(ticket.session_id, []).append((self._effective_priority(ticket, now), ticket.seq, ticket))
+        heap = []
+        for session_id, tickets in sessions.items():
+            heapq.heapify(tickets)
+            priority, seq, _ = tickets[0]
+            heap.append((priority, self._last_served.get(session_id, 0.0), seq, session_id))
+        heapq.heapify(heap)
+        order = []
+        while heap:
+            _, _, _, session_id = heapq.heappop(heap)
+            tickets = sessions[session_id]
+            order.append(heapq.heappop(tickets)[2])
+            if tickets:
+                # Round-robin: the session just served goes to the back of its priority class
+                priority, seq, _ = tickets[0]
+                heapq.heappush(heap, (priority, now + len(order), seq, session_id))
+        return order
+
+    def _position(self, ticket):
+        """1-based predicted position of a waiting ticket; the order is computed once per queue change"""
+        version, positions = self._positions
+        if version != self._version:
+            positions = {waiting: position for position, waiting in enumerate(self._order(), 1)}
+            self._positions = (self._version, positions)
+        return positions[ticket]
+
+    def _head(self):
+        if not self._waiting:
+            return None
+        now = time.monotonic()
+        return min(
+            self._waiting,
+            key=lambda t: (self._effective_priority(t, now), self._last_served.get(t.session_id, 0.0), t.seq),
+        )
+
+    def _notify(self):
+        """Wake waiters after a grant/release (caller holds the lock).
+
+        Threads all re-check; async waiters are only woken when they are the
+        new head or show their queue position, so hundreds of waiting
+        coroutines do not all spin on every release.
+        """
+        self._version += 1
+        self._cond.notify_all()
+        head = self._head()
+        for ticket, (loop, future, on_wait) in list(self._async_waiters.items()):
+            if ticket is head or on_wait is not None:
+                del self._async_waiters[ticket]
+                loop.call_soon_threadsafe(_wake, future)
+
+    # --- budgets ---
+    def _expire(self, now):
+        while self._requests and now - self._requests[0] >= WINDOW_SECONDS:
+            self._requests.popleft()
+        while self._token_usage and now - self._token_usage[0][0] >= WINDOW_SECONDS:
+            self._token_usage.popleft()
+
+    def _capacity_wait(self, tokens, now):
+        """Seconds until a request of this size fits the budgets (0 = now, None = on release).
+
+        A request larger than the whole tokens-per-minute budget waits until
+        the window is empty; it is then admitted alone and charged in full,
+        so later requests wait for it to leave the window.
+        """
+        self._expire(now)
+        if self._in_flight >= self.max_concurrent:
+            return None
+        wait = 0.0
+        if len(self._requests) >= self.requests_per_minute:
+            wait = max(wait, self._requests[0] + WINDOW_SECONDS - now)
+        used = sum(entry[1] for entry in self._token_usage)
+        tokens = min(tokens, self.tokens_per_minute)
+        if used and used + tokens > self.tokens_per_minute:
+            # Wait until enough old usage leaves the window
+            freed = 0
+            for timestamp, amount in self._token_usage:
+                freed += amount
+                if used - freed + tokens <= self.tokens_per_minute:
+                    wait = max(wait, timestamp + WINDOW_SECONDS - now)
+                    break
+        return wait
+
+    def _grant(self, ticket, now):
+        self._waiting.remove(ticket)
+        self._requests.append(now)
+        ticket.usage = [now, ticket.tokens]
+        self._token_usage.append(ticket.usage)
+        self._in_flight += 1
+        self._last_served[ticket.session_id] = now
+
+    # --- public API ---
+    def acquire(self, session_id="default", priority="batch", tokens=0, deadline=None, on_wait=None):
+        """Block until the call may start; returns a ticket to pass to release().
+
+        Raises JobCancelledError as soon as the current job is cancelled.
+        """
+        with self._cond:
+            ticket = Ticket(next(self._seq), session_id, priority, tokens)
+            self._waiting.append(ticket)
+            self._version += 1
+        token = cancellation.current_token()
+        unregister = token.on_cancel(self._wake_all) if token is not None else None
+        last_position = None
+        try:
+            while True:
+                with self._cond:
+                    if token is not None:
+                        token.check()
+                    now = time.monotonic()
+                    wait = None
+                    if self._head() is ticket:
+                        wait = self._capacity_wait(ticket.tokens, now)
+                        if wait == 0:
+                            self._grant(ticket, now)
+                            self._notify()
+                            return ticket
+                    if deadline is not None and now >= deadline:
+                        raise CapacityTimeoutError("Deadline reached while waiting for model capacity")
+                    position = self._position(ticket) if on_wait else None
+                    if on_wait is None or position == last_position:
+                        timeout = 1.0 if wait is None else min(wait, 1.0)
+                        if deadline is not None:
+                            timeout = min(timeout, max(0.0, deadline - now))
+                        self._cond.wait(timeout)
+                        continue
+                last_position = position
+                on_wait(position)  # Outside the lock; may touch the UI
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                self._notify()
+            raise
+        finally:
+            if unregister is not None:
+                unregister()
+
+    def _wake_all(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    async def acquire_async(self, session_id="default", priority="batch", tokens=0, deadline=None, on_wait=None):
+        """Like acquire(), but waits without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            ticket = Ticket(next(self._seq), session_id, priority, tokens)
+            self._waiting.append(ticket)
+            self._version += 1
+        last_position = None
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    wait = None
+                    if self._head() is ticket:
+                        wait = self._capacity_wait(ticket.tokens, now)
+                        if wait == 0:
+                            self._grant(ticket, now)
+                            self._notify()
+                            return ticket
+                    if deadline is not None and now >= deadline:
+                        raise CapacityTimeoutError("Deadline reached while waiting for model capacity")
+                    position = self._position(ticket) if on_wait else None
+                    timeout = 1.0 if wait is None else min(wait, 1.0)
+                    if deadline is not None:
+                        timeout = min(timeout, max(0.0, deadline - now))
+                    woken = loop.create_future()
+                    self._async_waiters[ticket] = (loop, woken, on_wait)
+                if on_wait is not None and position != last_position:
+                    last_position = position
+                    on_wait(position)
+                await asyncio.wait([woken], timeout=timeout)
+                with self._cond:
+                    self._async_waiters.pop(ticket, None)
+        except BaseException:
+            with self._cond:
+                self._async_waiters.pop(ticket, None)
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                self._notify()
+            raise
+
+    def release(self, ticket, actual_tokens=None):
+        """Free the concurrency slot and correct the token reservation"""
+        with self._cond:
+            self._in_flight -= 1
+            if actual_tokens is not None and ticket.usage is not None:
+                ticket.usage[1] = actual_tokens
+            self._notify()
+
+    @contextmanager
+    def slot(self, session_id="default", priority="batch", tokens=0, deadline=None, on_wait=None):
+        ticket = self.acquire(session_id, priority, tokens, deadline, on_wait)
+        result = {"tokens": None}
+        try:
+            yield result
+        finally:
+            self.release(ticket, result["tokens"])
+
+    def queue_position(self, session_id):
+        """1-based position of the session's next waiting call, or 0 if none is waiting"""
+        with self._cond:
+            for position, ticket in enumerate(self._order(), 1):
+                if ticket.session_id == session_id:
+                    return position
+        return 0
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._expire(now)
+            return {
+                "waiting": len(self._waiting),
+                "in_flight": self._in_flight,
+                "requests_last_minute": len(self._requests),
+                "tokens_last_minute": sum(entry[1] for entry in self._token_usage),
+            }
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Shared by every session in the process
+scheduler = LLMScheduler()
@@ -0,0 +1,117 @@
+"""
+Single-Flight Request Coalescing
+================================
+
+When several sessions submit the same (normalized) input at the same time,
+only the first call does the work; the others wait for it and receive the
+same result. Deduplicated calls are counted per flight group and recorded as
+telemetry cache hits.
+
+A waiting follower still honours its own cancellation token and deadline. If
+the leader was stopped rather than failed (its job was cancelled, or its
+session's Streamlit stop/rerun or an asyncio cancellation interrupted it), the
+followers do not inherit that: one of them runs the work again.
+"""
+
+import hashlib
+import re
+import threading
+
+import cancellation
+import telemetry
+
+# Seconds between checks of a waiting follower's cancellation token
+WAIT_INTERVAL = 0.1
+
+
+def normalize_input(text):
+    """Case- and whitespace-insensitive form of a business problem / BRD"""
+    return re.sub(r"\s+", " ", (text or "")).strip().lower()
+
+
+def make_key(*parts):
+    joined = "\x1f".join(normalize_input(str(part)) for part in parts)
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.deduplicated = 0
+
+    def do(self, key, fn):
+        """Run fn() once per in-flight key. Returns (result, shared)."""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is not None:
+                    call.waiters += 1
+                    self.deduplicated += 1
+                    leader = False
+                else:
+                    call = self._calls[key] = _Call()
+                    self.executed += 1
+                    leader = True
+            if leader:
+                break
+            with telemetry.span(f"singleflight.{self.name}", role="follower") as wait_span:
+                wait_span.cache_hit = True
+                self._wait(call)
+            if call.error is None:
+                return call.result, True
+            if isinstance(call.error, Exception) and not isinstance(call.error, cancellation.JobCancelledError):
+                raise call.error
+            # The leader was stopped or cancelled, not failed: run it again (or join whoever does)
+        with telemetry.span(f"singleflight.{self.name}", role="leader") as lead_span:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                lead_span.set(followers=call.waiters)
+                call.done.set()
+        return call.result, False
+
+    @staticmethod
+    def _wait(call):
+        """Wait for the leader, raising JobCancelledError if this follower's own job is cancelled"""
+        token = cancellation.current_token()
+        if token is None:
+            call.done.wait()
+            return
+        while not call.done.wait(WAIT_INTERVAL):
+            token.check()  # Also cancelled at the token's deadline
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {"executed": self.executed, "deduplicated": self.deduplicated, "in_flight": len(self._calls)}
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def flight(name):
+    """Process-wide flight group (survives Streamlit script reruns)"""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
@@ -0,0 +1,333 @@
+"""
+Stage Telemetry
+===============
+
+Lightweight tracing for the dashboard and the mockup agent. Every stage is
+wrapped in a span that records its duration plus optional LLM token counts,
+retries and cache hits. Finished spans are written to a size-rotated JSON-lines log
+and aggregated into Prometheus text metrics (a file rewritten by a background
+thread, and an optional /metrics endpoint).
+With MEMORY_PROFILE_ENABLED, selected spans are also memory-profiled
+(memory_profile.py).
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import memory_profile
+from config import (
+    TELEMETRY_ENABLED,
+    TELEMETRY_LOG_BACKUPS,
+    TELEMETRY_LOG_MAX_BYTES,
+    TELEMETRY_LOG_PATH,
+    TELEMETRY_PROMETHEUS_INTERVAL,
+    TELEMETRY_PROMETHEUS_PATH,
+    TELEMETRY_PROMETHEUS_PORT,
+)
+
+# Histogram buckets (seconds) for stage durations
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RECENT_SPAN_LIMIT = 200
+
+_lock = threading.Lock()
+_current_span = contextvars.ContextVar("current_span", default=None)
+_stage_stats = {}
+_recent_spans = []
+_prometheus_pending = threading.Event()
+_prometheus_writer = None
+_metrics_server = None
+
+
+class Span:
+    """A single timed stage"""
+
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = dict(attrs)
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.retries = 0
+        self.cache_hit = False
+        self.status = "ok"
+        self.error = None
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def record_usage(self, response):
+        """Add prompt/response token counts from a Gemini response"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        self.prompt_tokens += getattr(usage, "prompt_token_count", 0) or 0
+        self.response_tokens += getattr(usage, "candidates_token_count", 0) or 0
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3),
+            "prompt_tokens": self.prompt_tokens,
+            "response_tokens": self.response_tokens,
+            "retries": self.retries,
+            "cache_hit": self.cache_hit,
+            "status": self.status,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a stage. Nested spans share the trace id of their parent."""
+    with memory_profile.stage(name) as memory, _span(name, **attrs) as current:
+        if memory is not None:
+            memory.span = current
+        yield current
+
+
+@contextmanager
+def _span(name, **attrs):
+    if not TELEMETRY_ENABLED:
+        yield Span(name, **attrs)  # Not recorded anywhere
+        return
+    current = Span(name, parent=_current_span.get(), **attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - current._start
+        _current_span.reset(token)
+        _finish(current)
+
+
+def current_span():
+    """Return the innermost active span, or None"""
+    return _current_span.get()
+
+
+def _finish(finished):
+    record = finished.to_dict()
+    with _lock:
+        stats = _stage_stats.setdefault(finished.name, {
+            "count": 0, "errors": 0, "duration_sum": 0.0,
+            "buckets": [0] * len(DURATION_BUCKETS),
+            "prompt_tokens": 0, "response_tokens": 0,
+            "retries": 0, "cache_hits": 0,
+        })
+        stats["count"] += 1
+        stats["errors"] += finished.status != "ok"
+        stats["duration_sum"] += finished.duration
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if finished.duration <= bound:
+                stats["buckets"][i] += 1
+        stats["prompt_tokens"] += finished.prompt_tokens
+        stats["response_tokens"] += finished.response_tokens
+        stats["retries"] += finished.retries
+        stats["cache_hits"] += int(finished.cache_hit)
+        _recent_spans.append(record)
+        del _recent_spans[:-RECENT_SPAN_LIMIT]
+    _write_jsonl(record)
+    _schedule_prometheus_write()
+
+
+def _write_jsonl(record):
+    if not TELEMETRY_LOG_PATH:
+        return
+    try:
+        os.makedirs(os.path.dirname(TELEMETRY_LOG_PATH) or ".", exist_ok=True)
+        line = json.dumps(record, default=str)
+        with _lock:
+            with open(TELEMETRY_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                size = f.tell()
+            if TELEMETRY_LOG_MAX_BYTES and size >= TELEMETRY_LOG_MAX_BYTES:
+                _rotate_log(TELEMETRY_LOG_PATH, TELEMETRY_LOG_BACKUPS)
+    except OSError:
+        pass  # Telemetry must never break the app
+
+
+def _rotate_log(path, backups):
+    """spans.jsonl -> spans.jsonl.1 -> spans.jsonl.2 ...; files beyond `backups` are dropped"""
+    if backups <= 0:
+        os.remove(path)
+        return
+    for index in range(backups - 1, 0, -1):
+        if os.path.exists(f"{path}.{index}"):
+            os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def _schedule_prometheus_write():
+    """Have the background writer refresh the Prometheus file (no file I/O on the span's thread)"""
+    global _prometheus_writer
+    if not TELEMETRY_PROMETHEUS_PATH:
+        return
+    _prometheus_pending.set()
+    if _prometheus_writer is None:
+        with _lock:
+            if _prometheus_writer is None:
+                _prometheus_writer = threading.Thread(target=_prometheus_loop, name="telemetry-prometheus", daemon=True)
+                _prometheus_writer.start()
+
+
+def _prometheus_loop():
+    while True:
+        _prometheus_pending.wait()
+        _prometheus_pending.clear()
+        write_prometheus_file(TELEMETRY_PROMETHEUS_PATH)
+        time.sleep(TELEMETRY_PROMETHEUS_INTERVAL)
+
+
+if TELEMETRY_ENABLED and TELEMETRY_PROMETHEUS_PATH:
+    atexit.register(lambda: write_prometheus_file(TELEMETRY_PROMETHEUS_PATH))
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text():
+    """Render aggregated stage metrics in the Prometheus text format"""
+    with _lock:
+        stats = {name: dict(s, buckets=list(s["buckets"])) for name, s in _stage_stats.items()}
+    lines = [
+        "# HELP ba_stage_duration_seconds Duration of pipeline stages",
+        "# TYPE ba_stage_duration_seconds histogram",
+    ]
+    for name, s in sorted(stats.items()):
+        stage = _label(name)
+        for bound, count in zip(DURATION_BUCKETS, s["buckets"]):
+            lines.append(f'ba_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'ba_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {s["count"]}')
+        lines.append(f'ba_stage_duration_seconds_sum{{stage="{stage}"}} {s["duration_sum"]:.6f}')
+        lines.append(f'ba_stage_duration_seconds_count{{stage="{stage}"}} {s["count"]}')
+    counters = [
+        ("ba_stage_errors_total", "Stages that raised", "errors"),
+        ("ba_llm_prompt_tokens_total", "Prompt tokens sent to the model", "prompt_tokens"),
+        ("ba_llm_response_tokens_total", "Response tokens received from the model", "response_tokens"),
+        ("ba_stage_retries_total", "Retries performed inside a stage", "retries"),
+        ("ba_stage_cache_hits_total", "Stages served from a cache", "cache_hits"),
+    ]
+    for metric, help_text, key in counters:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, s in sorted(stats.items()):
+            lines.append(f'{metric}{{stage="{_label(name)}"}} {s[key]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(path=TELEMETRY_PROMETHEUS_PATH):
+    """Atomically write the Prometheus text metrics to a file"""
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=TELEMETRY_PROMETHEUS_PORT):
+    """Serve /metrics on a daemon thread (once per process). Returns the server or None."""
+    global _metrics_server
+    if not port:
+        return None
+    with _lock:
+        if _metrics_server is not None:
+            return _metrics_server
+        try:
+            _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        except OSError as e:
+            print(f"✗ Could not start metrics server on port {port}: {e}")
+            return None
+    threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    return _metrics_server
+
+
+def stage_summary():
+    """Per-stage aggregates for display"""
+    with _lock:
+        rows = []
+        for name, s in sorted(_stage_stats.items()):
+            rows.append({
+                "stage": name,
+                "calls": s["count"],
+                "avg_ms": round(s["duration_sum"] / s["count"] * 1000, 1) if s["count"] else 0.0,
+                "errors": s["errors"],
+                "prompt_tokens": s["prompt_tokens"],
+                "response_tokens": s["response_tokens"],
+                "retries": s["retries"],
+                "cache_hits": s["cache_hits"],
+            })
+        return rows
+
+
+def recent_spans(limit=50):
+    with _lock:
+        return list(_recent_spans[-limit:])
+
+
+def reset():
+    """Clear in-memory aggregates (used by benchmarks)"""
+    with _lock:
+        _stage_stats.clear()
+        _recent_spans.clear()
+
+
+def render_sidebar_panel():
+    """Optional Streamlit sidebar panel with per-stage timings"""
+    import streamlit as st
+
+    with st.sidebar.expander("Stage telemetry", expanded=False):
+        rows = stage_summary()
+        if not rows:
+            st.caption("No spans recorded yet.")
+            return
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        last = recent_spans(10)
+        if last:
+            st.caption("Most recent spans")
+            st.dataframe(
+                [{"stage": r["name"], "ms": r["duration_ms"], "status": r["status"]} for r in reversed(last)],
+                use_container_width=True,
+                hide_index=True,
+            )
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Project modules are imported by name, as the app and the benchmarks do
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "Mockup_design"))
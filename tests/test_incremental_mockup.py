@@ -0,0 +1,186 @@
+import incremental_mockup
+from incremental_mockup import component_spans, diff_schemas, plan, splice
+
+
+def outer(html, name):
+    start, end, _ = component_spans(html)[name]
+    return html[start:end]
+
+
+def inner_end(html, name):
+    return html[component_spans(html)[name][2]:]
+
+
+SCHEMA = [
+    {"type": "rectangle", "name": "Page", "x": 0, "y": 0, "width": 800, "height": 600},
+    {"type": "rectangle", "name": "Card", "parent": "Page", "x": 10, "y": 10, "width": 300, "height": 200},
+    {"type": "text", "name": "Title", "parent": "Card", "content": "Accounts"},
+    {"type": "button", "name": "Pay", "parent": "Card", "content": "Pay"},
+    {"type": "input", "name": "Amount", "parent": "Page"},
+]
+
+PAGE = (
+    "<!DOCTYPE html>\n<html><head><style>.card { color: red; }</style></head>\n<body>\n"
+    '<main data-component="Page">\n'
+    '  <section data-component="Card">\n'
+    '    <h2 data-component="Title">Accounts</h2>\n'
+    '    <button data-component="Pay">Pay</button>\n'
+    "  </section>\n"
+    '  <input data-component="Amount" name="amount">\n'
+    "</main>\n"
+    "</body>\n</html>\n"
+)
+
+
+def changed(schema, name, **values):
+    return [dict(element, **values) if element["name"] == name else dict(element) for element in schema]
+
+
+def without(schema, *names):
+    return [dict(element) for element in schema if element["name"] not in names]
+
+
+# --- component_spans ---
+
+def test_spans_of_nested_elements_cover_their_outer_html():
+    assert outer(PAGE, "Title") == '<h2 data-component="Title">Accounts</h2>'
+    assert outer(PAGE, "Card").startswith('<section data-component="Card">')
+    assert outer(PAGE, "Card").endswith("</section>")
+    assert inner_end(PAGE, "Card").startswith("</section>")
+    assert inner_end(PAGE, "Page").startswith("</main>")
+
+
+def test_spans_of_void_and_self_closing_elements():
+    html = '<form data-component="Form"><input data-component="Name" name="n"><br data-component="Gap"/></form>'
+    assert outer(html, "Name") == '<input data-component="Name" name="n">'
+    assert outer(html, "Gap") == '<br data-component="Gap"/>'
+    start, end, inner = component_spans(html)["Name"]
+    assert end == inner  # Nothing can be inserted inside a void element
+    assert outer(html, "Form") == html
+
+
+def test_implicitly_closed_element_ends_at_its_ancestors_end_tag():
+    html = '<div data-component="Box"><p data-component="Note">text</div>'
+    assert outer(html, "Note") == '<p data-component="Note">text'
+    assert outer(html, "Box") == html
+
+
+def test_implicitly_closed_siblings_do_not_overlap():
+    html = '<ul data-component="List"><li data-component="A">one<li data-component="B">two</ul>'
+    assert outer(html, "A") == '<li data-component="A">one'
+    assert outer(html, "B") == '<li data-component="B">two'
+    assert outer(html, "List") == html
+
+
+def test_spans_are_offsets_into_multiline_pages():
+    spans = component_spans(PAGE)
+    for name in ("Page", "Card", "Title", "Pay", "Amount"):
+        start, _, _ = spans[name]
+        assert PAGE[start:].startswith("<") and f'data-component="{name}"' in PAGE[start:PAGE.index(">", start)]
+
+
+# --- diff_schemas / plan ---
+
+def test_geometry_changes_are_not_component_changes():
+    moved = changed(SCHEMA, "Card", x=99, width=1)
+    diff = diff_schemas(SCHEMA, moved)
+    assert not diff["changed"] and not diff["added"] and not diff["removed"]
+    assert plan(SCHEMA, PAGE, moved)["mode"] == "reuse"
+
+
+def test_moving_a_component_to_another_parent_is_a_remove_and_an_add():
+    diff = diff_schemas(SCHEMA, changed(SCHEMA, "Pay", parent="Page"))
+    assert [element["name"] for element in diff["added"]] == ["Pay"]
+    assert [element["name"] for element in diff["removed"]] == ["Pay"]
+
+
+def test_plan_requests_only_the_outermost_changed_component():
+    new = changed(changed(SCHEMA, "Card", content="Balances"), "Title", content="Balances")
+    planned = plan(SCHEMA, PAGE, new, max_changed=1.0)
+    assert planned["mode"] == "splice"
+    assert [root["name"] for root in planned["roots"]] == ["Card"]
+
+
+def test_removed_component_inside_a_replaced_one_is_not_cut_separately():
+    new = without(changed(SCHEMA, "Card", content="Balances"), "Title")
+    planned = plan(SCHEMA, PAGE, new, max_changed=1.0)
+    assert [root["name"] for root in planned["roots"]] == ["Card"]
+    assert planned["removed"] == []
+
+
+def test_removed_component_inside_a_removed_one_is_not_cut_separately():
+    planned = plan(SCHEMA, PAGE, without(SCHEMA, "Card", "Title", "Pay"), max_changed=1.0)
+    assert [element["name"] for element in planned["removed"]] == ["Card"]
+
+
+def test_plan_falls_back_to_a_full_page_without_markers():
+    unmarked = PAGE.replace(' data-component="Title"', "")
+    planned = plan(SCHEMA, unmarked, changed(SCHEMA, "Title", content="Balances"), max_changed=1.0)
+    assert planned["mode"] == "full"
+    assert "Title" in planned["reason"]
+
+
+def test_plan_falls_back_to_a_full_page_when_too_much_changed():
+    new = [dict(element, content="new") for element in SCHEMA]
+    assert plan(SCHEMA, PAGE, new, max_changed=0.5)["mode"] == "full"
+
+
+# --- splice ---
+
+def test_splice_replaces_a_changed_component_in_place():
+    new = changed(SCHEMA, "Title", content="Balances")
+    planned = plan(SCHEMA, PAGE, new, max_changed=1.0)
+    fragment = '<h2 data-component="Title">Balances</h2>'
+    html = splice(PAGE, planned, {"Title": fragment})
+    assert html == PAGE.replace('<h2 data-component="Title">Accounts</h2>', fragment)
+
+
+def test_splice_inserts_added_components_inside_their_parent_and_before_body_end():
+    new = [dict(element) for element in SCHEMA] + [
+        {"type": "button", "name": "Cancel", "parent": "Card", "content": "Cancel"},
+        {"type": "text", "name": "Footer"},
+    ]
+    planned = plan(SCHEMA, PAGE, new, max_changed=1.0)
+    html = splice(PAGE, planned, {
+        "Cancel": '<button data-component="Cancel">Cancel</button>',
+        "Footer": '<footer data-component="Footer">f</footer>',
+    })
+    assert '<button data-component="Cancel">Cancel</button></section>' in html
+    assert '<footer data-component="Footer">f</footer></body>' in html
+    assert html.replace('<button data-component="Cancel">Cancel</button>', "").replace(
+        '<footer data-component="Footer">f</footer>', "") == PAGE
+
+
+def test_splice_cuts_out_removed_components():
+    planned = plan(SCHEMA, PAGE, without(SCHEMA, "Amount"), max_changed=1.0)
+    html = splice(PAGE, planned, {})
+    assert "Amount" not in html
+    assert html == PAGE.replace('<input data-component="Amount" name="amount">', "")
+
+
+def test_splice_of_a_replaced_component_drops_its_removed_children():
+    new = without(changed(SCHEMA, "Card", content="Balances"), "Title")
+    planned = plan(SCHEMA, PAGE, new, max_changed=1.0)
+    fragment = '<section data-component="Card"><button data-component="Pay">Pay</button></section>'
+    html = splice(PAGE, planned, {"Card": fragment})
+    assert 'data-component="Title"' not in html
+    assert html.count('data-component="Pay"') == 1
+    assert component_spans(html).keys() == {"Page", "Card", "Pay", "Amount"}
+
+
+def test_splice_within_implicitly_closed_siblings():
+    schema = [
+        {"type": "list", "name": "List"},
+        {"type": "item", "name": "A", "parent": "List", "content": "one"},
+        {"type": "item", "name": "B", "parent": "List", "content": "two"},
+    ]
+    page = '<body><ul data-component="List"><li data-component="A">one<li data-component="B">two</ul></body>'
+    planned = plan(schema, page, changed(schema, "A", content="uno"), max_changed=1.0)
+    html = splice(page, planned, {"A": '<li data-component="A">uno</li>'})
+    assert html == '<body><ul data-component="List"><li data-component="A">uno</li><li data-component="B">two</ul></body>'
+
+
+def test_parse_fragments_wraps_unmarked_fragments_and_requires_every_name():
+    fragments = incremental_mockup.parse_fragments('```json\n{"Title": "<h2>New</h2>"}\n```', ["Title"])
+    assert fragments == {"Title": '<div data-component="Title"><h2>New</h2></div>'}
+    assert incremental_mockup.parse_fragments('{"Title": "<h2>New</h2>"}', ["Title", "Pay"]) is None
@@ -0,0 +1,130 @@
+import pytest
+
+from incremental_report import REPORT_SECTIONS, SECTION_KEYS, ReportState, problem_delta, split_report
+
+PROBLEM = (
+    "A regional credit union wants a mobile onboarding journey for new members. "
+    "Members upload identity documents and the branch team reviews them. "
+    "Approved members receive a welcome pack and a savings account. "
+    "The board tracks KPI metrics such as completion rate and time to approval."
+)
+# Only the KPI sentence changes
+KPI_EDIT = PROBLEM.replace("completion rate and time to approval", "completion rate, dropout rate and NPS")
+# A new concept: only the BRD section mentions uploads of identity documents
+BRD_EDIT = PROBLEM.replace(
+    "Members upload identity documents", "Members upload identity documents and proof of address"
+)
+
+BODIES = {
+    "stakeholder_map": "Applicants, staff, directors and the compliance office.",
+    "process_flow": "Download the app, register, get reviewed, open the account.",
+    "brd": "Requirement: members upload identity documents from the app for review.",
+    "frs": "The app captures identity documents; reviewers see a queue of uploads.",
+    "use_cases": "**Use Case 1:** Register\n**Actors:** Member\n**Main Flow:**\n1. Open the app",
+    "data_mapping": "| Data Element | Source |\n|---|---|\n| Identity document | App upload |",
+    "scope": "In scope: onboarding in the app. Out of scope: loans.",
+    "kpis": "KPI metrics: completion rate, time to approval.",
+}
+
+
+def build_report():
+    parts = ["# Business Analysis\n\nIntro text.\n\n"]
+    for spec in REPORT_SECTIONS:
+        parts.append(f"{spec['heading']}\n\n{BODIES[spec['key']]}\n\n")
+    return "".join(parts)
+
+
+def new_state():
+    return ReportState.from_report(PROBLEM, build_report())
+
+
+def rewrite(spec, problem, context):
+    return f"{spec['heading']}\n\nRewritten {spec['key']} with entirely different wording about {len(problem)}."
+
+
+def keep_wording(spec, problem, context):
+    return f"{spec['heading']}\n\n{BODIES[spec['key']]}"
+
+
+def test_split_report_finds_every_section():
+    intro, sections = split_report(build_report())
+    assert intro.startswith("# Business Analysis")
+    assert list(sections) == SECTION_KEYS
+
+
+def test_cosmetic_edits_change_nothing():
+    state = new_state()
+    assert state.plan(PROBLEM.upper().replace(". ", ".   ")) == []
+    assert problem_delta(PROBLEM, PROBLEM + " ")[0] == set()
+
+
+def test_edit_only_makes_the_relevant_section_stale():
+    assert new_state().plan(KPI_EDIT) == ["kpis"]
+
+
+def test_materially_changed_section_regenerates_its_dependents():
+    state = new_state()
+    assert state.plan(BRD_EDIT) == ["brd"]
+    summary = state.regenerate(BRD_EDIT, rewrite)
+    # frs -> use_cases, brd -> scope and kpis follow the dependency graph
+    assert summary["regenerated"] == ["brd", "frs", "use_cases", "data_mapping", "scope", "kpis"]
+    assert summary["reused"] == ["stakeholder_map", "process_flow"]
+    assert state.plan(BRD_EDIT) == []
+
+
+def test_similar_regenerated_section_does_not_cascade():
+    state = new_state()
+    summary = state.regenerate(BRD_EDIT, keep_wording)
+    assert summary["regenerated"] == ["brd"]
+
+
+def test_failed_section_keeps_its_text_and_stays_stale():
+    state = new_state()
+    before = state.sections["kpis"]
+    summary = state.regenerate(KPI_EDIT, lambda spec, problem, context: None)
+    assert summary["regenerated"] == []
+    assert summary["failed"] == ["kpis"]
+    assert "kpis" not in summary["reused"]
+    assert state.sections["kpis"] == before
+    assert state.plan(KPI_EDIT) == ["kpis"]
+    summary = state.regenerate(KPI_EDIT, rewrite)
+    assert summary["regenerated"] == ["kpis"]
+    assert summary["failed"] == []
+    assert state.plan(KPI_EDIT) == []
+
+
+def test_failed_section_is_retried_with_the_next_edit():
+    state = new_state()
+    state.regenerate(KPI_EDIT, lambda spec, problem, context: None)
+    next_edit = KPI_EDIT.replace("branch team reviews", "branch team carefully reviews")
+    assert "kpis" in state.plan(next_edit)
+
+
+def test_stopped_update_leaves_the_remaining_sections_stale():
+    state = new_state()
+    calls = []
+
+    def stop_after_brd(spec, problem, context):
+        calls.append(spec["key"])
+        if spec["key"] == "frs":
+            raise RuntimeError("job cancelled")
+        return rewrite(spec, problem, context)
+
+    summary = state.regenerate(BRD_EDIT, stop_after_brd)
+    assert calls == ["brd", "frs"]
+    assert summary["stopped"] == "job cancelled"
+    assert summary["regenerated"] == ["brd"]
+    # Still due: the stale sections and the dependents of the changed brd
+    assert summary["failed"] == ["frs", "data_mapping", "scope", "kpis"]
+    assert state.plan(BRD_EDIT) == ["frs", "data_mapping", "scope", "kpis"]
+
+
+def test_interrupted_update_is_re_raised_and_leaves_sections_stale():
+    state = new_state()
+
+    def interrupt(spec, problem, context):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        state.regenerate(KPI_EDIT, interrupt)
+    assert state.plan(KPI_EDIT) == ["kpis"]
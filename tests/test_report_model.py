@@ -0,0 +1,40 @@
+from report_model import parse_report
+
+REPORT = """# Report
+
+## 01. Stakeholder Map
+
+#1 priority is the branch team.
+#hashtag campaigns are out of scope.
+####### Not a heading either
+
+##Also text
+
+### Details
+
+**Use Case 1:** Register
+**Actors:** Member
+**Main Flow:**
+1. Open the app
+#2 step: upload documents
+
+2. Submit
+"""
+
+
+def test_headings_need_whitespace_after_the_hashes():
+    document = parse_report(REPORT)
+    assert [(heading.level, heading.title) for heading in document.headings] == [
+        (1, "Report"), (2, "01. Stakeholder Map"), (3, "Details"),
+    ]
+    assert [section.title for section in document.sections(level=2)] == ["01. Stakeholder Map"]
+
+
+def test_bare_hashes_are_an_empty_heading():
+    document = parse_report("##\ntext\n")
+    assert [(heading.level, heading.title) for heading in document.headings] == [(2, "")]
+
+
+def test_hash_lines_inside_a_main_flow_are_steps():
+    use_case = parse_report(REPORT).use_cases[0]
+    assert use_case.main_flow == "1. Open the app\n#2 step: upload documents\n2. Submit"